@@ -133,11 +133,19 @@ AUTH_USER_MODEL = 'users.User'
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        # Пользователь из claims access-токена, без запроса к БД; JWT_CLAIMS_AUTH=false —
+        # JWTAuthentication с асинхронным вариантом для AsyncAPIView, читающая пользователя из БД
+        "users.authentication.ClaimsJWTAuthentication"
+        if os.getenv("JWT_CLAIMS_AUTH", "True") == "True"
+        else "users.authentication.AsyncJWTAuthentication",
     ),
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",
     ],
+    "DEFAULT_RENDERER_CLASSES": [
+        "lms.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
     "DEFAULT_FILTER_BACKENDS": [
         "django_filters.rest_framework.DjangoFilterBackend",
         "rest_framework.filters.OrderingFilter",
@@ -145,6 +153,12 @@ REST_FRAMEWORK = {
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
 }
 
+SIMPLE_JWT = {
+    # Токены несут claims пользователя (users.tokens); refresh выдает их заново из БД
+    "TOKEN_OBTAIN_SERIALIZER": "users.tokens.ClaimsTokenObtainPairSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "users.tokens.ClaimsTokenRefreshSerializer",
+}
+
 SPECTACULAR_SETTINGS = {
     "TITLE": "SPA LMS API",
     "DESCRIPTION": "API для системы управления обучением (LMS)",
@@ -152,10 +166,29 @@ SPECTACULAR_SETTINGS = {
     "SERVE_INCLUDE_SCHEMA": False,
 }
 
+# Хосты, ссылки на которые разрешены в описаниях и video_url (вместе с поддоменами)
+LMS_ALLOWED_LINK_HOSTS = [
+    host.strip() for host in os.getenv("LMS_ALLOWED_LINK_HOSTS", "youtube.com,youtu.be").split(",") if host.strip()
+]
+
+
 # Stripe settings
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY", "")
 STRIPE_PUBLISHABLE_KEY = os.getenv("STRIPE_PUBLISHABLE_KEY", "")
 STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET", "")
+STRIPE_CURRENCY = os.getenv("STRIPE_CURRENCY", "usd")
+# Пустой адрес — api.stripe.com; для локальной заглушки: python manage.py stripe_stub
+STRIPE_API_BASE = os.getenv("STRIPE_API_BASE", "")
+# Таймауты вызова Stripe, секунды: чтение ответа и установка соединения
+STRIPE_TIMEOUT = float(os.getenv("STRIPE_TIMEOUT", "10"))
+STRIPE_CONNECT_TIMEOUT = float(os.getenv("STRIPE_CONNECT_TIMEOUT", "3"))
+# Keep-alive соединений в пуле на процесс
+STRIPE_POOL_SIZE = int(os.getenv("STRIPE_POOL_SIZE", "10"))
+# Повторы идемпотентных вызовов при сбоях сети, 5xx и 429
+STRIPE_MAX_RETRIES = int(os.getenv("STRIPE_MAX_RETRIES", "2"))
+# Автомат: столько сбоев подряд размыкают его на STRIPE_BREAKER_RESET секунд
+STRIPE_BREAKER_THRESHOLD = int(os.getenv("STRIPE_BREAKER_THRESHOLD", "5"))
+STRIPE_BREAKER_RESET = float(os.getenv("STRIPE_BREAKER_RESET", "30"))
 
 
 # Email settings
@@ -174,6 +207,14 @@ if REDIS_PASSWORD:
 else:
     REDIS_URL = f"redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}"
 
+# Общий кеш для всех воркеров (роли пользователей и т.п.)
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv("CACHE_BACKEND", "django.core.cache.backends.redis.RedisCache"),
+        "LOCATION": os.getenv("CACHE_LOCATION") or REDIS_URL,
+    }
+}
+
 CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", REDIS_URL)
 CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", REDIS_URL)
 CELERY_ACCEPT_CONTENT = ["json"]
@@ -189,4 +230,27 @@ CELERY_BEAT_SCHEDULE = {
         # Каждый день в 03:00 по TIME_ZONE
         "schedule": crontab(hour=3, minute=0),
     },
+    "prune-stripe-events-daily": {
+        "task": "users.tasks.prune_stripe_events",
+        "schedule": crontab(hour=3, minute=30),
+    },
+    "prune-idempotency-keys-hourly": {
+        "task": "users.tasks.prune_idempotency_keys",
+        "schedule": crontab(minute=45),
+    },
+    "reconcile-pending-payments": {
+        "task": "users.tasks.reconcile_pending_payments",
+        # Подстраховка на случай потерянных вебхуков Stripe
+        "schedule": crontab(minute="*/15"),
+    },
+    "repair-course-counters-daily": {
+        "task": "lms.tasks.repair_course_counters",
+        # Каждый день в 04:00 по TIME_ZONE
+        "schedule": crontab(hour=4, minute=0),
+    },
+    "refresh-course-stats-hourly": {
+        "task": "lms.tasks.refresh_course_stats",
+        # Каждый час пересчитываются вчерашний и сегодняшний дни
+        "schedule": crontab(minute=15),
+    },
 }
@@ -31,6 +31,7 @@ urlpatterns = [
                 "endpoints": {
                     "courses": "/api/courses/",
                     "lessons": "/api/lessons/",
+                    "search": "/api/search/",
                     "users": "/api/users/",
                     "auth_register": "/api/auth/register/",
                     "auth_login": "/api/auth/token/",
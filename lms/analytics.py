@@ -0,0 +1,151 @@
+"""
+Сводная статистика по курсам (CourseDailyStats).
+
+Срезы обновляются инкрементально: оплата платежа и снятие оплаты (сигнал
+Payment), оформление и отмена подписок (lms.services, view подписки).
+Задача lms.tasks.refresh_course_stats пересчитывает последние дни из
+исходных таблиц и исправляет то, что прошло мимо инкрементальных
+обновлений (queryset.update, удаление платежей, каскадные удаления).
+"""
+from collections import defaultdict
+from datetime import datetime, time
+
+from django.db import transaction
+from django.db.models import Case, Count, F, Sum, Value, When
+from django.db.models.functions import Coalesce, TruncDate, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from lms.models import CourseDailyStats, Subscription
+from users.models import Payment
+
+STATS_FIELDS = ("revenue", "payments", "new_subscribers")
+
+
+def bump_course_stats(deltas):
+    """
+    Атомарно прибавляет изменения к срезам, создавая недостающие, за два запроса
+    при любом числе срезов. deltas — {(course_id, день): {поле: изменение}}.
+    """
+    deltas = {key: values for key, values in deltas.items() if any(values.values())}
+    if not deltas:
+        return
+    CourseDailyStats.objects.bulk_create(
+        [CourseDailyStats(course_id=course_id, date=day) for course_id, day in deltas], ignore_conflicts=True
+    )
+    updates = {}
+    for field in STATS_FIELDS:
+        whens = [
+            When(course_id=course_id, date=day, then=Value(values[field]))
+            for (course_id, day), values in deltas.items()
+            if values.get(field)
+        ]
+        if whens:
+            output_field = CourseDailyStats._meta.get_field(field)
+            updates[field] = F(field) + Case(*whens, default=Value(0), output_field=output_field)
+    CourseDailyStats.objects.filter(
+        course_id__in={course_id for course_id, _ in deltas},
+        date__in={day for _, day in deltas},
+    ).update(**updates)
+
+
+def payment_course_id(payment):
+    if payment.paid_course_id:
+        return payment.paid_course_id
+    if payment.paid_lesson_id:
+        return payment.paid_lesson.course_id
+    return None
+
+
+def record_payment_status_change(payment, previous_status):
+    """Учитывает переход платежа в статус PAID и обратно"""
+    paid = Payment.PaymentStatus.PAID
+    if (previous_status == paid) == (payment.payment_status == paid):
+        return
+    course_id = payment_course_id(payment)
+    if course_id is None:
+        return
+    sign = 1 if payment.payment_status == paid else -1
+    day = timezone.localdate(payment.payment_date)
+    bump_course_stats({(course_id, day): {"revenue": sign * payment.amount, "payments": sign}})
+
+
+def subscriptions_by_day(queryset):
+    """Подписки queryset по (курс, день оформления) одним GROUP BY"""
+    rows = (
+        queryset.order_by()
+        .annotate(day=TruncDate("created_at"))
+        .values("course", "day")
+        .annotate(total=Count("pk"))
+        .values_list("course", "day", "total")
+    )
+    return {(course_id, day): total for course_id, day, total in rows}
+
+
+def record_subscriptions(deltas, day=None):
+    """
+    Учитывает оформленные (> 0) и отмененные (< 0) подписки.
+    deltas — {(course_id, день оформления): изменение} или {course_id: изменение} за day.
+    """
+    day = day or timezone.localdate()
+    bump_course_stats({
+        (key if isinstance(key, tuple) else (key, day)): {"new_subscribers": delta}
+        for key, delta in deltas.items()
+    })
+
+
+def rebuild_course_stats(since=None):
+    """
+    Пересчитывает срезы начиная с дня since (все, если None) из платежей и подписок.
+    Возвращает количество записанных срезов.
+    """
+    payments = Payment.objects.filter(payment_status=Payment.PaymentStatus.PAID)
+    subscriptions = Subscription.objects.all()
+    stats = CourseDailyStats.objects.all()
+    if since is not None:
+        start = timezone.make_aware(datetime.combine(since, time.min))
+        payments = payments.filter(payment_date__gte=start)
+        subscriptions = subscriptions.filter(created_at__gte=start)
+        stats = stats.filter(date__gte=since)
+
+    totals = defaultdict(lambda: dict.fromkeys(STATS_FIELDS, 0))
+    revenue = (
+        payments.annotate(course=Coalesce("paid_course_id", "paid_lesson__course_id"), day=TruncDate("payment_date"))
+        .filter(course__isnull=False)
+        .values("course", "day")
+        .annotate(revenue=Sum("amount"), payments=Count("pk"))
+        .order_by()
+    )
+    for row in revenue:
+        totals[(row["course"], row["day"])].update(revenue=row["revenue"], payments=row["payments"])
+    for key, total in subscriptions_by_day(subscriptions).items():
+        totals[key]["new_subscribers"] = total
+
+    with transaction.atomic():
+        # Срезы, для которых в исходных данных ничего не осталось, обнуляются
+        stats.update(**dict.fromkeys(STATS_FIELDS, 0))
+        CourseDailyStats.objects.bulk_create(
+            [CourseDailyStats(course_id=course_id, date=day, **values) for (course_id, day), values in totals.items()],
+            update_conflicts=True,
+            unique_fields=["course", "date"],
+            update_fields=list(STATS_FIELDS),
+            batch_size=1000,
+        )
+    return len(totals)
+
+
+BUCKETS = {"day": F("date"), "week": TruncWeek("date"), "month": TruncMonth("date")}
+
+
+def course_stats(courses, date_from, date_to, bucket="day"):
+    """
+    Срезы курсов queryset courses за [date_from, date_to], сложенные по периодам
+    bucket (day, week, month). Читает только CourseDailyStats по индексу
+    (course, date): не больше одной строки на курс и день.
+    """
+    return (
+        CourseDailyStats.objects.filter(course__in=courses.values("pk"), date__range=(date_from, date_to))
+        .annotate(period=BUCKETS[bucket])
+        .values("course", "period")
+        .annotate(revenue=Sum("revenue"), payments=Sum("payments"), new_subscribers=Sum("new_subscribers"))
+        .order_by("course", "period")
+    )
@@ -0,0 +1,494 @@
+"""
+Замер эндпоинтов lms.urls и users.urls с бюджетами.
+
+Каждый маршрут обоих приложений покрыт хотя бы одним сценарием (SCENARIOS).
+Сценарий выполняется тестовым клиентом через весь стек Django на данных
+реалистичного объема (seed_benchmark_data): один прогрев, один прогон с
+подсчетом SQL-запросов и выделенной памяти (tracemalloc) и iterations
+прогонов для задержек p50/p95. Данные создаются в транзакции и
+откатываются после замеров, Stripe заменен локальной заглушкой.
+
+Результаты сравниваются с бюджетами из BUDGETS_PATH (lms/benchmark_budgets.json):
+превышение любого из queries, p95_ms, alloc_kb — нарушение. Бюджет запросов
+точный и не зависит от машины; бюджеты задержек и памяти — потолки с запасом.
+"""
+import hashlib
+import hmac
+import importlib
+import json
+import math
+import platform
+import random
+import statistics
+import subprocess
+import time
+import tracemalloc
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass, field
+from decimal import Decimal
+from pathlib import Path
+from typing import Callable
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.db import connection, reset_queries, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver
+from django.utils import timezone
+
+from lms.analytics import rebuild_course_stats
+from lms.models import Course, Lesson, Subscription
+from lms.search import reset_fallback_index
+from lms.tasks import repair_course_counters
+from users.models import Payment, User
+from users.permissions import MODERATOR_GROUP
+from users.stripe_gateway import reset_stripe_gateway
+from users.stripe_stub import StripeStub
+from users.tokens import ClaimsTokenObtainPairSerializer
+
+BUDGETS_PATH = Path(__file__).with_name("benchmark_budgets.json")
+BENCHMARK_URLCONFS = ("lms.urls", "users.urls")
+BUDGET_METRICS = ("queries", "p95_ms", "alloc_kb")
+WEBHOOK_SECRET = "whsec_benchmark"
+BENCHMARK_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "benchmarks"},
+}
+# Страница списков — 10 объектов, у владельца их должно быть больше, чтобы N+1 был виден
+OWNER_COURSES = 12
+
+
+@dataclass
+class BenchmarkData:
+    owner: User
+    moderator: User
+    staff: User
+    courses: list
+    lessons: list
+    others: list
+    payment: Payment
+    tokens: dict = field(default_factory=dict)
+    counter: int = 0
+
+    def next(self):
+        self.counter += 1
+        return self.counter
+
+
+@dataclass
+class Scenario:
+    name: str
+    route: str
+    method: str
+    # (данные, номер прогона) -> {"path": ..., "data": ..., "headers": ...}; вызывается вне замера
+    prepare: Callable[[BenchmarkData, int], dict]
+    user: str | None = "owner"
+    expected: int = 200
+
+
+def seed_benchmark_data(users=200, courses=100, lessons_per_course=10, payments=300, seed=0):
+    """Пользователи, курсы, уроки, подписки и платежи; у владельца — OWNER_COURSES курсов"""
+    rng = random.Random(seed)
+    password = make_password(None)
+    people = User.objects.bulk_create(
+        User(email=f"benchmark-{i}@example.com", password=password, is_staff=i == 2)
+        for i in range(max(users, 4))
+    )
+    owner, moderator, staff, others = people[0], people[1], people[2], people[3:]
+    Group.objects.get_or_create(name=MODERATOR_GROUP)[0].user_set.add(moderator)
+
+    course_objects = Course.objects.bulk_create(
+        Course(
+            owner=owner if i < OWNER_COURSES else rng.choice(others),
+            title=f"Course {i} " + rng.choice(["Python", "Django", "SQL", "Data"]),
+            description="Описание курса " * rng.randint(5, 40),
+        )
+        for i in range(max(courses, OWNER_COURSES))
+    )
+    lesson_objects = Lesson.objects.bulk_create(
+        Lesson(
+            owner=course.owner,
+            course=course,
+            title=f"Lesson {course.pk}.{j}",
+            description="Описание урока " * rng.randint(5, 40),
+            video_url="https://www.youtube.com/watch?v=benchmark",
+        )
+        for course in course_objects
+        for j in range(lessons_per_course)
+    )
+    Subscription.objects.bulk_create(
+        Subscription(user=user, course=course)
+        for user in people
+        for course in rng.sample(course_objects, min(5, len(course_objects)))
+    )
+    statuses = list(Payment.PaymentStatus.values)
+    Payment.objects.bulk_create(
+        Payment(
+            user=owner if i % 3 == 0 else rng.choice(others),
+            paid_course=rng.choice(course_objects),
+            amount=Decimal(rng.randint(10, 500)),
+            payment_status=rng.choice(statuses),
+        )
+        for i in range(payments)
+    )
+    payment = Payment.objects.create(
+        user=owner,
+        paid_course=course_objects[0],
+        amount=Decimal("10.00"),
+        payment_method=Payment.PaymentMethod.STRIPE,
+        stripe_session_id="cs_benchmark",
+    )
+    # bulk_create минует сигналы: счетчики и сводную статистику считаем задачами ремонта
+    repair_course_counters()
+    rebuild_course_stats()
+
+    data = BenchmarkData(
+        owner=owner,
+        moderator=moderator,
+        staff=staff,
+        courses=[course for course in course_objects if course.owner_id == owner.pk],
+        lessons=[lesson for lesson in lesson_objects if lesson.owner_id == owner.pk],
+        others=others,
+        payment=payment,
+    )
+    for role in ("owner", "moderator", "staff"):
+        user = getattr(data, role)
+        data.tokens[role] = str(ClaimsTokenObtainPairSerializer.get_token(user).access_token)
+    return data
+
+
+def _new_course(data):
+    return Course.objects.create(owner=data.owner, title=f"Disposable {data.next()}")
+
+
+def _new_lesson(data):
+    return Lesson.objects.create(owner=data.owner, course=data.courses[0], title=f"Disposable {data.next()}")
+
+
+def _lesson_payload(data, count):
+    return [
+        {"course": data.courses[0].pk, "title": f"Bulk {data.next()}", "video_url": "https://youtu.be/benchmark"}
+        for _ in range(count)
+    ]
+
+
+def _webhook(data, i):
+    payload = json.dumps({
+        "id": f"evt_benchmark_{data.next()}",
+        "object": "event",
+        "type": "checkout.session.completed",
+        "data": {"object": {"id": "cs_benchmark", "object": "checkout.session", "payment_status": "paid"}},
+    })
+    timestamp = int(time.time())
+    signature = hmac.new(WEBHOOK_SECRET.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+    return {
+        "path": "/api/payments/webhook/",
+        "data": payload,
+        "headers": {"stripe-signature": f"t={timestamp},v1={signature}"},
+    }
+
+
+SCENARIOS = [
+    Scenario("api root", "api-root", "GET", lambda d, i: {"path": "/api/"}),
+    Scenario("courses list", "course-list", "GET", lambda d, i: {"path": "/api/courses/"}),
+    Scenario(
+        "courses list with lessons", "course-list", "GET",
+        lambda d, i: {"path": "/api/courses/?expand=lessons&page_size=50"},
+    ),
+    Scenario("courses list (moderator)", "course-list", "GET", lambda d, i: {"path": "/api/courses/"}, "moderator"),
+    Scenario(
+        "course create", "course-list", "POST",
+        lambda d, i: {"path": "/api/courses/", "data": {"title": f"New {d.next()}", "description": "Курс"}},
+        expected=201,
+    ),
+    Scenario("course detail", "course-detail", "GET", lambda d, i: {"path": f"/api/courses/{d.courses[0].pk}/"}),
+    Scenario(
+        "course update", "course-detail", "PATCH",
+        lambda d, i: {"path": f"/api/courses/{d.courses[1].pk}/", "data": {"title": f"Renamed {i}"}},
+    ),
+    Scenario(
+        "course delete", "course-detail", "DELETE",
+        lambda d, i: {"path": f"/api/courses/{_new_course(d).pk}/"},
+        expected=204,
+    ),
+    Scenario(
+        "course lessons", "course-lessons", "GET",
+        lambda d, i: {"path": f"/api/courses/{d.courses[0].pk}/lessons/"},
+    ),
+    Scenario("lessons list", "lesson-list", "GET", lambda d, i: {"path": "/api/lessons/"}),
+    Scenario(
+        "lesson create", "lesson-list", "POST",
+        lambda d, i: {"path": "/api/lessons/", "data": _lesson_payload(d, 1)[0]},
+        expected=201,
+    ),
+    Scenario("lesson detail", "lesson-detail", "GET", lambda d, i: {"path": f"/api/lessons/{d.lessons[0].pk}/"}),
+    Scenario(
+        "lesson update", "lesson-detail", "PATCH",
+        lambda d, i: {"path": f"/api/lessons/{d.lessons[1].pk}/", "data": {"title": f"Renamed {i}"}},
+    ),
+    Scenario(
+        "lesson delete", "lesson-detail", "DELETE",
+        lambda d, i: {"path": f"/api/lessons/{_new_lesson(d).pk}/"},
+        expected=204,
+    ),
+    Scenario(
+        "lessons bulk create", "lesson-bulk", "POST",
+        lambda d, i: {"path": "/api/lessons/bulk/", "data": _lesson_payload(d, 10)},
+        expected=201,
+    ),
+    Scenario(
+        "lessons bulk update", "lesson-bulk", "PATCH",
+        lambda d, i: {
+            "path": "/api/lessons/bulk/",
+            "data": [{"id": lesson.pk, "title": f"Bulk renamed {i}"} for lesson in d.lessons[:10]],
+        },
+    ),
+    Scenario(
+        "subscription toggle", "subscription", "POST",
+        lambda d, i: {"path": "/api/subscriptions/", "data": {"course_id": d.courses[2].pk}},
+    ),
+    Scenario(
+        "subscriptions bulk", "subscription-bulk", "POST",
+        lambda d, i: {
+            "path": "/api/subscriptions/bulk/",
+            "data": {
+                "action": "subscribe" if i % 2 == 0 else "unsubscribe",
+                "users": [user.pk for user in d.others[:100]],
+                "courses": [course.pk for course in d.courses[:5]],
+            },
+        },
+    ),
+    Scenario(
+        "subscription status", "subscription-status", "GET",
+        lambda d, i: {"path": "/api/subscriptions/status/?course_ids=" + ",".join(str(c.pk) for c in d.courses)},
+    ),
+    Scenario("search", "search", "GET", lambda d, i: {"path": "/api/search/?q=cour"}),
+    Scenario("search short term", "search", "GET", lambda d, i: {"path": "/api/search/?q=c+co"}),
+    Scenario("analytics", "analytics", "GET", lambda d, i: {"path": "/api/analytics/?bucket=week"}),
+    Scenario("users list (staff)", "user-list", "GET", lambda d, i: {"path": "/api/users/"}, "staff"),
+    Scenario("user detail", "user-detail", "GET", lambda d, i: {"path": f"/api/users/{d.owner.pk}/"}),
+    Scenario(
+        "user update", "user-detail", "PATCH",
+        lambda d, i: {"path": f"/api/users/{d.owner.pk}/", "data": {"city": f"City {i}"}},
+    ),
+    # Путь совпадает с user-detail роутера, который стоит раньше и перехватывает его
+    Scenario("user profile", "user-profile", "GET", lambda d, i: {"path": f"/api/users/{d.owner.pk}/"}),
+    Scenario(
+        "register", "user-register", "POST",
+        lambda d, i: {
+            "path": "/api/auth/register/",
+            "data": {"email": f"benchmark-new-{d.next()}@example.com", "password": "benchmark-pass-123"},
+        },
+        user=None,
+        expected=201,
+    ),
+    Scenario("payments list", "payment-list", "GET", lambda d, i: {"path": "/api/payments/"}),
+    Scenario(
+        "payment create", "payment-create", "POST",
+        lambda d, i: {"path": "/api/payments/create/", "data": {"paid_course": d.courses[3].pk, "amount": "10.00"}},
+        expected=201,
+    ),
+    Scenario(
+        "payment status", "payment-status", "GET",
+        lambda d, i: {"path": f"/api/payments/{d.payment.pk}/status/"},
+    ),
+    Scenario("stripe webhook", "payment-webhook", "POST", _webhook, user=None),
+]
+
+
+def route_names(urlconfs=BENCHMARK_URLCONFS):
+    """Имена всех маршрутов urlconf'ов (вложенные include раскрываются)"""
+    names = set()
+
+    def walk(patterns):
+        for pattern in patterns:
+            if isinstance(pattern, URLResolver):
+                walk(pattern.url_patterns)
+            elif isinstance(pattern, URLPattern) and pattern.name:
+                names.add(pattern.name)
+
+    for urlconf in urlconfs:
+        walk(importlib.import_module(urlconf).urlpatterns)
+    return names
+
+
+def uncovered_routes(scenarios=SCENARIOS):
+    return sorted(route_names() - {scenario.route for scenario in scenarios})
+
+
+@contextmanager
+def benchmark_environment():
+    """
+    Заглушка Stripe, секрет вебхука и отдельный кеш в памяти на время замеров.
+    Общий кеш (Redis) не трогается: в нем отзывы токенов, роли, позиции задач
+    и брокер Celery, и очищать его ради замеров нельзя.
+    """
+    with ExitStack() as stack:
+        stub = StripeStub()
+        stub.start()
+        stack.callback(stub.stop)
+        stack.enter_context(
+            override_settings(
+                STRIPE_API_BASE=stub.url,
+                STRIPE_SECRET_KEY="sk_test_stub",
+                STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET,
+                CACHES=BENCHMARK_CACHES,
+            )
+        )
+        reset_stripe_gateway()
+        stack.callback(reset_stripe_gateway)
+        # Кеш в памяти процесса живет и после замены настроек — до и после он пустой
+        cache.clear()
+        stack.callback(cache.clear)
+        # Индекс поиска в памяти строится из данных, которые будут откачены
+        stack.callback(reset_fallback_index)
+        yield stub
+
+
+def run_benchmarks(scenarios=SCENARIOS, iterations=30, seed_options=None, progress=None):
+    """
+    Засевает данные, выполняет сценарии и откатывает все изменения.
+    Возвращает отчет: {"meta": {...}, "results": {имя сценария: метрики}}.
+    """
+    seed_options = seed_options or {}
+    results = {}
+    with benchmark_environment(), transaction.atomic():
+        data = seed_benchmark_data(**seed_options)
+        client = Client()
+        for scenario in scenarios:
+            results[scenario.name] = measure_scenario(client, data, scenario, iterations)
+            if progress:
+                progress(scenario.name, results[scenario.name])
+        transaction.set_rollback(True)
+    return {"meta": report_meta(iterations, seed_options), "results": results}
+
+
+def measure_scenario(client, data, scenario, iterations):
+    def call(i):
+        request = scenario.prepare(data, i)
+        headers = dict(request.get("headers", {}))
+        if scenario.user:
+            headers["authorization"] = f"Bearer {data.tokens[scenario.user]}"
+        body = request.get("data")
+        if body is not None and not isinstance(body, str):
+            body = json.dumps(body)
+        return lambda: client.generic(
+            scenario.method, request["path"], body or "", content_type="application/json", headers=headers
+        )
+
+    def check(response):
+        if response.status_code != scenario.expected:
+            raise AssertionError(
+                f"{scenario.name}: {scenario.method} returned {response.status_code}, "
+                f"expected {scenario.expected}: {response.content[:300]!r}"
+            )
+
+    # Прогрев: кеш ролей, продукт и цена Stripe, индекс поиска
+    request = call(0)
+    check(request())
+
+    request = call(1)
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    allocated_before = tracemalloc.get_traced_memory()[0]
+    # При DEBUG журнал запросов ограничен и мог заполниться на засеве
+    reset_queries()
+    with CaptureQueriesContext(connection) as ctx:
+        response = request()
+    peak = tracemalloc.get_traced_memory()[1]
+    if not tracing:
+        tracemalloc.stop()
+    check(response)
+
+    latencies = []
+    for i in range(iterations):
+        request = call(i + 2)
+        started = time.perf_counter()
+        response = request()
+        latencies.append(time.perf_counter() - started)
+        check(response)
+
+    ordered = sorted(latencies) or [0.0]
+    return {
+        "route": scenario.route,
+        "method": scenario.method,
+        "queries": len(ctx.captured_queries),
+        "p50_ms": round(statistics.median(ordered) * 1000, 2),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 2),
+        "alloc_kb": round((peak - allocated_before) / 1024, 1),
+    }
+
+
+def report_meta(iterations, seed_options):
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "created_at": timezone.now().isoformat(),
+        "database": connection.vendor,
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "iterations": iterations,
+        "seed": seed_options,
+    }
+
+
+def load_budgets(path=BUDGETS_PATH):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def check_budgets(report, budgets, metrics=BUDGET_METRICS):
+    """Нарушения бюджетов: [{"scenario", "metric", "value", "budget"}]; сценарий без бюджета — тоже нарушение"""
+    violations = []
+    for name, result in report["results"].items():
+        budget = budgets.get(name)
+        if budget is None:
+            violations.append({"scenario": name, "metric": "budget", "value": None, "budget": None})
+            continue
+        for metric in metrics:
+            if metric in budget and result[metric] > budget[metric]:
+                violations.append({"scenario": name, "metric": metric, "value": result[metric], "budget": budget[metric]})
+    return violations
+
+
+def make_budgets(report):
+    """Бюджеты по замеру: запросы — как есть, p95 и память — с запасом на шум и другую машину"""
+    return {
+        name: {
+            "queries": result["queries"],
+            "p95_ms": max(50, math.ceil(result["p95_ms"] * 3)),
+            "alloc_kb": max(256, math.ceil(result["alloc_kb"] * 2)),
+        }
+        for name, result in report["results"].items()
+    }
+
+
+def compare_reports(report, baseline, tolerance=0.1):
+    """
+    Изменения метрик относительно прошлого отчета: {сценарий: {метрика: (было, стало)}}.
+    Число запросов сравнивается точно, задержки и память — с допуском tolerance.
+    """
+    changes = {}
+    for name, result in report["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if previous is None:
+            continue
+        diff = {}
+        for metric in ("queries", "p50_ms", "p95_ms", "alloc_kb"):
+            old, new = previous.get(metric), result[metric]
+            if old is None or old == new:
+                continue
+            if metric == "queries" or abs(new - old) > tolerance * max(abs(old), 1e-9):
+                diff[metric] = (old, new)
+        if diff:
+            changes[name] = diff
+    return changes
@@ -0,0 +1,89 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lms.benchmarks import (
+    BUDGETS_PATH,
+    SCENARIOS,
+    check_budgets,
+    compare_reports,
+    load_budgets,
+    make_budgets,
+    run_benchmarks,
+    uncovered_routes,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark every route of lms.urls and users.urls on seeded data: SQL queries, p50/p95 latency "
+        "and allocations. Fails when a budget from lms/benchmark_budgets.json is exceeded"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=30, help="Timed requests per scenario")
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--courses", type=int, default=100)
+        parser.add_argument("--lessons-per-course", type=int, default=10)
+        parser.add_argument("--payments", type=int, default=300)
+        parser.add_argument("--seed", type=int, default=0, help="Random seed for the generated data")
+        parser.add_argument("--only", help="Run only scenarios whose name contains this text")
+        parser.add_argument("--report", help="Write the JSON report to this file")
+        parser.add_argument("--baseline", help="JSON report of an earlier run to compare with")
+        parser.add_argument("--budgets", default=str(BUDGETS_PATH), help="Budgets file")
+        parser.add_argument("--write-budgets", action="store_true", help="Write budgets from this run instead of checking")
+
+    def handle(self, *args, **options):
+        missing = uncovered_routes()
+        if missing:
+            raise CommandError(f"Routes without a benchmark scenario: {', '.join(missing)}")
+        scenarios = [s for s in SCENARIOS if not options["only"] or options["only"] in s.name]
+
+        report = run_benchmarks(
+            scenarios,
+            iterations=options["iterations"],
+            seed_options={
+                "users": options["users"],
+                "courses": options["courses"],
+                "lessons_per_course": options["lessons_per_course"],
+                "payments": options["payments"],
+                "seed": options["seed"],
+            },
+            progress=self.progress,
+        )
+
+        if options["baseline"]:
+            with open(options["baseline"], encoding="utf-8") as f:
+                changes = compare_reports(report, json.load(f))
+            for name, diff in changes.items():
+                self.stdout.write(f"  {name}: " + ", ".join(f"{m} {old} -> {new}" for m, (old, new) in diff.items()))
+
+        if options["write_budgets"]:
+            budgets = make_budgets(report)
+            if options["only"]:
+                budgets = {**load_budgets(options["budgets"]), **budgets}
+            with open(options["budgets"], "w", encoding="utf-8") as f:
+                json.dump(budgets, f, ensure_ascii=False, indent=2, sort_keys=True)
+                f.write("\n")
+            self.stdout.write(self.style.SUCCESS(f"Budgets written to {options['budgets']}"))
+            violations = []
+        else:
+            violations = check_budgets(report, load_budgets(options["budgets"]))
+        report["violations"] = violations
+
+        if options["report"]:
+            with open(options["report"], "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+                f.write("\n")
+
+        if violations:
+            for v in violations:
+                self.stderr.write(f"  {v['scenario']}: {v['metric']} {v['value']} > budget {v['budget']}")
+            raise CommandError(f"{len(violations)} budget violation(s)")
+        self.stdout.write(self.style.SUCCESS(f"{len(report['results'])} scenarios within budget"))
+
+    def progress(self, name, result):
+        self.stdout.write(
+            f"{name:<28} {result['method']:<6} queries {result['queries']:>3}  "
+            f"p50 {result['p50_ms']:>8.2f} ms  p95 {result['p95_ms']:>8.2f} ms  alloc {result['alloc_kb']:>9.1f} KB"
+        )
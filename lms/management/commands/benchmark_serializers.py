@@ -0,0 +1,94 @@
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from lms.models import Course, Lesson
+from lms.renderers import FastJSONRenderer
+from lms.serializers import RowSerializer
+from lms.views import CourseViewSet, LessonListCreateView
+from users.models import Payment, User
+from users.views import PaymentListView
+
+
+class Command(BaseCommand):
+    help = "Benchmark list serialization: ModelSerializer + JSONRenderer vs values() + RowSerializer + FastJSONRenderer"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--objects", type=int, default=2000, help="Objects per list (default: 2000)")
+        parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement, best is reported")
+
+    def handle(self, *args, **options):
+        # Данные создаются в транзакции и откатываются после замеров
+        with transaction.atomic():
+            user = self.seed(options["objects"])
+            for view_class in (CourseViewSet, LessonListCreateView, PaymentListView):
+                self.report(view_class, user, options["repeat"])
+            transaction.set_rollback(True)
+
+    def seed(self, count):
+        user = User.objects.create(email="benchmark@example.com")
+        courses = Course.objects.bulk_create(
+            Course(owner=user, title=f"Course {i}", description="Описание курса " * 10) for i in range(count)
+        )
+        Lesson.objects.bulk_create(
+            Lesson(
+                owner=user,
+                course=course,
+                title=f"Lesson {course.pk}",
+                description="Описание урока " * 10,
+                video_url="https://www.youtube.com/watch?v=benchmark",
+            )
+            for course in courses
+        )
+        Payment.objects.bulk_create(
+            Payment(user=user, paid_course=course, amount=Decimal("100.00")) for course in courses
+        )
+        return user
+
+    def make_view(self, view_class, user):
+        request = APIRequestFactory().get("/")
+        force_authenticate(request, user=user)
+        view = view_class()
+        view.request = Request(request, authenticators=view.get_authenticators())
+        view.request.user = user
+        view.args, view.kwargs, view.format_kwarg = (), {}, None
+        view.action = "list"
+        return view
+
+    def measure(self, func, repeat):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            size = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return size, best
+
+    def report(self, view_class, user, repeat):
+        view = self.make_view(view_class, user)
+        queryset = view.get_queryset()
+
+        def model_path():
+            serializer = view.get_serializer(queryset, many=True)
+            JSONRenderer().render(serializer.data)
+            return len(serializer.data)
+
+        row_serializer = RowSerializer.for_serializer(view.get_serializer())
+
+        def row_path():
+            data = row_serializer.many_to_representation(queryset.values(*row_serializer.columns))
+            FastJSONRenderer().render(data)
+            return len(data)
+
+        count, before = self.measure(model_path, repeat)
+        _, after = self.measure(row_path, repeat)
+        self.stdout.write(
+            f"{view_class.__name__}: {count} objects, "
+            f"before {count / before:,.0f} obj/s, after {count / after:,.0f} obj/s "
+            f"(x{before / after:.1f})"
+        )
@@ -0,0 +1,58 @@
+import re
+import time
+from urllib.parse import urlparse
+
+from django.core.management.base import BaseCommand
+from rest_framework import serializers
+
+from lms.validators import validate_no_external_links
+
+
+def legacy_validate_no_external_links(value):
+    # Прежняя реализация: findall по всему тексту и urlparse каждой ссылки
+    urls = re.findall(r'https?://[^\s<>"{}|\\^`\[\]]+', value)
+    for url in urls:
+        parsed = urlparse(url)
+        if 'youtube.com' not in parsed.netloc and 'youtu.be' not in parsed.netloc:
+            raise serializers.ValidationError("external link")
+
+
+class Command(BaseCommand):
+    help = "Benchmark validate_no_external_links on large descriptions: previous implementation vs LinkPolicy"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size", type=int, default=4, help="Description size in megabytes (default: 4)")
+        parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement, best is reported")
+
+    def handle(self, *args, **options):
+        size = options["size"] * 1024 * 1024
+        for name, text in self.payloads(size):
+            before = self.measure(legacy_validate_no_external_links, text, options["repeat"])
+            after = self.measure(validate_no_external_links, text, options["repeat"])
+            megabytes = len(text) / 1024 / 1024
+            self.stdout.write(
+                f"{name}: {megabytes:.1f} MB, "
+                f"before {megabytes / before:,.1f} MB/s, after {megabytes / after:,.1f} MB/s "
+                f"(x{before / after:.1f})"
+            )
+
+    def payloads(self, size):
+        def fill(chunk):
+            return chunk * (size // len(chunk) + 1)
+
+        yield "plain text", fill("Описание урока без ссылок. ")[:size]
+        yield "youtube links", fill("Смотрите https://www.youtube.com/watch?v=abcdef и дальше. ")[:size]
+        rejected_tail = " https://example.com/page"
+        yield "external link at the end", fill("Смотрите https://youtu.be/abcdef. ")[:size] + rejected_tail
+
+    def measure(self, validator, text, repeat):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            try:
+                validator(text)
+            except serializers.ValidationError:
+                pass
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
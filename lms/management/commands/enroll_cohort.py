@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models.functions import Lower
+
+from lms.models import Course
+from lms.services import subscribe_users, unsubscribe_users
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = "Subscribe (or unsubscribe) a cohort of users to courses using set-based inserts/deletes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--course", type=int, action="append", required=True, help="Course id (repeatable)")
+        parser.add_argument("--user", type=int, action="append", default=[], help="User id (repeatable)")
+        parser.add_argument("--emails-file", help="File with one user email per line")
+        parser.add_argument("--unenroll", action="store_true", help="Remove subscriptions instead of creating")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        course_ids = set(options["course"])
+        found = set(Course.objects.filter(pk__in=course_ids).values_list("pk", flat=True))
+        if course_ids - found:
+            raise CommandError(f"Courses not found: {sorted(course_ids - found)}")
+
+        user_ids = set(User.objects.filter(pk__in=options["user"]).values_list("pk", flat=True))
+        if options["emails_file"]:
+            with open(options["emails_file"], encoding="utf-8") as fh:
+                emails = {line.strip().lower() for line in fh if line.strip()}
+            # Адреса в БД могут храниться в любом регистре — сравниваем без него
+            matched = dict(
+                User.objects.annotate(email_lower=Lower("email"))
+                .filter(email_lower__in=emails)
+                .values_list("email_lower", "pk")
+            )
+            user_ids.update(matched.values())
+            missing = emails - set(matched)
+            if missing:
+                self.stdout.write(self.style.WARNING(f"{len(missing)} emails not found, skipped"))
+        if not user_ids:
+            raise CommandError("No users to process")
+
+        with transaction.atomic():
+            if options["unenroll"]:
+                deleted = unsubscribe_users(user_ids, course_ids)
+                message = f"Deleted {deleted} subscriptions"
+            else:
+                created = subscribe_users(user_ids, course_ids, batch_size=options["batch_size"])
+                message = f"Created {created} subscriptions"
+        self.stdout.write(self.style.SUCCESS(f"{message} for {len(user_ids)} users and {len(course_ids)} courses"))
@@ -0,0 +1,79 @@
+import os
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from lms.analytics import rebuild_course_stats
+from lms.synthetic import Plan, generate, prepare_plan
+from lms.tasks import repair_course_counters
+
+# Ноль и отрицательные значения ломают распределения и деление на чанки
+POSITIVE_OPTIONS = (
+    "users", "courses", "lessons_per_course", "subscriptions_per_user", "payments", "days", "zipf", "workers",
+    "chunk_size",
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate synthetic users, courses, lessons, subscriptions and payments for load and capacity testing: "
+        "skewed distributions, bulk inserts (COPY on PostgreSQL), parallel workers, deterministic from --seed"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10000)
+        parser.add_argument("--courses", type=int, help="Default: one per 100 users")
+        parser.add_argument("--lessons-per-course", type=float, default=8.0, help="Mean, log-normal")
+        parser.add_argument("--subscriptions-per-user", type=float, default=3.0, help="Mean, log-normal")
+        parser.add_argument("--payments", type=int, help="Default: two per user")
+        parser.add_argument("--days", type=int, default=365, help="History depth for dates")
+        parser.add_argument("--zipf", type=float, default=1.1, help="Skew of course popularity and buyer activity")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--workers", type=int, default=min(8, os.cpu_count() or 1))
+        parser.add_argument("--chunk-size", type=int, default=10000, help="Rows per insert transaction")
+        parser.add_argument("--password", default="loadtest", help="Password of every generated user")
+        parser.add_argument("--skip-rollups", action="store_true", help="Do not recount course counters and stats")
+
+    def handle(self, *args, **options):
+        for name in POSITIVE_OPTIONS:
+            if options[name] is not None and options[name] <= 0:
+                raise CommandError(f"--{name.replace('_', '-')} must be positive")
+        workers = options["workers"]
+        if workers > 1 and connection.vendor == "sqlite":
+            self.stdout.write(self.style.WARNING("SQLite allows one writer: using a single worker"))
+            workers = 1
+
+        started = time.perf_counter()
+        plan = prepare_plan(Plan(
+            users=options["users"],
+            courses=options["courses"] if options["courses"] is not None else max(1, options["users"] // 100),
+            payments=options["payments"] if options["payments"] is not None else options["users"] * 2,
+            # Один хеш на всех: хеширование миллиона паролей заняло бы часы
+            password_hash=make_password(options["password"]),
+            now=timezone.now(),
+            seed=options["seed"],
+            lessons_per_course=options["lessons_per_course"],
+            subscriptions_per_user=options["subscriptions_per_user"],
+            days=options["days"],
+            zipf=options["zipf"],
+            chunk_size=options["chunk_size"],
+        ))
+        self.stdout.write(
+            f"Generating {plan.users:,} users, {plan.courses:,} courses, {plan.lessons:,} lessons, "
+            f"~{int(plan.users * plan.subscriptions_per_user):,} subscriptions, {plan.payments:,} payments "
+            f"with {workers} worker(s), seed {plan.seed}"
+        )
+        generate(plan, workers=workers, progress=self.progress)
+
+        if not options["skip_rollups"]:
+            rollup_started = time.perf_counter()
+            repair_course_counters()
+            rebuild_course_stats()
+            self.stdout.write(f"  counters and course stats: {time.perf_counter() - rollup_started:.1f} s")
+        self.stdout.write(self.style.SUCCESS(f"Done in {time.perf_counter() - started:.1f} s"))
+
+    def progress(self, kind, rows, seconds):
+        self.stdout.write(f"  {kind}: {rows:,} rows in {seconds:.1f} s ({rows / max(seconds, 1e-9):,.0f} rows/s)")
@@ -0,0 +1,44 @@
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    Course = apps.get_model("lms", "Course")
+    Lesson = apps.get_model("lms", "Lesson")
+    Subscription = apps.get_model("lms", "Subscription")
+
+    def count(model):
+        return Coalesce(
+            Subquery(
+                model.objects.filter(course=OuterRef("pk"))
+                .order_by()
+                .values("course")
+                .annotate(total=Count("pk"))
+                .values("total")
+            ),
+            0,
+        )
+
+    Course.objects.update(lessons_count=count(Lesson), subscribers_count=count(Subscription))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("lms", "0006_lesson_updated_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="course",
+            name="lessons_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="course",
+            name="subscribers_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,70 @@
+import django.contrib.postgres.search
+from django.db import migrations
+
+# search_vector пересчитывается триггером при каждой записи title/description,
+# поэтому его поддерживают и bulk_create/bulk_update, и UPDATE в обход ORM.
+# Веса: заголовок — A, описание — B; конфигурация "simple" (без стемминга),
+# чтобы префиксный поиск работал одинаково для русского и английского текста.
+CREATE_SQL = """
+CREATE OR REPLACE FUNCTION lms_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('simple', coalesce(NEW.title, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(NEW.description, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER lms_course_search_vector_update
+    BEFORE INSERT OR UPDATE OF title, description ON lms_course
+    FOR EACH ROW EXECUTE FUNCTION lms_search_vector_update();
+CREATE TRIGGER lms_lesson_search_vector_update
+    BEFORE INSERT OR UPDATE OF title, description ON lms_lesson
+    FOR EACH ROW EXECUTE FUNCTION lms_search_vector_update();
+
+UPDATE lms_course SET title = title;
+UPDATE lms_lesson SET title = title;
+
+CREATE INDEX lms_course_search_idx ON lms_course USING gin (search_vector);
+CREATE INDEX lms_lesson_search_idx ON lms_lesson USING gin (search_vector);
+"""
+
+DROP_SQL = """
+DROP INDEX IF EXISTS lms_lesson_search_idx;
+DROP INDEX IF EXISTS lms_course_search_idx;
+DROP TRIGGER IF EXISTS lms_lesson_search_vector_update ON lms_lesson;
+DROP TRIGGER IF EXISTS lms_course_search_vector_update ON lms_course;
+DROP FUNCTION IF EXISTS lms_search_vector_update();
+"""
+
+
+def create_search_triggers(apps, schema_editor):
+    # На других СУБД поиск идет по индексу в памяти процесса (lms.search)
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(CREATE_SQL, params=None)
+
+
+def drop_search_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(DROP_SQL, params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("lms", "0007_course_counters"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="course",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="lesson",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_triggers, drop_search_triggers),
+    ]
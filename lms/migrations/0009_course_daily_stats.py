@@ -0,0 +1,28 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lms', '0008_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('payments', models.IntegerField(default=0)),
+                ('new_subscribers', models.IntegerField(default=0)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='lms.course')),
+            ],
+            options={
+                'verbose_name': 'Статистика курса за день',
+                'verbose_name_plural': 'Статистика курсов по дням',
+                'constraints': [models.UniqueConstraint(fields=('course', 'date'), name='lms_coursedailystats_course_date_uniq')],
+            },
+        ),
+    ]
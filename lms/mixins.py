@@ -0,0 +1,137 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import quote_etag
+from rest_framework import status
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+
+from lms.serializers import RowSerializer
+
+from users.permissions import is_moderator
+
+
+class SparseFieldsetMixin:
+    """
+    Поддержка `?fields=` и `?expand=` для view.
+
+    `?fields=id,title` ограничивает набор полей ответа, а колонки модели,
+    которые не нужны запрошенным полям, не загружаются из БД (`only()`).
+    `?expand=lessons` включает тяжелые вложенные поля, перечисленные в
+    `expandable_fields`. Ограничение полей применяется только к чтению:
+    при записи сериализатор и модель работают со всеми полями.
+    """
+    fields_query_param = "fields"
+    expand_query_param = "expand"
+    # поле сериализатора -> поле модели, которое нужно загрузить
+    sparse_model_fields = {}
+    expandable_fields = ()
+
+    def get_sparse_fields(self):
+        if self.request is None or self.request.method not in SAFE_METHODS:
+            return None
+        raw = self.request.query_params.get(self.fields_query_param)
+        if not raw:
+            return None
+        return [name.strip() for name in raw.split(",") if name.strip()]
+
+    def get_expand(self):
+        if self.request is None:
+            return set()
+        raw = self.request.query_params.get(self.expand_query_param, "")
+        return {name.strip() for name in raw.split(",")} & set(self.expandable_fields)
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_sparse_fields()
+        if fields is not None:
+            kwargs.setdefault("fields", fields)
+        if self.expandable_fields:
+            kwargs.setdefault("expand", self.get_expand())
+        return super().get_serializer(*args, **kwargs)
+
+    def is_field_requested(self, name):
+        fields = self.get_sparse_fields()
+        return fields is None or name in fields
+
+    def defer_unrequested_fields(self, qs):
+        fields = self.get_sparse_fields()
+        if fields is None:
+            return qs
+        columns = {"id"}
+        columns.update(self.sparse_model_fields[name] for name in fields if name in self.sparse_model_fields)
+        return qs.only(*columns)
+
+
+class ConditionalGetMixin:
+    """
+    Условные GET-запросы (ETag) для list и retrieve.
+
+    Подкласс реализует `get_conditional_state(many)`: один легкий запрос,
+    возвращающий состояние, от которого зависит ответ, или None, если решить
+    заранее нельзя (например, объект не найден). Если клиент прислал
+    актуальный If-None-Match, отвечаем 304, не сериализуя данные.
+
+    Last-Modified не отдается: ответ меняют и записи без updated_at
+    (счетчики, подписки, удаления), а ETag строится по всему состоянию.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, True, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, False, request, *args, **kwargs)
+
+    def get_conditional_state(self, many):
+        raise NotImplementedError
+
+    def get_etag(self, parts):
+        # Представление зависит от пользователя (подписки, видимость) и параметров запроса
+        user = self.request.user
+        key = repr((parts, user.pk, is_moderator(user), self.request.get_full_path()))
+        return quote_etag(hashlib.sha256(key.encode()).hexdigest()[:40])
+
+    def conditional_response(self, handler, many, request, *args, **kwargs):
+        state = self.get_conditional_state(many)
+        if state is None:
+            return handler(request, *args, **kwargs)
+
+        etag = self.get_etag(state)
+        response = get_conditional_response(request._request, etag=etag)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+        response["ETag"] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ["Authorization"])
+        return response
+
+
+class RowListMixin:
+    """
+    Быстрый путь для GET-списков: строки `values()` + RowSerializer вместо
+    экземпляров модели и ModelSerializer. Ответ совпадает с обычным; если
+    набор полей не поддерживается RowSerializer (например, ?expand=lessons),
+    используется стандартный list().
+    """
+    use_row_serializer = True
+
+    def get_row_serializer(self):
+        if not self.use_row_serializer:
+            return None
+        return RowSerializer.for_serializer(self.get_serializer())
+
+    def list(self, request, *args, **kwargs):
+        row_serializer = self.get_row_serializer()
+        if row_serializer is None:
+            return super().list(request, *args, **kwargs)
+
+        # Ключ keyset-пагинации нужен пагинатору для курсора, даже если его нет в ответе
+        keyset_field = (getattr(self, "keyset_ordering", None) or "id").lstrip("-")
+        columns = list(dict.fromkeys(["id", keyset_field, *row_serializer.columns]))
+        queryset = self.filter_queryset(self.get_queryset()).values(*columns)
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(row_serializer.many_to_representation(page))
+        return Response(row_serializer.many_to_representation(queryset))
@@ -1,6 +1,17 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 
 
+class SearchableManager(models.Manager):
+    """
+    Менеджер по умолчанию для моделей с search_vector: колонку читает только
+    поиск (lms.search), остальным запросам она не нужна.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().defer("search_vector")
+
+
 class Course(models.Model):
     owner = models.ForeignKey(
         "users.User", related_name="courses", on_delete=models.CASCADE, null=True, blank=True
@@ -9,6 +20,15 @@ class Course(models.Model):
     preview = models.ImageField(upload_to="courses/", blank=True, null=True)
     description = models.TextField(blank=True)
     updated_at = models.DateTimeField(auto_now=True, null=True, blank=True)
+    # Денормализованные счетчики: поддерживаются lms.signals и lms.services,
+    # расхождения исправляет задача lms.tasks.repair_course_counters
+    lessons_count = models.PositiveIntegerField(default=0)
+    subscribers_count = models.PositiveIntegerField(default=0)
+    # На PostgreSQL заполняется триггером из title и description, индекс GIN
+    # (см. миграцию 0008). На других СУБД не используется.
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = SearchableManager()
 
     def __str__(self):
         return self.title
@@ -21,6 +41,23 @@ class Lesson(models.Model):
     description = models.TextField(blank=True)
     preview = models.ImageField(upload_to="lessons/", blank=True, null=True)
     video_url = models.URLField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True, null=True, blank=True)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = SearchableManager()
+
+    class Meta:
+        indexes = [
+            # Keyset-пагинация уроков курса: WHERE course_id = ? AND id > ? ORDER BY id
+            models.Index(fields=["course", "id"], name="lms_lesson_course_id_idx"),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Запоминаем курс, чтобы при переносе урока поправить счетчики обоих курсов
+        instance._loaded_course_id = instance.__dict__.get("course_id")
+        return instance
 
     def __str__(self):
         return self.title
@@ -39,3 +76,27 @@ class Subscription(models.Model):
 
     def __str__(self):
         return f"{self.user.email} подписан на {self.course.title}"
+
+
+class CourseDailyStats(models.Model):
+    """
+    Дневной срез по курсу для аналитики владельца (см. lms.analytics).
+
+    revenue и payments — оплаченные платежи за курс и его уроки по дате платежа;
+    new_subscribers — подписки, оформленные в этот день и действующие сейчас.
+    """
+    course = models.ForeignKey(Course, related_name="daily_stats", on_delete=models.CASCADE)
+    date = models.DateField()
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    payments = models.IntegerField(default=0)
+    new_subscribers = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["course", "date"], name="lms_coursedailystats_course_date_uniq"),
+        ]
+        verbose_name = "Статистика курса за день"
+        verbose_name_plural = "Статистика курсов по дням"
+
+    def __str__(self):
+        return f"{self.course_id} {self.date}"
@@ -1,9 +1,204 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def encode_keyset_cursor(value, pk, reverse=False):
+    """Кодирует позицию (ключ сортировки, id) в непрозрачную строку курсора"""
+    if isinstance(value, (datetime, date)):
+        value = value.isoformat()
+    elif isinstance(value, Decimal):
+        value = str(value)
+    position = {"v": value, "i": pk}
+    if reverse:
+        position["r"] = 1
+    encoded = base64.urlsafe_b64encode(json.dumps(position, separators=(",", ":")).encode("ascii"))
+    return encoded.decode("ascii").rstrip("=")
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset-пагинация по паре (ключ сортировки, id).
+
+    Не выполняет COUNT(*) и не использует OFFSET: каждая страница — это
+    `WHERE (key, id) > (last_key, last_id) ORDER BY key, id LIMIT n`,
+    поэтому глубокие страницы стоят столько же, сколько первая, а вставка
+    новых строк не сдвигает уже выданные страницы.
+
+    Ключ сортировки задается атрибутом `ordering` (или `keyset_ordering`
+    у view), "-" в начале — сортировка по убыванию. Поле должно быть
+    NOT NULL и входить в индекс вместе с id.
+    """
+    page_size = 10
+    page_size_query_param = "page_size"
+    max_page_size = 50
+    cursor_query_param = "cursor"
+    ordering = "id"
+    invalid_cursor_message = "Некорректный курсор"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.field, self.descending = self.get_ordering(view)
+
+        position = self.decode_cursor(request, queryset.model)
+        self.has_cursor = position is not None
+        self.reverse = bool(position and position["r"])
+
+        # При движении назад инвертируем порядок, а затем разворачиваем страницу
+        descending = self.descending != self.reverse
+        queryset = queryset.order_by(*self.get_order_by(descending))
+        if position is not None:
+            queryset = queryset.filter(self.get_keyset_filter(position["v"], position["i"], descending))
+
+        results = list(queryset[:self.page_size + 1])
+        self.has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if self.reverse:
+            results.reverse()
+        self.page = results
+        return results
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                return _positive_int(
+                    request.query_params[self.page_size_query_param],
+                    strict=True,
+                    cutoff=self.max_page_size,
+                )
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def get_ordering(self, view):
+        ordering = getattr(view, "keyset_ordering", None) or self.ordering
+        return ordering.lstrip("-"), ordering.startswith("-")
+
+    def get_order_by(self, descending):
+        prefix = "-" if descending else ""
+        if self.field in ("id", "pk"):
+            return [f"{prefix}pk"]
+        return [f"{prefix}{self.field}", f"{prefix}pk"]
+
+    def get_keyset_filter(self, value, pk, descending):
+        op = "lt" if descending else "gt"
+        if self.field in ("id", "pk"):
+            return Q(**{f"pk__{op}": pk})
+        return Q(**{f"{self.field}__{op}": value}) | Q(**{self.field: value, f"pk__{op}": pk})
+
+    def decode_cursor(self, request, model):
+        """
+        Позиция из курсора. Значения приводятся к типам полей модели (с их
+        проверками, в том числе диапазона), чтобы подделанный курсор давал
+        404, а не ошибку при выполнении запроса.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            padded = encoded + "=" * (-len(encoded) % 4)
+            position = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+            value = None
+            if self.field not in ("id", "pk"):
+                value = model._meta.get_field(self.field).clean(position["v"], None)
+            pk = model._meta.pk.clean(position["i"], None)
+            # Ключ сортировки NOT NULL (см. выше), None в позиции — подделка
+            if pk is None or (value is None and self.field not in ("id", "pk")):
+                raise ValueError
+            return {"v": value, "i": pk, "r": bool(position.get("r"))}
+        except (TypeError, ValueError, KeyError, AttributeError, UnicodeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, obj, reverse):
+        # Страница может состоять из моделей или из строк values() (RowListMixin)
+        if isinstance(obj, dict):
+            value, pk = obj.get(self.field), obj["id"]
+        else:
+            value, pk = getattr(obj, self.field), obj.pk
+        if self.field in ("id", "pk"):
+            value = None
+        cursor = encode_keyset_cursor(value, pk, reverse=reverse)
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        if not self.page:
+            return None
+        # Вперед можно идти, если есть еще строки или мы пришли сюда, двигаясь назад
+        if self.reverse or self.has_more:
+            return self.encode_cursor(self.page[-1], reverse=False)
+        return None
+
+    def get_previous_link(self):
+        if not self.page:
+            return None
+        has_previous = self.has_more if self.reverse else self.has_cursor
+        if has_previous:
+            return self.encode_cursor(self.page[0], reverse=True)
+        return None
+
+    def get_paginated_response(self, data):
+        return Response({
+            "next": self.get_next_link(),
+            "previous": self.get_previous_link(),
+            "results": data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+
+class CourseLessonKeysetPagination(KeysetPagination):
+    """Keyset-пагинатор для курсов и уроков"""
+    page_size = 10
+    page_size_query_param = "page_size"
+    max_page_size = 50
 
 
 class CourseLessonPagination(PageNumberPagination):
-    """Пагинатор для курсов и уроков"""
+    """
+    Пагинатор для курсов и уроков.
+
+    По умолчанию постраничный (`?page=`). Если в запросе передан `?cursor=`
+    или `?pagination=cursor`, переключается на keyset-пагинацию.
+    """
     page_size = 10
     page_size_query_param = "page_size"
     max_page_size = 50
+    mode_query_param = "pagination"
+    keyset_pagination_class = CourseLessonKeysetPagination
+
+    def use_keyset(self, request):
+        return (
+            request.query_params.get(self.mode_query_param) == "cursor"
+            or self.keyset_pagination_class.cursor_query_param in request.query_params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.use_keyset(request):
+            self.keyset = self.keyset_pagination_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
 
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -1,6 +1,6 @@
 from rest_framework.permissions import BasePermission
 
-from users.permissions import IsModerator
+from users.permissions import is_moderator
 
 
 class IsCourseOwner(BasePermission):
@@ -17,7 +17,7 @@ class IsOwnerOrModerator(BasePermission):
     """Object-level: owner or moderator."""
 
     def has_object_permission(self, request, view, obj):
-        if IsModerator().has_permission(request, view):
+        if is_moderator(request.user):
             return True
         owner = getattr(obj, "owner", None)
         return bool(request.user and request.user.is_authenticated and owner == request.user)
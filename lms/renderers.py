@@ -0,0 +1,41 @@
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # orjson есть в requirements.txt; без него рендерер работает как стандартный
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer на orjson с тем же JSON, что и стандартный.
+
+    Даты и прочие нестандартные типы передаются в кодировщик DRF, поэтому
+    их формат не меняется. Отличается только запись float: значения те же,
+    но orjson пишет очень малые числа без экспоненты (`0.00001` вместо
+    `1e-05`, `1e-7` вместо `1e-07`), а NaN и бесконечность — как `null`,
+    тогда как JSONRenderer на них падает. Если orjson не установлен, запрошен отступ
+    (`; indent=4`), включен ensure_ascii/не-компактный вывод или данные
+    orjson не поддерживает, используется стандартная реализация.
+    """
+    if orjson is not None:
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if (
+            orjson is None
+            or self.ensure_ascii
+            or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=self.options)
+        except (orjson.JSONEncodeError, TypeError):
+            return super().render(data, accepted_media_type, renderer_context)
+        # Как и JSONRenderer, экранируем U+2028/U+2029
+        if b"\xe2\x80\xa8" in ret or b"\xe2\x80\xa9" in ret:
+            ret = ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+        return ret
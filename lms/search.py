@@ -0,0 +1,308 @@
+"""
+Полнотекстовый поиск по курсам и урокам (title и description).
+
+На PostgreSQL запрос идет по колонке search_vector с индексом GIN, которую
+поддерживает триггер (миграция 0008). На остальных СУБД используется
+инвертированный индекс в памяти процесса: он строится при первом поиске,
+обновляется после коммита изменений и целиком перестраивается раз в
+FALLBACK_INDEX_TTL, чтобы подхватить изменения из других процессов.
+
+Индекс в памяти рассчитан только на разработку и тесты на SQLite: каждый
+процесс держит в памяти все курсы и уроки, а изменения из других процессов
+видны с задержкой до FALLBACK_INDEX_TTL. В продакшене поиск идет через
+PostgreSQL.
+"""
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection, transaction
+from django.db.models import F
+
+from lms.models import Course, Lesson
+from lms.services import visible_courses, visible_lessons
+from users.permissions import is_moderator
+
+SEARCH_CONFIG = "simple"
+MAX_TERMS = 8
+# Более короткие слова ищутся только целиком: префикс из одной-двух букв
+# совпадает с большей частью словаря
+MIN_PREFIX_LENGTH = 3
+# На PostgreSQL ранжируются не больше SEARCH_CANDIDATES совпадений каждого типа
+SEARCH_CANDIDATES = 1000
+FALLBACK_INDEX_TTL = 300
+
+# Веса полей в индексе в памяти; на PostgreSQL им соответствуют веса A и B
+TITLE_WEIGHT = 1.0
+DESCRIPTION_WEIGHT = 0.4
+# Совпадение только по префиксу слова ценится ниже точного
+PREFIX_FACTOR = 0.5
+
+_TOKEN_RE = re.compile(r"\w+")
+
+SEARCH_MODELS = {"course": Course, "lesson": Lesson}
+
+
+def search_terms(query):
+    """Слова запроса в нижнем регистре, без повторов, не больше MAX_TERMS"""
+    return list(dict.fromkeys(_TOKEN_RE.findall(query.lower())))[:MAX_TERMS]
+
+
+def search(user, query, types=None, limit=20):
+    """
+    Ищет курсы и уроки, доступные пользователю, по словам запроса.
+
+    Каждое слово от MIN_PREFIX_LENGTH букв ищется как префикс (для
+    автодополнения), более короткие — целиком; документ должен содержать
+    все слова. Возвращает до limit словарей
+    {"type", "id", "title", "course", "rank"} по убыванию релевантности.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return []
+    types = types or list(SEARCH_MODELS)
+    if connection.vendor == "postgresql":
+        results = _search_postgres(user, terms, types, limit)
+    else:
+        results = _search_fallback(user, terms, types, limit)
+    results.sort(key=lambda item: (-item["rank"], item["type"], item["id"]))
+    return results[:limit]
+
+
+def _visible_queryset(user, kind):
+    return visible_courses(user) if kind == "course" else visible_lessons(user)
+
+
+def is_prefix_term(term):
+    return len(term) >= MIN_PREFIX_LENGTH
+
+
+def _search_postgres(user, terms, types, limit):
+    # Слова состоят только из \w, поэтому их можно безопасно подставить в tsquery
+    query = SearchQuery(
+        " & ".join(f"'{term}':*" if is_prefix_term(term) else f"'{term}'" for term in terms),
+        search_type="raw",
+        config=SEARCH_CONFIG,
+    )
+    results = []
+    for kind in types:
+        columns = ["id", "title", "course_id"] if kind == "lesson" else ["id", "title"]
+        # Кандидаты выбираются по индексу GIN без сортировки и ограничиваются
+        # до ранжирования: ts_rank считается по каждой строке, и на частых
+        # словах ранжирование всех совпадений обходилось бы в полный просмотр
+        candidates = (
+            _visible_queryset(user, kind)
+            .filter(search_vector=query)
+            .order_by()
+            .values("pk")[:SEARCH_CANDIDATES]
+        )
+        rows = (
+            SEARCH_MODELS[kind].objects
+            .filter(pk__in=candidates)
+            .annotate(rank=SearchRank(F("search_vector"), query))
+            .order_by("-rank", "pk")
+            .values(*columns, "rank")[:limit]
+        )
+        results.extend(
+            {"type": kind, "id": row["id"], "title": row["title"], "course": row.get("course_id"), "rank": row["rank"]}
+            for row in rows
+        )
+    return results
+
+
+class InvertedIndex:
+    """
+    Инвертированный индекс: слово -> {документ: вес}.
+
+    Документ — пара (тип, id); для него хранятся заголовок, владелец и курс,
+    чтобы проверять видимость и формировать ответ без запросов к БД.
+    Префиксы ищутся двоичным поиском по отсортированному списку слов.
+    """
+
+    def __init__(self):
+        self.postings = defaultdict(dict)
+        self.documents = {}
+        self._tokens = None
+
+    def add(self, key, title, description, owner_id, course_id=None):
+        self.remove(key)
+        weights = {}
+        for token in _TOKEN_RE.findall(description.lower()):
+            weights[token] = DESCRIPTION_WEIGHT
+        for token in _TOKEN_RE.findall(title.lower()):
+            weights[token] = TITLE_WEIGHT
+        for token, weight in weights.items():
+            if token not in self.postings:
+                self._tokens = None
+            self.postings[token][key] = weight
+        self.documents[key] = (title, owner_id, course_id, tuple(weights))
+
+    def remove(self, key):
+        document = self.documents.pop(key, None)
+        if document is None:
+            return
+        for token in document[3]:
+            postings = self.postings[token]
+            postings.pop(key, None)
+            if not postings:
+                del self.postings[token]
+                self._tokens = None
+
+    def matching_tokens(self, term):
+        if not is_prefix_term(term):
+            if term in self.postings:
+                yield term
+            return
+        if self._tokens is None:
+            self._tokens = sorted(self.postings)
+        tokens = self._tokens
+        position = bisect_left(tokens, term)
+        while position < len(tokens) and tokens[position].startswith(term):
+            yield tokens[position]
+            position += 1
+
+    def search(self, terms):
+        """{документ: ранг} для документов, содержащих все слова"""
+        scores = None
+        for term in terms:
+            term_scores = {}
+            for token in self.matching_tokens(term):
+                factor = 1.0 if token == term else PREFIX_FACTOR
+                for key, weight in self.postings[token].items():
+                    score = weight * factor
+                    if score > term_scores.get(key, 0):
+                        term_scores[key] = score
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {key: score + term_scores[key] for key, score in scores.items() if key in term_scores}
+            if not scores:
+                return {}
+        return scores
+
+
+_index = None
+_index_built_at = 0.0
+# Защищает _index и _pending_reindex; перестройка идет без него
+_index_lock = threading.Lock()
+# Перестраивает индекс только один поток, остальные ищут по прежнему
+_rebuild_lock = threading.Lock()
+# Изменения, закоммиченные во время перестройки; применяются к новому индексу
+_pending_reindex = None
+
+
+def _document_rows(kind, pks=None):
+    model = SEARCH_MODELS[kind]
+    columns = ["id", "title", "description", "owner_id"] + (["course_id"] if kind == "lesson" else [])
+    qs = model.objects.order_by()
+    if pks is not None:
+        qs = qs.filter(pk__in=pks)
+    return qs.values_list(*columns).iterator(chunk_size=2000)
+
+
+def _index_rows(index, kind, rows):
+    for pk, title, description, owner_id, *course_id in rows:
+        index.add((kind, pk), title, description, owner_id, *course_id)
+
+
+def get_fallback_index():
+    """
+    Индекс в памяти; при устаревании перестраивается вне _index_lock.
+
+    Пока один поток читает строки из БД, остальные продолжают искать по
+    прежнему индексу и ждут только самую первую сборку.
+    """
+    index = _index
+    if index is not None and time.monotonic() - _index_built_at <= FALLBACK_INDEX_TTL:
+        return index
+    if not _rebuild_lock.acquire(blocking=index is None):
+        return index
+    try:
+        return _rebuild_fallback_index()
+    finally:
+        _rebuild_lock.release()
+
+
+def _rebuild_fallback_index():
+    global _index, _index_built_at, _pending_reindex
+    with _index_lock:
+        if _index is not None and time.monotonic() - _index_built_at <= FALLBACK_INDEX_TTL:
+            return _index
+        _pending_reindex = []
+    built_at = time.monotonic()
+    index = InvertedIndex()
+    try:
+        for kind in SEARCH_MODELS:
+            _index_rows(index, kind, _document_rows(kind))
+    except BaseException:
+        with _index_lock:
+            _pending_reindex = None
+        raise
+    with _index_lock:
+        pending, _pending_reindex = _pending_reindex, None
+        if pending is None:
+            # Индекс сбросили во время сборки
+            return index
+        for kind, pks in pending:
+            _apply_reindex(index, kind, pks)
+        _index, _index_built_at = index, built_at
+        return index
+
+
+def reset_fallback_index():
+    global _index, _pending_reindex
+    with _index_lock:
+        _index = None
+        _pending_reindex = None
+
+
+def _apply_reindex(index, kind, pks):
+    for pk in pks:
+        index.remove((kind, pk))
+    _index_rows(index, kind, _document_rows(kind, pks))
+
+
+def _reindex(kind, pks):
+    with _index_lock:
+        if _pending_reindex is not None:
+            _pending_reindex.append((kind, pks))
+        if _index is not None:
+            _apply_reindex(_index, kind, pks)
+
+
+def reindex_documents(kind, pks):
+    """
+    Обновляет документы индекса в памяти после коммита текущей транзакции.
+    Удаленные документы просто пропадают из индекса. На PostgreSQL не нужно:
+    search_vector пересчитывает триггер.
+    """
+    if connection.vendor == "postgresql":
+        return
+    pks = list(pks)
+    if pks:
+        transaction.on_commit(lambda: _reindex(kind, pks))
+
+
+def _search_fallback(user, terms, types, limit):
+    index = get_fallback_index()
+    # Те же правила, что в visible_courses / visible_lessons
+    sees_all = is_moderator(user)
+    # _reindex меняет индекс на месте, поэтому читаем его под блокировкой
+    with _index_lock:
+        return _collect_fallback(index, user, sees_all, terms, types)
+
+
+def _collect_fallback(index, user, sees_all, terms, types):
+    scores = index.search(terms)
+    results = []
+    for (kind, pk), rank in scores.items():
+        if kind not in types:
+            continue
+        title, owner_id, course_id, _ = index.documents[(kind, pk)]
+        if not sees_all and owner_id != user.pk:
+            continue
+        results.append({"type": kind, "id": pk, "title": title, "course": course_id, "rank": rank})
+    return results
@@ -1,15 +1,177 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.urls import reverse
+from django.utils import timezone
+from drf_spectacular.utils import extend_schema_field
 from rest_framework import serializers
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
 
 from lms.models import Course, Lesson, Subscription
-from lms.validators import (
-    YouTubeURLValidator,
-    validate_no_external_links,
-    validate_youtube_url,
-)
+from lms.paginators import KeysetPagination, encode_keyset_cursor
+from lms.search import search_terms
+from lms.validators import validate_no_external_links, validate_youtube_url
+
+User = get_user_model()
+
+
+class DynamicFieldsMixin:
+    """Позволяет ограничить набор полей ответа: `Serializer(..., fields=["id", "title"])`."""
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop("fields", None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class RowSerializer:
+    """
+    Быстрый read-only путь сериализации списков.
+
+    Работает со строками `values()` вместо экземпляров модели и применяет к ним
+    to_representation тех же полей, что и исходный сериализатор, поэтому
+    результат совпадает с ответом ModelSerializer байт в байт. Значения
+    SerializerMethodField берутся из колонок, перечисленных в `row_sources`
+    сериализатора; если поле нельзя получить из `values()` (вложенные
+    сериализаторы, составные source), быстрый путь недоступен.
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.columns = list(dict.fromkeys(column for _, column, _ in fields))
+
+    @classmethod
+    def for_serializer(cls, serializer):
+        """Строит RowSerializer по экземпляру сериализатора или возвращает None."""
+        row_sources = getattr(serializer, "row_sources", {})
+        fields = []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if name in row_sources:
+                fields.append((name, row_sources[name], None))
+            elif isinstance(field, (serializers.SerializerMethodField, serializers.BaseSerializer)):
+                return None
+            elif field.source == "*" or "." in field.source:
+                return None
+            elif isinstance(field, serializers.FileField):
+                fields.append((name, field.source, cls.file_converter(serializer, field)))
+            elif isinstance(field, (serializers.ReadOnlyField, serializers.PrimaryKeyRelatedField)):
+                # values() уже возвращает id связанного объекта
+                fields.append((name, field.source, None))
+            else:
+                fields.append((name, field.source, field.to_representation))
+        return cls(fields)
+
+    @staticmethod
+    def file_converter(serializer, field):
+        """Повторяет FileField.to_representation для имени файла из values()"""
+        storage = serializer.Meta.model._meta.get_field(field.source).storage
+        use_url = getattr(field, "use_url", api_settings.UPLOADED_FILES_USE_URL)
+        request = field.context.get("request")
+
+        def convert(name):
+            if not name:
+                return None
+            if not use_url:
+                return name
+            url = storage.url(name)
+            if request is not None:
+                return request.build_absolute_uri(url)
+            return url
+        return convert
+
+    def to_representation(self, row):
+        ret = {}
+        for name, column, convert in self.fields:
+            value = row[column]
+            ret[name] = value if value is None or convert is None else convert(value)
+        return ret
+
+    def many_to_representation(self, rows):
+        return [self.to_representation(row) for row in rows]
+
+
+class PreloadedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    PrimaryKeyRelatedField, который сначала ищет объект среди заранее загруженных
+    в `context["preloaded"][<имя поля>]` (см. LessonListSerializer), а в базу
+    идет только за отсутствующими.
+    """
+
+    def to_internal_value(self, data):
+        preloaded = self.context.get("preloaded", {}).get(self.field_name)
+        if preloaded:
+            try:
+                obj = preloaded.get(self.get_queryset().model._meta.pk.to_python(data))
+            except (TypeError, ValueError, DjangoValidationError):
+                obj = None
+            if obj is not None:
+                return obj
+        return super().to_internal_value(data)
+
+
+class LessonListSerializer(serializers.ListSerializer):
+    """
+    Массовое создание и обновление уроков: курсы всех элементов загружаются
+    одним запросом, запись — одним bulk_create / bulk_update.
+    """
+    max_items = 1000
+
+    def __init__(self, *args, **kwargs):
+        # ListSerializer берет max_length только из kwargs, атрибут класса он перезаписывает
+        kwargs.setdefault("max_length", self.max_items)
+        super().__init__(*args, **kwargs)
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            course_ids = {item.get("course") for item in data if isinstance(item, dict)}
+            course_ids = [pk for pk in course_ids if isinstance(pk, int) or (isinstance(pk, str) and pk.isdigit())]
+            self.context.setdefault("preloaded", {})["course"] = Course.objects.in_bulk(course_ids)
+        return super().to_internal_value(data)
+
+    @staticmethod
+    def get_item_id(data):
+        try:
+            return int(data["id"])
+        except (TypeError, ValueError, KeyError):
+            return None
+
+    def run_child_validation(self, data):
+        # При обновлении каждому элементу соответствует свой урок (self.instance — dict по id)
+        if self.instance is not None:
+            self.child.instance = self.instance.get(self.get_item_id(data))
+            if self.child.instance is None:
+                raise serializers.ValidationError({"id": ["Урок не найден"]})
+            self.child.initial_data = data
+        return super().run_child_validation(data)
 
+    def create(self, validated_data):
+        return Lesson.objects.bulk_create([Lesson(**attrs) for attrs in validated_data])
 
-class LessonSerializer(serializers.ModelSerializer):
-    owner = serializers.ReadOnlyField(source="owner.id")
+    def update(self, instance, validated_data):
+        now = timezone.now()
+        fields = {"updated_at"}
+        lessons = {}
+        for item, attrs in zip(self.initial_data, validated_data):
+            lesson = instance[self.get_item_id(item)]
+            for name, value in attrs.items():
+                setattr(lesson, name, value)
+                fields.add(name)
+            # bulk_update не вызывает pre_save, поэтому auto_now выставляем сами
+            lesson.updated_at = now
+            lessons[lesson.pk] = lesson
+        Lesson.objects.bulk_update(list(lessons.values()), sorted(fields), batch_size=500)
+        return list(lessons.values())
+
+
+class LessonSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    owner = serializers.ReadOnlyField(source="owner_id")
+    course = PreloadedPrimaryKeyRelatedField(queryset=Course.objects.all())
     video_url = serializers.URLField(validators=[validate_youtube_url], required=False, allow_blank=True)
     description = serializers.CharField(validators=[validate_no_external_links], required=False, allow_blank=True)
 
@@ -17,30 +179,159 @@ class LessonSerializer(serializers.ModelSerializer):
         model = Lesson
         fields = ["id", "owner", "course", "title", "description", "preview", "video_url"]
         read_only_fields = ["id", "owner"]
-        validators = [YouTubeURLValidator(field='video_url')]
+        list_serializer_class = LessonListSerializer
 
 
-class CourseSerializer(serializers.ModelSerializer):
-    owner = serializers.ReadOnlyField(source="owner.id")
-    lessons_count = serializers.SerializerMethodField()
-    lessons = LessonSerializer(many=True, read_only=True)
+class CourseSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    owner = serializers.ReadOnlyField(source="owner_id")
+    lessons = serializers.SerializerMethodField()
+    lessons_next = serializers.SerializerMethodField()
     is_subscribed = serializers.SerializerMethodField()
     description = serializers.CharField(validators=[validate_no_external_links], required=False, allow_blank=True)
 
+    # Колонки values(), из которых RowSerializer берет значения вычисляемых полей
+    row_sources = {
+        "is_subscribed": "annotated_is_subscribed",
+    }
+    # Сколько уроков отдается внутри курса при ?expand=lessons,
+    # остальные доступны по ссылке lessons_next
+    lessons_limit = 20
+    expanded_fields = ["lessons", "lessons_next"]
+
     class Meta:
         model = Course
-        fields = ["id", "owner", "title", "description", "preview", "lessons_count", "lessons", "is_subscribed"]
-        read_only_fields = ["id", "owner", "lessons_count", "lessons", "is_subscribed"]
+        fields = [
+            "id", "owner", "title", "description", "preview",
+            "lessons_count", "subscribers_count", "lessons", "lessons_next", "is_subscribed",
+        ]
+        read_only_fields = [
+            "id", "owner", "lessons_count", "subscribers_count", "lessons", "lessons_next", "is_subscribed",
+        ]
 
-    def get_lessons_count(self, obj):
-        return obj.lessons.count()
+    def __init__(self, *args, expand=(), **kwargs):
+        expand_lessons = "lessons" in expand
+        if expand_lessons and kwargs.get("fields") is not None:
+            kwargs["fields"] = [*kwargs["fields"], *self.expanded_fields]
+        super().__init__(*args, **kwargs)
+        if not expand_lessons:
+            for name in self.expanded_fields:
+                self.fields.pop(name, None)
+
+    def get_expanded_lessons(self, obj):
+        """Первые lessons_limit + 1 уроков курса (лишний показывает, что есть продолжение)"""
+        lessons = getattr(obj, "expanded_lessons", None)
+        if lessons is None:
+            lessons = list(obj.lessons.order_by("id")[:self.lessons_limit + 1])
+            obj.expanded_lessons = lessons
+        return lessons
+
+    @extend_schema_field(LessonSerializer(many=True))
+    def get_lessons(self, obj):
+        lessons = self.get_expanded_lessons(obj)[:self.lessons_limit]
+        return LessonSerializer(lessons, many=True, context=self.context).data
+
+    @extend_schema_field(serializers.URLField(allow_null=True))
+    def get_lessons_next(self, obj):
+        """
+        Ссылка на продолжение списка уроков: keyset-курсор по
+        /api/courses/<id>/lessons/, где видимость та же, что у самого курса
+        """
+        lessons = self.get_expanded_lessons(obj)
+        if len(lessons) <= self.lessons_limit:
+            return None
+        url = reverse("course-lessons", kwargs={"pk": obj.pk})
+        request = self.context.get("request")
+        if request is not None:
+            url = request.build_absolute_uri(url)
+        cursor = encode_keyset_cursor(None, lessons[self.lessons_limit - 1].pk)
+        return replace_query_param(url, KeysetPagination.cursor_query_param, cursor)
 
     def get_is_subscribed(self, obj):
         """Проверяет, подписан ли текущий пользователь на курс"""
+        annotated = getattr(obj, "annotated_is_subscribed", None)
+        if annotated is not None:
+            return annotated
         request = self.context.get("request")
         if request and request.user.is_authenticated:
             return Subscription.objects.filter(user=request.user, course=obj).exists()
         return False
 
 
+class SubscriptionBulkSerializer(serializers.Serializer):
+    """Массовая подписка/отписка: все пользователи × все курсы"""
+    SUBSCRIBE = "subscribe"
+    UNSUBSCRIBE = "unsubscribe"
+
+    action = serializers.ChoiceField(choices=[SUBSCRIBE, UNSUBSCRIBE])
+    users = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=50000)
+    courses = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=100)
+
+    def validate_users(self, value):
+        value = set(value)
+        found = set(User.objects.filter(pk__in=value).values_list("pk", flat=True))
+        missing = value - found
+        if missing:
+            raise serializers.ValidationError(f"Пользователи не найдены: {sorted(missing)[:20]}")
+        return value
+
+    def validate_courses(self, value):
+        value = set(value)
+        found = set(Course.objects.filter(pk__in=value).values_list("pk", flat=True))
+        missing = value - found
+        if missing:
+            raise serializers.ValidationError(f"Курсы не найдены: {sorted(missing)}")
+        return value
+
+
+class SubscriptionStatusSerializer(serializers.Serializer):
+    """Ответ на пакетную проверку подписок"""
+    subscribed = serializers.ListField(child=serializers.IntegerField())
+
+
+class SearchQuerySerializer(serializers.Serializer):
+    """Параметры поиска"""
+    q = serializers.CharField(max_length=200)
+    type = serializers.ChoiceField(choices=["course", "lesson"], required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=50, default=20)
+
+    def validate_q(self, value):
+        if not search_terms(value):
+            raise serializers.ValidationError("Запрос должен содержать хотя бы одно слово")
+        return value
+
+
+class SearchResultSerializer(serializers.Serializer):
+    """Найденный курс или урок"""
+    type = serializers.CharField()
+    id = serializers.IntegerField()
+    title = serializers.CharField()
+    course = serializers.IntegerField(allow_null=True)
+    rank = serializers.FloatField()
+
+
+class AnalyticsQuerySerializer(serializers.Serializer):
+    """Параметры аналитики: период (по умолчанию последние 30 дней), курс и шаг"""
+    max_days = 366
+
+    course = serializers.IntegerField(required=False)
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    bucket = serializers.ChoiceField(choices=["day", "week", "month"], default="day")
+
+    def validate(self, attrs):
+        attrs.setdefault("date_to", timezone.localdate())
+        attrs.setdefault("date_from", attrs["date_to"] - timedelta(days=29))
+        if attrs["date_from"] > attrs["date_to"]:
+            raise serializers.ValidationError("date_from не может быть позже date_to")
+        if (attrs["date_to"] - attrs["date_from"]).days >= self.max_days:
+            raise serializers.ValidationError(f"Период не может быть длиннее {self.max_days} дней")
+        return attrs
+
 
+class CourseStatsSerializer(serializers.Serializer):
+    """Выручка и новые подписчики курса за период"""
+    course = serializers.IntegerField()
+    period = serializers.DateField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+    payments = serializers.IntegerField()
+    new_subscribers = serializers.IntegerField()
@@ -0,0 +1,137 @@
+"""
+Сервисные функции LMS
+"""
+from collections import Counter
+from datetime import timedelta
+from functools import partial
+from itertools import islice
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, Count, F, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from lms.analytics import record_subscriptions, subscriptions_by_day
+from lms.models import Course, Lesson, Subscription
+from lms.tasks import send_course_update_notification
+from users.permissions import is_moderator
+
+# Подписчики получают не больше одного уведомления об обновлении курса за этот интервал
+COURSE_NOTIFY_INTERVAL = timedelta(hours=4)
+
+
+def visible_courses(user):
+    """Курсы, доступные пользователю: модератору — все, остальным — свои"""
+    qs = Course.objects.all()
+    if is_moderator(user):
+        return qs
+    return qs.filter(owner=user)
+
+
+def visible_lessons(user):
+    """Уроки, доступные пользователю: модератору — все, остальным — свои"""
+    qs = Lesson.objects.all()
+    if is_moderator(user):
+        return qs
+    return qs.filter(owner=user)
+
+
+def course_notify_key(course_id):
+    return f"lms:course-notify:{course_id}"
+
+
+def _dispatch_course_notification(course_id):
+    # cache.add атомарен (SET NX в Redis): из всех конкурентных изменений курса
+    # окно открывает ровно одно, остальные до его истечения ничего не ставят
+    if cache.add(course_notify_key(course_id), True, int(COURSE_NOTIFY_INTERVAL.total_seconds())):
+        send_course_update_notification.delay(course_id)
+
+
+def notify_courses_changed(course_ids):
+    """
+    Принимает событие «курс изменился» от любого view или массовой операции
+    и ставит уведомление подписчикам не чаще раза в COURSE_NOTIFY_INTERVAL.
+
+    Запросов к БД не делает. Окно открывается после коммита транзакции,
+    поэтому откаченное изменение его не занимает, а несколько изменений
+    одного курса в транзакции дают одну проверку.
+    """
+    for course_id in set(course_ids):
+        transaction.on_commit(partial(_dispatch_course_notification, course_id))
+
+
+def mark_courses_updated(course_ids):
+    """
+    Отмечает курсы обновленными одним UPDATE и уведомляет подписчиков
+    через notify_courses_changed.
+
+    Используется массовыми операциями с уроками, которые не вызывают сигналы
+    моделей: сколько бы уроков ни изменилось, на курс приходится одно событие.
+    """
+    course_ids = set(course_ids)
+    if not course_ids:
+        return
+    Course.objects.filter(pk__in=course_ids).update(updated_at=timezone.now())
+    notify_courses_changed(course_ids)
+
+
+def adjust_course_counters(field, deltas):
+    """
+    Атомарно сдвигает денормализованный счетчик курсов (lessons_count или
+    subscribers_count) одним UPDATE. deltas — {course_id: изменение}.
+    """
+    deltas = {course_id: delta for course_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    shift = Case(*[When(pk=course_id, then=Value(delta)) for course_id, delta in deltas.items()], default=Value(0))
+    Course.objects.filter(pk__in=deltas).update(**{field: Greatest(F(field) + shift, Value(0))})
+
+
+def count_by_course(queryset):
+    """Число строк queryset по курсам одним GROUP BY: {course_id: количество}"""
+    return dict(queryset.order_by().values("course").annotate(total=Count("pk")).values_list("course", "total"))
+
+
+def subscribe_users(user_ids, course_ids, batch_size=1000):
+    """
+    Подписывает всех пользователей на все курсы множественными INSERT.
+
+    Уже существующие подписки пропускаются (ignore_conflicts по unique_together).
+    Возвращает количество созданных подписок.
+    """
+    user_ids, course_ids = set(user_ids), set(course_ids)
+    existing = Subscription.objects.filter(user_id__in=user_ids, course_id__in=course_ids)
+    before = count_by_course(existing)
+    pairs = ((user_id, course_id) for user_id in user_ids for course_id in course_ids)
+    # Пачками, чтобы не держать в памяти все пары пользователь × курс
+    while batch := list(islice(pairs, batch_size)):
+        Subscription.objects.bulk_create(
+            [Subscription(user_id=user_id, course_id=course_id) for user_id, course_id in batch],
+            ignore_conflicts=True,
+        )
+    after = count_by_course(existing)
+    created = {course_id: total - before.get(course_id, 0) for course_id, total in after.items()}
+    adjust_course_counters("subscribers_count", created)
+    record_subscriptions(created)
+    return sum(created.values())
+
+
+def unsubscribe_users(user_ids, course_ids):
+    """Удаляет подписки пользователей на курсы одним DELETE. Возвращает количество удаленных."""
+    subscriptions = Subscription.objects.filter(user_id__in=set(user_ids), course_id__in=set(course_ids))
+    removed = subscriptions_by_day(subscriptions)
+    deleted, _ = subscriptions.delete()
+    by_course = Counter()
+    for (course_id, _), total in removed.items():
+        by_course[course_id] -= total
+    adjust_course_counters("subscribers_count", by_course)
+    record_subscriptions({key: -total for key, total in removed.items()})
+    return deleted
+
+
+def get_subscribed_course_ids(user, course_ids):
+    """Возвращает id курсов из course_ids, на которые подписан пользователь (один запрос)."""
+    return set(
+        Subscription.objects.filter(user=user, course_id__in=set(course_ids)).values_list("course_id", flat=True)
+    )
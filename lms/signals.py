@@ -0,0 +1,69 @@
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from lms.analytics import record_payment_status_change
+from lms.models import Course, Lesson
+from lms.search import reindex_documents
+from users.models import Payment
+
+
+def touch_course(course_id, lessons_delta=0):
+    """
+    Обновляет Course.updated_at (изменение урока меняет и курс) и счетчик
+    уроков одним UPDATE без загрузки курса.
+    """
+    values = {"updated_at": timezone.now()}
+    if lessons_delta:
+        values["lessons_count"] = F("lessons_count") + lessons_delta
+    Course.objects.filter(pk=course_id).update(**values)
+
+
+@receiver(post_save, sender=Lesson)
+def touch_course_on_lesson_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous_course_id = getattr(instance, "_loaded_course_id", None)
+    if created:
+        touch_course(instance.course_id, lessons_delta=1)
+    elif previous_course_id is not None and previous_course_id != instance.course_id:
+        touch_course(previous_course_id, lessons_delta=-1)
+        touch_course(instance.course_id, lessons_delta=1)
+    else:
+        touch_course(instance.course_id)
+    instance._loaded_course_id = instance.course_id
+
+
+@receiver(post_delete, sender=Lesson)
+def touch_course_on_lesson_delete(sender, instance, origin=None, **kwargs):
+    # При удалении самого курса каскадом обновлять его незачем
+    if isinstance(origin, Course) or getattr(origin, "model", None) is Course:
+        return
+    touch_course(instance.course_id, lessons_delta=-1)
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+def reindex_course(sender, instance, raw=False, **kwargs):
+    if not raw:
+        reindex_documents("course", [instance.pk])
+
+
+@receiver(post_save, sender=Lesson)
+@receiver(post_delete, sender=Lesson)
+def reindex_lesson(sender, instance, raw=False, **kwargs):
+    if not raw:
+        reindex_documents("lesson", [instance.pk])
+
+
+@receiver(post_save, sender=Payment)
+def update_stats_on_payment_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        record_payment_status_change(instance, previous_status=None)
+    elif hasattr(instance, "_loaded_payment_status"):
+        record_payment_status_change(instance, previous_status=instance._loaded_payment_status)
+    instance._loaded_payment_status = instance.payment_status
+
@@ -0,0 +1,405 @@
+"""
+Синтетические данные для нагрузочного тестирования и оценки емкости.
+
+Объем задается параметрами Plan (например, 1M пользователей и 10M
+платежей). Распределения скошены, как в живой системе: курсы у немногих
+авторов, популярность курсов и активность покупателей подчиняются закону
+Ципфа, число уроков и подписок — логнормальное.
+
+Данные строятся чанками. Строки чанка зависят только от seed, вида данных
+и номера чанка, поэтому результат не зависит от числа воркеров и порядка
+выполнения. id пользователей, курсов, уроков и платежей назначаются заранее
+(после текущего максимума), и воркеры ссылаются на них, не читая БД. Чанк
+пишется одной транзакцией: на PostgreSQL — через COPY, на других СУБД —
+через executemany. Модели и сигналы не участвуют: пароль хешируется один
+раз на всех, а счетчики курсов и сводная статистика пересчитываются в
+конце задачами ремонта.
+"""
+import io
+import math
+import random
+import time
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, replace
+from datetime import datetime, timedelta
+from decimal import Decimal
+from functools import lru_cache
+from itertools import accumulate
+from multiprocessing import get_context
+
+from django.core.management.color import no_style
+from django.db import connection, connections, transaction
+from django.db.models import Max
+
+from lms.models import Course, Lesson, Subscription
+from users.models import Payment, User
+
+# Доля пользователей-авторов курсов
+AUTHORS_SHARE = 0.05
+MAX_LESSONS_PER_COURSE = 80
+MAX_SUBSCRIPTIONS_PER_USER = 200
+# Доля оплат отдельных уроков
+LESSON_PAYMENT_SHARE = 0.15
+EMAIL_DOMAIN = "load.example.com"
+CENT = Decimal("0.01")
+
+FIRST_NAMES = ["Анна", "Иван", "Мария", "Алексей", "Ольга", "Дмитрий", "Елена", "Сергей", "Наталья", "Павел"]
+LAST_NAMES = ["Иванов", "Смирнова", "Кузнецов", "Попова", "Соколов", "Лебедева", "Козлов", "Новикова"]
+CITIES = [("Москва", 40), ("Санкт-Петербург", 20), ("Казань", 8), ("Новосибирск", 7), ("Екатеринбург", 7),
+          ("Алматы", 5), ("Минск", 5), ("", 8)]
+TOPICS = ["Python", "Django", "SQL", "Data Science", "DevOps", "Frontend", "Design", "Management", "English"]
+LEVELS = ["для начинающих", "продвинутый", "интенсив", "практикум", "с нуля"]
+WORDS = ["курс", "урок", "практика", "задание", "проект", "теория", "пример", "разбор", "код", "данные"]
+PRICE_TIERS = [("9.99", 20), ("19.99", 30), ("29.99", 20), ("49.99", 15), ("99.99", 10), ("199.99", 5)]
+STATUSES = [(Payment.PaymentStatus.PAID, 80), (Payment.PaymentStatus.PENDING, 12), (Payment.PaymentStatus.CANCELLED, 8)]
+METHODS = [(Payment.PaymentMethod.STRIPE, 70), (Payment.PaymentMethod.TRANSFER, 20), (Payment.PaymentMethod.CASH, 10)]
+
+# Порядок важен: каждый вид ссылается на предыдущие
+KINDS = ("users", "courses", "lessons", "subscriptions", "payments")
+
+
+@dataclass(frozen=True)
+class Plan:
+    users: int
+    courses: int
+    payments: int
+    password_hash: str
+    now: datetime
+    seed: int = 0
+    lessons_per_course: float = 8.0
+    subscriptions_per_user: float = 3.0
+    days: int = 365
+    zipf: float = 1.1
+    chunk_size: int = 10000
+    # Заполняются prepare_plan()
+    user_offset: int = 1
+    course_offset: int = 1
+    lesson_offset: int = 1
+    payment_offset: int = 1
+    lesson_counts: tuple = field(default=(), repr=False)
+    lesson_starts: tuple = field(default=(), repr=False)
+
+    @property
+    def authors(self):
+        return max(1, int(self.users * AUTHORS_SHARE))
+
+    @property
+    def lessons(self):
+        return sum(self.lesson_counts)
+
+
+def prepare_plan(plan):
+    """
+    Дополняет план id, с которых начинаются новые строки, и числом уроков
+    каждого курса (по нему воркеры находят id уроков курса).
+    """
+    offsets = {
+        name: (model.objects.aggregate(last=Max("pk"))["last"] or 0) + 1
+        for name, model in (("user", User), ("course", Course), ("lesson", Lesson), ("payment", Payment))
+    }
+    rng = random.Random(f"{plan.seed}:lesson-counts")
+    mu, sigma = _lognormal_params(plan.lessons_per_course, 0.6)
+    counts = tuple(
+        max(1, min(MAX_LESSONS_PER_COURSE, round(rng.lognormvariate(mu, sigma)))) for _ in range(plan.courses)
+    )
+    return replace(
+        plan,
+        user_offset=offsets["user"],
+        course_offset=offsets["course"],
+        lesson_offset=offsets["lesson"],
+        payment_offset=offsets["payment"],
+        lesson_counts=counts,
+        lesson_starts=tuple(accumulate(counts, initial=0)),
+    )
+
+
+def chunks(plan, kind):
+    """Диапазоны чанков вида данных: пользователей, курсов или платежей"""
+    if kind == "users":
+        total, size = plan.users, plan.chunk_size
+    elif kind == "courses":
+        total, size = plan.courses, plan.chunk_size
+    elif kind == "lessons":
+        # Уроки строятся по курсам: чанк — курсы, у которых вместе около chunk_size уроков
+        total, size = plan.courses, max(1, int(plan.chunk_size / max(plan.lessons_per_course, 1)))
+    elif kind == "subscriptions":
+        total, size = plan.users, max(1, int(plan.chunk_size / max(plan.subscriptions_per_user, 1)))
+    else:
+        total, size = plan.payments, plan.chunk_size
+    return [(start, min(start + size, total)) for start in range(0, total, size)]
+
+
+def chunk_rows(plan, kind, start, stop):
+    """Строки чанка: (таблица, колонки, список строк). Зависят только от плана и границ чанка"""
+    rng = random.Random(f"{plan.seed}:{kind}:{start}")
+    return ROW_BUILDERS[kind](plan, rng, start, stop)
+
+
+def _user_rows(plan, rng, start, stop):
+    columns = [
+        "id", "email", "password", "first_name", "last_name", "phone", "city",
+        "is_active", "is_staff", "is_superuser", "date_joined", "last_login",
+    ]
+    rows = []
+    for i in range(start, stop):
+        pk = plan.user_offset + i
+        joined = plan.now - timedelta(days=plan.days * rng.random())
+        # Каждый десятый ни разу не входил
+        last_login = None if rng.random() < 0.1 else joined + (plan.now - joined) * rng.random() ** 0.5
+        rows.append((
+            pk, f"user{pk}@{EMAIL_DOMAIN}", plan.password_hash,
+            rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), "", _weighted(rng, CITIES),
+            rng.random() >= 0.03, False, False, joined, last_login,
+        ))
+    return User, columns, rows
+
+
+def _course_rows(plan, rng, start, stop):
+    columns = ["id", "owner_id", "title", "description", "updated_at", "lessons_count", "subscribers_count"]
+    rows = []
+    for i in range(start, stop):
+        rows.append((
+            plan.course_offset + i,
+            course_owner_id(plan, i),
+            f"{rng.choice(TOPICS)} {rng.choice(LEVELS)} #{i}",
+            _text(rng, 20, 120),
+            plan.now - timedelta(days=plan.days * rng.random()),
+            0,
+            0,
+        ))
+    return Course, columns, rows
+
+
+def _lesson_rows(plan, rng, start, stop):
+    columns = ["id", "owner_id", "course_id", "title", "description", "video_url", "updated_at"]
+    rows = []
+    for course in range(start, stop):
+        owner_id = course_owner_id(plan, course)
+        first = plan.lesson_offset + plan.lesson_starts[course]
+        for number in range(plan.lesson_counts[course]):
+            rows.append((
+                first + number,
+                owner_id,
+                plan.course_offset + course,
+                f"Урок {number + 1}: {rng.choice(WORDS)}",
+                _text(rng, 10, 80),
+                f"https://www.youtube.com/watch?v=load{course}x{number}",
+                plan.now - timedelta(days=plan.days * rng.random()),
+            ))
+    return Lesson, columns, rows
+
+
+def _subscription_rows(plan, rng, start, stop):
+    columns = ["user_id", "course_id", "created_at"]
+    mu, sigma = _lognormal_params(plan.subscriptions_per_user, 1.0)
+    limit = min(MAX_SUBSCRIPTIONS_PER_USER, plan.courses)
+    rows = []
+    for i in range(start, stop):
+        wanted = min(limit, round(rng.lognormvariate(mu, sigma)))
+        courses = set()
+        # Популярные курсы выпадают чаще — повторы отбрасываются, число попыток ограничено
+        for _ in range(wanted * 20):
+            if len(courses) >= wanted:
+                break
+            courses.add(zipf_index(rng, plan.courses, plan.zipf))
+        user_id = plan.user_offset + i
+        for course in sorted(courses):
+            rows.append((user_id, plan.course_offset + course, plan.now - timedelta(days=plan.days * rng.random())))
+    return Subscription, columns, rows
+
+
+def _payment_rows(plan, rng, start, stop):
+    columns = [
+        "id", "user_id", "paid_course_id", "paid_lesson_id", "amount",
+        "payment_method", "payment_status", "payment_date",
+    ]
+    rows = []
+    for i in range(start, stop):
+        course = zipf_index(rng, plan.courses, plan.zipf)
+        price = course_price(plan, course)
+        if rng.random() < LESSON_PAYMENT_SHARE:
+            lesson = plan.lesson_starts[course] + int(rng.random() * plan.lesson_counts[course])
+            paid_course, paid_lesson, amount = None, plan.lesson_offset + lesson, (price / 5).quantize(CENT)
+        else:
+            paid_course, paid_lesson, amount = plan.course_offset + course, None, price
+        rows.append((
+            plan.payment_offset + i,
+            plan.user_offset + zipf_index(rng, plan.users, plan.zipf),
+            paid_course,
+            paid_lesson,
+            amount,
+            _weighted(rng, METHODS),
+            _weighted(rng, STATUSES),
+            # Свежих платежей больше, чем старых
+            plan.now - timedelta(days=plan.days * rng.random() ** 2),
+        ))
+    return Payment, columns, rows
+
+
+ROW_BUILDERS = {
+    "users": _user_rows,
+    "courses": _course_rows,
+    "lessons": _lesson_rows,
+    "subscriptions": _subscription_rows,
+    "payments": _payment_rows,
+}
+
+
+@lru_cache(maxsize=8)
+def _zipf_cum_weights(n, s):
+    return list(accumulate(1 / rank ** s for rank in range(1, n + 1)))
+
+
+def _scramble(rank, n):
+    """Ранг -> индекс: самые популярные объекты разбросаны по диапазону, а не идут первыми"""
+    stride = 2654435761
+    return rank * stride % n if math.gcd(stride, n) == 1 else rank
+
+
+def zipf_index(rng, n, s):
+    """Индекс 0..n-1 по закону Ципфа с параметром s"""
+    weights = _zipf_cum_weights(n, s)
+    return _scramble(bisect_right(weights, rng.random() * weights[-1]), n) if n > 1 else 0
+
+
+def _unit(*parts):
+    """Детерминированное число из [0, 1) без состояния: для свойств курса, нужных в разных чанках"""
+    return random.Random(":".join(map(str, parts))).random()
+
+
+def course_owner_id(plan, course):
+    weights = _zipf_cum_weights(plan.authors, plan.zipf)
+    rank = bisect_right(weights, _unit(plan.seed, "owner", course) * weights[-1])
+    return plan.user_offset + _scramble(min(rank, plan.authors - 1), plan.authors)
+
+
+def course_price(plan, course):
+    return _course_price(plan.seed, course)
+
+
+@lru_cache(maxsize=100000)
+def _course_price(seed, course):
+    return Decimal(_weighted(random.Random(f"{seed}:price:{course}"), PRICE_TIERS))
+
+
+def _weighted(rng, choices):
+    values, cum_weights = _cum_weights(tuple(choices))
+    return rng.choices(values, cum_weights=cum_weights)[0]
+
+
+@lru_cache(maxsize=None)
+def _cum_weights(choices):
+    values, weights = zip(*choices)
+    return values, list(accumulate(weights))
+
+
+def _lognormal_params(mean, sigma):
+    """mu логнормального распределения с заданными средним и sigma"""
+    return math.log(max(mean, 0.01)) - sigma ** 2 / 2, sigma
+
+
+def _text(rng, low, high):
+    return " ".join(rng.choices(WORDS, k=rng.randint(low, high)))
+
+
+def write_rows(model, columns, rows):
+    """Пишет строки одной транзакцией; на PostgreSQL — через COPY"""
+    if not rows:
+        return 0
+    table = model._meta.db_table
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                buffer = io.StringIO()
+                for row in rows:
+                    buffer.write("\t".join(_copy_value(value) for value in row))
+                    buffer.write("\n")
+                buffer.seek(0)
+                cursor.cursor.copy_expert(f'COPY "{table}" ({", ".join(columns)}) FROM STDIN', buffer)
+            else:
+                # Драйвер сам передает числа, строки и None; приводить нужно только даты и Decimal
+                fields = [model._meta.get_field(column) for column in columns]
+                adapted = [i for i, f in enumerate(fields) if f.get_internal_type() in ("DateTimeField", "DecimalField")]
+                prepared = []
+                for row in rows:
+                    row = list(row)
+                    for i in adapted:
+                        row[i] = fields[i].get_db_prep_save(row[i], connection)
+                    prepared.append(row)
+                placeholders = ", ".join(["%s"] * len(columns))
+                cursor.executemany(
+                    f'INSERT INTO "{table}" ({", ".join(columns)}) VALUES ({placeholders})', prepared
+                )
+    return len(rows)
+
+
+def _copy_value(value):
+    if value is None:
+        return "\\N"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def generate_chunk(plan, kind, start, stop):
+    """Строит и пишет один чанк; возвращает число строк"""
+    model, columns, rows = chunk_rows(plan, kind, start, stop)
+    return write_rows(model, columns, rows)
+
+
+_worker_plan = None
+
+
+def _init_worker(plan):
+    global _worker_plan
+    import django
+
+    django.setup()
+    _worker_plan = plan
+
+
+def _run_worker_chunk(kind, start, stop):
+    return generate_chunk(_worker_plan, kind, start, stop)
+
+
+def generate(plan, workers=1, progress=None):
+    """
+    Генерирует все виды данных по порядку, чанки каждого вида — параллельно
+    в workers процессах. progress(вид, строк, секунд) вызывается после каждого
+    вида. Возвращает {вид: число строк}.
+    """
+    totals = {}
+    executor = None
+    if workers > 1:
+        # Соединения родителя не должны достаться воркерам
+        connections.close_all()
+        executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=get_context("spawn"), initializer=_init_worker, initargs=(plan,)
+        )
+    try:
+        for kind in KINDS:
+            started = time.perf_counter()
+            ranges = chunks(plan, kind)
+            if executor is None:
+                totals[kind] = sum(generate_chunk(plan, kind, start, stop) for start, stop in ranges)
+            else:
+                # Следующий вид ссылается на этот, поэтому вид целиком дожидается своих чанков
+                futures = [executor.submit(_run_worker_chunk, kind, start, stop) for start, stop in ranges]
+                totals[kind] = sum(future.result() for future in futures)
+            if progress:
+                progress(kind, totals[kind], time.perf_counter() - started)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    reset_sequences()
+    return totals
+
+
+def reset_sequences():
+    """После вставки с явными id последовательности PostgreSQL нужно сдвинуть за максимум"""
+    statements = connection.ops.sequence_reset_sql(no_style(), [User, Course, Lesson, Subscription, Payment])
+    if statements:
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
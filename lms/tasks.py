@@ -1,37 +1,175 @@
+import logging
+from datetime import timedelta
+from itertools import islice
+from smtplib import (
+    SMTPAuthenticationError,
+    SMTPException,
+    SMTPRecipientsRefused,
+    SMTPResponseException,
+    SMTPSenderRefused,
+)
+
 from celery import shared_task
 from django.conf import settings
-from django.core.mail import send_mail
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from lms.models import Course, Lesson, Subscription
+
+logger = logging.getLogger(__name__)
 
-from lms.models import Course, Subscription
+# Сколько адресов обрабатывает одна подзадача рассылки
+NOTIFY_CHUNK_SIZE = 500
+NOTIFY_MAX_RETRIES = 5
+NOTIFY_RETRY_DELAY = 60
+
+# Сколько курсов сверяет один проход repair_course_counters
+COUNTERS_REPAIR_BATCH_SIZE = 500
+
+
+def _course_update_message(course):
+    subject = f"Обновление курса: {course.title}"
+    message = (
+        f"Курс «{course.title}» был обновлён. "
+        "Зайдите в личный кабинет, чтобы посмотреть новые материалы."
+    )
+    return subject, message
 
 
 @shared_task
-def send_course_update_notification(course_id: int) -> int:
+def send_course_update_notification(course_id: int, chunk_size: int = NOTIFY_CHUNK_SIZE) -> int:
     """
-    Отправляет письма пользователям, подписанным на обновление конкретного курса.
+    Рассылает уведомление об обновлении курса его подписчикам.
 
+    Адреса читаются потоком (iterator — серверный курсор на PostgreSQL) и
+    раздаются пачками по chunk_size в подзадачи send_course_update_chunk,
+    так что в памяти не бывает больше одной пачки, а сбой SMTP повторяет
+    только свою пачку.
     Возвращает количество получателей.
     """
-    course = Course.objects.get(pk=course_id)
-    subscriptions = Subscription.objects.filter(course=course).select_related("user")
+    emails = (
+        Subscription.objects.filter(course_id=course_id)
+        .exclude(user__email="")
+        .order_by("pk")
+        .values_list("user__email", flat=True)
+        .iterator(chunk_size=chunk_size)
+    )
+    total = 0
+    while chunk := list(islice(emails, chunk_size)):
+        send_course_update_chunk.delay(course_id, chunk)
+        total += len(chunk)
+    return total
+
+
+@shared_task(bind=True, max_retries=NOTIFY_MAX_RETRIES, default_retry_delay=NOTIFY_RETRY_DELAY)
+def send_course_update_chunk(self, course_id: int, recipients: list) -> int:
+    """
+    Отправляет пачке получателей по отдельному письму через одно SMTP-соединение.
 
-    recipients = [sub.user.email for sub in subscriptions if sub.user.email]
-    if not recipients:
+    Адрес, который сервер отверг окончательно (ответ 5xx на получателя или
+    письмо), пропускается с записью в лог — повтор ему не поможет. При
+    временной ошибке (сеть, 4xx) задача повторяется только для тех адресов,
+    до которых еще не дошла очередь: доставленные письма повторно не уходят.
+    Возвращает количество отправленных писем.
+    """
+    course = Course.objects.filter(pk=course_id).first()
+    if course is None:
         return 0
+    subject, message = _course_update_message(course)
 
-    subject = f"Обновление курса: {course.title}"
-    message = (
-        f"Курс «{course.title}» был обновлён. "
-        "Зайдите в личный кабинет, чтобы посмотреть новые материалы."
+    sent = 0
+    with get_connection() as connection:
+        for position, email in enumerate(recipients):
+            try:
+                EmailMessage(
+                    subject, message, settings.DEFAULT_FROM_EMAIL, [email], connection=connection
+                ).send()
+            except (SMTPException, OSError) as exc:
+                if _is_permanent_recipient_error(exc):
+                    logger.warning("Course %s update not delivered to %s: %s", course_id, email, exc)
+                    continue
+                raise self.retry(args=(course_id, recipients[position:]), exc=exc)
+            sent += 1
+    return sent
+
+
+def _is_permanent_recipient_error(exc):
+    """Окончательный отказ для этого получателя, а не сбой соединения или отправителя"""
+    if isinstance(exc, SMTPRecipientsRefused):
+        return True
+    return (
+        isinstance(exc, SMTPResponseException)
+        and not isinstance(exc, (SMTPSenderRefused, SMTPAuthenticationError))
+        and exc.smtp_code >= 500
     )
 
-    send_mail(
-        subject=subject,
-        message=message,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        recipient_list=recipients,
-        fail_silently=True,
+
+def _course_count(model):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(course=OuterRef("pk"))
+            .order_by()
+            .values("course")
+            .annotate(total=Count("pk"))
+            .values("total")
+        ),
+        0,
     )
 
-    return len(recipients)
 
+@shared_task
+def repair_course_counters(batch_size: int = COUNTERS_REPAIR_BATCH_SIZE) -> int:
+    """
+    Сверяет денормализованные lessons_count и subscribers_count с реальными
+    данными и исправляет расхождения (каскадные удаления, сбои между
+    изменением данных и сдвигом счетчика).
+
+    Курсы обходятся пачками по id: на каждую пачку два GROUP BY для поиска
+    расхождений и один UPDATE только для разошедшихся курсов.
+    Возвращает количество исправленных курсов.
+    """
+    # lms.services импортирует этот модуль, поэтому импорт здесь
+    from lms.services import count_by_course
+
+    repaired = 0
+    last_id = 0
+    while True:
+        batch = list(
+            Course.objects.filter(pk__gt=last_id)
+            .order_by("pk")
+            .values_list("pk", "lessons_count", "subscribers_count")[:batch_size]
+        )
+        if not batch:
+            return repaired
+        last_id = batch[-1][0]
+        ids = [course_id for course_id, *_ in batch]
+        lessons = count_by_course(Lesson.objects.filter(course_id__in=ids))
+        subscribers = count_by_course(Subscription.objects.filter(course_id__in=ids))
+        drifted = [
+            course_id
+            for course_id, lessons_count, subscribers_count in batch
+            if lessons_count != lessons.get(course_id, 0) or subscribers_count != subscribers.get(course_id, 0)
+        ]
+        if drifted:
+            # Пересчитываем подзапросом в самом UPDATE, чтобы не затереть изменения,
+            # случившиеся между сверкой и исправлением
+            repaired += Course.objects.filter(pk__in=drifted).update(
+                lessons_count=_course_count(Lesson),
+                subscribers_count=_course_count(Subscription),
+            )
+
+
+@shared_task
+def refresh_course_stats(days: int | None = 2) -> int:
+    """
+    Пересчитывает срезы CourseDailyStats за последние days дней (все при None)
+    из платежей и подписок. Срезы поддерживаются инкрементально, задача
+    догоняет изменения, прошедшие мимо этих обновлений.
+    Возвращает количество записанных срезов.
+    """
+    from lms.analytics import rebuild_course_stats
+
+    since = None if days is None else timezone.localdate() - timedelta(days=days - 1)
+    return rebuild_course_stats(since)
@@ -1,13 +1,72 @@
+import base64
+import json
+import os
+import tempfile
+import time
+import warnings
+from collections import Counter
+from dataclasses import replace
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+from smtplib import SMTPDataError, SMTPException, SMTPRecipientsRefused
+from unittest import mock, skipUnless
+
+from celery.exceptions import Retry
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
+from django.contrib.postgres.search import SearchQuery
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.paginator import UnorderedObjectListWarning
+from django.db import connection
+from django.test import SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from rest_framework import status
+from django.utils import timezone
+from django.utils.http import http_date
+from django.utils.translation import gettext_lazy
+from rest_framework import serializers, status
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APITestCase
 
-from lms.models import Course, Lesson, Subscription
+from lms.benchmarks import (
+    SCENARIOS,
+    check_budgets,
+    compare_reports,
+    load_budgets,
+    run_benchmarks,
+    uncovered_routes,
+)
+from lms.models import Course, CourseDailyStats, Lesson, Subscription
+from lms.renderers import FastJSONRenderer, orjson
+from lms import search as search_module
+from lms.search import SEARCH_CONFIG, get_fallback_index, reset_fallback_index
+from lms.serializers import CourseSerializer
+from lms.synthetic import Plan, chunk_rows, chunks, prepare_plan
+from lms.services import course_notify_key, notify_courses_changed, subscribe_users, unsubscribe_users
+from lms.tasks import refresh_course_stats, repair_course_counters, send_course_update_chunk, send_course_update_notification
+from lms.validators import LinkPolicy, validate_no_external_links, validate_youtube_url
+from lms.views import CourseViewSet, LessonListCreateView
+from users.models import Payment
 
 User = get_user_model()
 
+# Тесты не должны зависеть от Redis и от данных, оставшихся в нем после прошлых
+# прогонов, а cache.clear() в тестах не должен очищать общий кеш
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+locmem_cache = override_settings(CACHES=LOCMEM_CACHES)
+
+
+def setUpModule():
+    locmem_cache.enable()
+
+
+def tearDownModule():
+    locmem_cache.disable()
+
+
 
 def get_full_url(url_name, **kwargs):
     """Вспомогательная функция для получения полного URL с префиксом /api/"""
@@ -311,3 +370,1281 @@ class SubscriptionTestCase(APITestCase):
         url = reverse("subscription")
         response = self.client.post(url, {})
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class CourseQueryCountTestCase(APITestCase):
+    """Тесты фиксированного числа SQL-запросов для списка и карточки курса"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email="owner@test.com",
+            password="testpass123"
+        )
+        for i in range(12):
+            course = Course.objects.create(title=f"Course {i}", owner=self.user)
+            for j in range(3):
+                Lesson.objects.create(course=course, title=f"Lesson {i}.{j}", owner=self.user)
+            if i % 2:
+                Subscription.objects.create(user=self.user, course=course)
+        self.client.force_authenticate(user=self.user)
+
+    def count_queries(self, url):
+        # Прогреваем кеш роли, чтобы сравнивать только запросы самого эндпоинта
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(ctx.captured_queries), response
+
+    def test_list_query_count_does_not_depend_on_page_size(self):
+        """Число запросов на список курсов не растет вместе с размером страницы"""
+        small, _ = self.count_queries("/api/courses/?page_size=2&expand=lessons")
+        large, response = self.count_queries("/api/courses/?page_size=12&expand=lessons")
+        self.assertEqual(small, large)
+        self.assertEqual(len(response.data["results"]), 12)
+
+    def test_list_returns_annotated_values(self):
+        """Аннотированные значения совпадают с реальными данными"""
+        _, response = self.count_queries("/api/courses/?page_size=12&expand=lessons")
+        for item in response.data["results"]:
+            course = Course.objects.get(pk=item["id"])
+            self.assertEqual(item["lessons_count"], 3)
+            self.assertEqual(len(item["lessons"]), 3)
+            self.assertEqual(
+                item["is_subscribed"],
+                Subscription.objects.filter(user=self.user, course=course).exists(),
+            )
+
+    def test_retrieve_query_count_does_not_depend_on_lessons(self):
+        """Число запросов на карточку курса не зависит от количества уроков"""
+        course = Course.objects.filter(owner=self.user).first()
+        url = f"/api/courses/{course.id}/?expand=lessons"
+        before, _ = self.count_queries(url)
+        for j in range(10):
+            Lesson.objects.create(course=course, title=f"Extra {j}", owner=self.user)
+        after, response = self.count_queries(url)
+        self.assertEqual(before, after)
+        self.assertEqual(response.data["lessons_count"], 13)
+
+
+class LessonKeysetPaginationTestCase(APITestCase):
+    """Тесты keyset-пагинации уроков"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email="owner@test.com",
+            password="testpass123"
+        )
+        self.course = Course.objects.create(title="Course", owner=self.user)
+        for i in range(7):
+            Lesson.objects.create(course=self.course, title=f"Lesson {i}", owner=self.user)
+        self.client.force_authenticate(user=self.user)
+
+    def walk(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids.extend(item["id"] for item in response.data["results"])
+            url = response.data["next"]
+        return ids
+
+    def test_cursor_mode_walks_all_lessons(self):
+        """Обход всех страниц курсором возвращает каждый урок ровно один раз"""
+        ids = self.walk("/api/lessons/?pagination=cursor&page_size=3")
+        self.assertEqual(ids, list(Lesson.objects.order_by("id").values_list("id", flat=True)))
+
+    def test_page_mode_is_ordered(self):
+        """Постраничный режим идет по id: без предупреждения о неупорядоченном queryset"""
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", UnorderedObjectListWarning)
+            ids = self.walk("/api/lessons/?page_size=3")
+        self.assertEqual(ids, sorted(Lesson.objects.values_list("id", flat=True)))
+
+    def test_cursor_mode_skips_count_query(self):
+        """В режиме курсора не выполняется COUNT(*)"""
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get("/api/lessons/?pagination=cursor&page_size=3")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn("count", response.data)
+        self.assertFalse(any("COUNT(*)" in q["sql"].upper() for q in ctx.captured_queries))
+
+    def test_cursor_is_stable_under_inserts(self):
+        """Новые строки не сдвигают уже выданные страницы"""
+        first = self.client.get("/api/lessons/?pagination=cursor&page_size=3")
+        seen = [item["id"] for item in first.data["results"]]
+        Lesson.objects.create(course=self.course, title="Inserted", owner=self.user)
+        rest = self.walk(first.data["next"])
+        self.assertFalse(set(seen) & set(rest))
+        self.assertEqual(len(seen) + len(rest), 8)
+
+    def test_previous_link_returns_previous_page(self):
+        """Ссылка previous возвращает предыдущую страницу в прямом порядке"""
+        first = self.client.get("/api/lessons/?pagination=cursor&page_size=3")
+        second = self.client.get(first.data["next"])
+        back = self.client.get(second.data["previous"])
+        self.assertEqual(back.data["results"], first.data["results"])
+
+    def test_invalid_cursor(self):
+        """Некорректный курсор возвращает 404"""
+        response = self.client.get("/api/lessons/?cursor=garbage")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_forged_cursor(self):
+        """Курсор с id вне диапазона или не того типа дает 404, а не 500"""
+        for position in ({"i": 10 ** 30}, {"i": None}, {"i": "x"}, ["i"]):
+            cursor = base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+            for url in ("/api/lessons/", "/api/courses/"):
+                response = self.client.get(url, {"cursor": cursor})
+                self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, (url, position))
+
+    def test_courses_support_cursor_mode(self):
+        """Курсы тоже поддерживают keyset-пагинацию"""
+        Course.objects.create(title="Second", owner=self.user)
+        response = self.client.get("/api/courses/?pagination=cursor&page_size=1")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertIsNotNone(response.data["next"])
+
+
+class CourseSparseFieldsetTestCase(APITestCase):
+    """Тесты ?fields= и ?expand=lessons для курсов"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email="owner@test.com",
+            password="testpass123"
+        )
+        self.course = Course.objects.create(
+            title="Course",
+            description="Long description",
+            owner=self.user
+        )
+        self.limit = CourseSerializer.lessons_limit
+        for i in range(self.limit + 5):
+            Lesson.objects.create(course=self.course, title=f"Lesson {i}", owner=self.user)
+        self.client.force_authenticate(user=self.user)
+        self.url = f"/api/courses/{self.course.id}/"
+
+    def test_lessons_are_not_expanded_by_default(self):
+        """Без ?expand=lessons уроки не попадают в ответ"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn("lessons", response.data)
+        self.assertEqual(response.data["lessons_count"], self.limit + 5)
+
+    def test_fields_limit_response(self):
+        """?fields= оставляет в ответе только запрошенные поля"""
+        response = self.client.get(self.url, {"fields": "id,title"})
+        self.assertEqual(set(response.data), {"id", "title"})
+
+    def test_unrequested_columns_are_deferred(self):
+        """Незапрошенные колонки не выбираются из БД"""
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(self.url, {"fields": "id,title"})
+        course_queries = [q["sql"] for q in ctx.captured_queries if '"lms_course"."title"' in q["sql"]]
+        self.assertTrue(course_queries)
+        for sql in course_queries:
+            self.assertNotIn('"lms_course"."description"', sql)
+            self.assertNotIn('"lms_lesson"', sql)
+
+    def test_expanded_lessons_are_capped(self):
+        """Развернутые уроки ограничены, остальные доступны по курсору"""
+        response = self.client.get(self.url, {"fields": "id", "expand": "lessons"})
+        self.assertEqual(set(response.data), {"id", "lessons", "lessons_next"})
+        self.assertEqual(len(response.data["lessons"]), self.limit)
+
+        rest = self.client.get(response.data["lessons_next"])
+        self.assertEqual(rest.status_code, status.HTTP_200_OK)
+        ids = [item["id"] for item in response.data["lessons"]]
+        while True:
+            ids.extend(item["id"] for item in rest.data["results"])
+            if not rest.data["next"]:
+                break
+            rest = self.client.get(rest.data["next"])
+        self.assertEqual(ids, list(self.course.lessons.order_by("id").values_list("id", flat=True)))
+
+    def test_lessons_next_keeps_course_visibility(self):
+        """lessons_next отдает все уроки курса, в том числе других авторов; чужим курс не виден"""
+        other = User.objects.create_user(email="author@test.com", password="testpass123")
+        self.course.lessons.filter(pk__in=self.course.lessons.order_by("-id").values("id")[:10]).update(owner=other)
+        response = self.client.get(self.url, {"fields": "id", "expand": "lessons"})
+        ids = [item["id"] for item in response.data["lessons"]]
+        url = response.data["lessons_next"]
+        self.assertIn(f"/api/courses/{self.course.id}/lessons/", url)
+        while url:
+            page = self.client.get(url)
+            self.assertEqual(page.status_code, status.HTTP_200_OK)
+            ids.extend(item["id"] for item in page.data["results"])
+            url = page.data["next"]
+        self.assertEqual(ids, list(self.course.lessons.order_by("id").values_list("id", flat=True)))
+
+        self.client.force_authenticate(user=other)
+        response = self.client.get(f"/api/courses/{self.course.id}/lessons/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_lessons_next_is_null_when_everything_fits(self):
+        """lessons_next пустой, если все уроки поместились"""
+        course = Course.objects.create(title="Small", owner=self.user)
+        Lesson.objects.create(course=course, title="Only", owner=self.user)
+        response = self.client.get(f"/api/courses/{course.id}/", {"expand": "lessons"})
+        self.assertEqual(len(response.data["lessons"]), 1)
+        self.assertIsNone(response.data["lessons_next"])
+
+    def test_lesson_fields(self):
+        """?fields= работает и для уроков"""
+        response = self.client.get("/api/lessons/", {"fields": "id,title"})
+        self.assertEqual(set(response.data["results"][0]), {"id", "title"})
+
+
+class ConditionalGetTestCase(APITestCase):
+    """Тесты ETag для курсов и уроков"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email="owner@test.com",
+            password="testpass123"
+        )
+        self.course = Course.objects.create(title="Course", owner=self.user)
+        self.lesson = Lesson.objects.create(course=self.course, title="Lesson", owner=self.user)
+        self.client.force_authenticate(user=self.user)
+        self.course_url = f"/api/courses/{self.course.id}/"
+
+    def test_course_returns_validators(self):
+        """Ответ содержит строгий ETag и не содержит Last-Modified"""
+        response = self.client.get(self.course_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response["ETag"].startswith('"'))
+        self.assertNotIn("Last-Modified", response)
+
+    def test_course_not_modified(self):
+        """Повторный запрос с If-None-Match получает 304 за один запрос к БД"""
+        etag = self.client.get(self.course_url)["ETag"]
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.course_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+    def test_if_modified_since_is_ignored(self):
+        """If-Modified-Since не дает 304: по дате не видно изменений счетчиков и удалений"""
+        since = http_date(time.time() + 3600)
+        response = self.client.get(self.course_url, HTTP_IF_MODIFIED_SINCE=since)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get("/api/lessons/", HTTP_IF_MODIFIED_SINCE=since)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def assertModified(self, url, etag):
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def test_etag_changes_on_unsubscribe(self):
+        """Отписка текущего пользователя меняет ETag курса и списка"""
+        Subscription.objects.create(user=self.user, course=self.course)
+        etag = self.client.get(self.course_url)["ETag"]
+        list_etag = self.client.get("/api/courses/")["ETag"]
+        unsubscribe_users([self.user.id], [self.course.id])
+        self.assertFalse(self.assertModified(self.course_url, etag).data["is_subscribed"])
+        self.assertModified("/api/courses/", list_etag)
+
+    def test_etag_changes_when_others_subscribe(self):
+        """Подписка других пользователей меняет subscribers_count, а с ним и ETag"""
+        other = User.objects.create_user(email="other@test.com", password="testpass123")
+        etag = self.client.get(self.course_url)["ETag"]
+        list_etag = self.client.get("/api/courses/")["ETag"]
+        subscribe_users([other.id], [self.course.id])
+        self.assertEqual(self.assertModified(self.course_url, etag).data["subscribers_count"], 1)
+        self.assertModified("/api/courses/", list_etag)
+
+    def test_etag_changes_on_lesson_delete(self):
+        """Удаление урока меняет ETag курса и списка уроков"""
+        Lesson.objects.create(course=self.course, title="Another", owner=self.user)
+        etag = self.client.get(self.course_url)["ETag"]
+        lessons_etag = self.client.get("/api/lessons/")["ETag"]
+        self.lesson.delete()
+        self.assertEqual(self.assertModified(self.course_url, etag).data["lessons_count"], 1)
+        self.assertModified("/api/lessons/", lessons_etag)
+
+    def test_etag_changes_on_course_delete(self):
+        """Удаление курса меняет ETag списка, даже если это не последний курс"""
+        Course.objects.create(title="Newer", owner=self.user)
+        list_etag = self.client.get("/api/courses/")["ETag"]
+        self.course.delete()
+        self.assertEqual(len(self.assertModified("/api/courses/", list_etag).data["results"]), 1)
+
+    def test_etag_changes_on_counter_repair(self):
+        """Пересчет счетчиков (UPDATE без updated_at) меняет ETag"""
+        Course.objects.filter(pk=self.course.pk).update(lessons_count=5)
+        etag = self.client.get(self.course_url)["ETag"]
+        list_etag = self.client.get("/api/courses/")["ETag"]
+        repair_course_counters()
+        self.assertEqual(self.assertModified(self.course_url, etag).data["lessons_count"], 1)
+        self.assertModified("/api/courses/", list_etag)
+
+    def test_course_etag_changes_with_lessons(self):
+        """Добавление урока меняет ETag курса"""
+        etag = self.client.get(self.course_url)["ETag"]
+        Lesson.objects.create(course=self.course, title="Another", owner=self.user)
+        response = self.client.get(self.course_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_course_etag_changes_with_subscription(self):
+        """Подписка текущего пользователя меняет ETag"""
+        list_etag = self.client.get("/api/courses/")["ETag"]
+        etag = self.client.get(self.course_url)["ETag"]
+        Subscription.objects.create(user=self.user, course=self.course)
+        response = self.client.get(self.course_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data["is_subscribed"])
+        response = self.client.get("/api/courses/", HTTP_IF_NONE_MATCH=list_etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_etag_depends_on_query(self):
+        """Разные параметры запроса дают разные ETag"""
+        full = self.client.get(self.course_url)["ETag"]
+        sparse = self.client.get(self.course_url, {"fields": "id"})["ETag"]
+        self.assertNotEqual(full, sparse)
+
+    def test_lesson_detail_and_list(self):
+        """Условные GET для уроков"""
+        url = f"/api/lessons/{self.lesson.id}/"
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        list_etag = self.client.get("/api/lessons/")["ETag"]
+        self.assertEqual(
+            self.client.get("/api/lessons/", HTTP_IF_NONE_MATCH=list_etag).status_code,
+            status.HTTP_304_NOT_MODIFIED,
+        )
+
+        self.client.patch(url, {"title": "Changed"})
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get("/api/lessons/", HTTP_IF_NONE_MATCH=list_etag).status_code, status.HTTP_200_OK)
+
+    def test_missing_object_still_404(self):
+        """Для несуществующего объекта валидаторы не мешают 404"""
+        self.assertEqual(self.client.get("/api/courses/999999/").status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get("/api/lessons/999999/").status_code, status.HTTP_404_NOT_FOUND)
+
+
+class RowSerializerTestCase(APITestCase):
+    """Быстрый путь списков должен совпадать со стандартным байт в байт"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email="owner@test.com",
+            password="testpass123"
+        )
+        for i in range(3):
+            course = Course.objects.create(
+                title=f"Курс {i}  ",
+                description="Описание",
+                preview=f"courses/{i}.png" if i % 2 else "",
+                owner=self.user
+            )
+            Lesson.objects.create(
+                course=course,
+                title=f"Урок {i}",
+                video_url="https://www.youtube.com/watch?v=test",
+                preview="lessons/1.png",
+                owner=self.user
+            )
+        Subscription.objects.create(user=self.user, course=course)
+        self.client.force_authenticate(user=self.user)
+
+    def assert_same_content(self, view_class, url):
+        fast = self.client.get(url)
+        with mock.patch.object(view_class, "use_row_serializer", False):
+            slow = self.client.get(url)
+        self.assertEqual(fast.status_code, status.HTTP_200_OK)
+        self.assertEqual(fast.content, slow.content)
+
+    def test_course_list(self):
+        """Список курсов"""
+        self.assert_same_content(CourseViewSet, "/api/courses/")
+        self.assert_same_content(CourseViewSet, "/api/courses/?fields=id,preview,is_subscribed")
+        self.assert_same_content(CourseViewSet, "/api/courses/?pagination=cursor&page_size=2")
+
+    def test_lesson_list(self):
+        """Список уроков"""
+        self.assert_same_content(LessonListCreateView, "/api/lessons/")
+        self.assert_same_content(LessonListCreateView, "/api/lessons/?pagination=cursor&page_size=1")
+
+    def test_expand_falls_back_to_serializer(self):
+        """?expand=lessons обслуживается обычным сериализатором"""
+        response = self.client.get("/api/courses/?expand=lessons")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["results"][0]["lessons"]), 1)
+
+
+class FastJSONRendererTestCase(SimpleTestCase):
+    """FastJSONRenderer выдает тот же JSON, что и JSONRenderer"""
+
+    def test_same_bytes(self):
+        data = {
+            "results": [
+                {
+                    "id": 1,
+                    "title": "Курс\u2028\"кавычки\"",
+                    "date": datetime(2025, 1, 2, 3, 4, 5, 678, tzinfo=dt_timezone.utc),
+                    "day": date(2025, 1, 2),
+                    "amount": Decimal("10.50"),
+                    "lazy": gettext_lazy("Lazy"),
+                    "flag": True,
+                    "empty": None,
+                    "ratio": 0.1,
+                    1: "int key",
+                }
+            ],
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_floats(self):
+        """Float совпадают по значению; запись отличается только у малых чисел"""
+        floats = [0.0, -0.5, 0.1, 1 / 3, 2.5, 123456789.123, 1e16, 1.5e300, 1e-4, 1e-05, 2.5e-05, 1e-07, 5e-324]
+        data = {"values": floats}
+        fast, standard = FastJSONRenderer().render(data), JSONRenderer().render(data)
+        self.assertEqual(json.loads(fast), json.loads(standard))
+        self.assertEqual(json.loads(fast)["values"], floats)
+        # Обычные значения пишутся одинаково
+        regular = {"values": floats[:9]}
+        self.assertEqual(FastJSONRenderer().render(regular), JSONRenderer().render(regular))
+
+    def test_uses_orjson(self):
+        """orjson — зависимость проекта: компактный ответ строится им, а не стандартным кодировщиком"""
+        self.assertIsNotNone(orjson, "orjson не установлен (requirements.txt)")
+        with mock.patch("lms.renderers.orjson.dumps", wraps=orjson.dumps) as dumps, \
+                mock.patch.object(JSONRenderer, "render") as fallback:
+            FastJSONRenderer().render({"id": 1})
+        dumps.assert_called_once()
+        fallback.assert_not_called()
+
+    def test_documented_float_differences(self):
+        """Известные отличия от JSONRenderer, описанные в FastJSONRenderer"""
+        self.assertEqual(FastJSONRenderer().render({"rank": 1e-05}), b'{"rank":0.00001}')
+        self.assertEqual(JSONRenderer().render({"rank": 1e-05}), b'{"rank":1e-05}')
+        self.assertEqual(FastJSONRenderer().render({"rank": float("nan")}), b'{"rank":null}')
+        with self.assertRaises(ValueError):
+            JSONRenderer().render({"rank": float("nan")})
+
+    def test_indent_is_respected(self):
+        data = {"a": [1, 2]}
+        media_type = "application/json; indent=4"
+        self.assertEqual(
+            FastJSONRenderer().render(data, media_type),
+            JSONRenderer().render(data, media_type),
+        )
+
+
+class LessonBulkTestCase(APITestCase):
+    """Тесты массового импорта уроков"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email="owner@test.com",
+            password="testpass123"
+        )
+        self.other_user = User.objects.create_user(
+            email="other@test.com",
+            password="testpass123"
+        )
+        self.course = Course.objects.create(title="Course", owner=self.user)
+        self.second_course = Course.objects.create(title="Second", owner=self.user)
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse("lesson-bulk")
+        cache.clear()
+
+    def payload(self, count, course=None):
+        return [
+            {
+                "course": (course or self.course).id,
+                "title": f"Lesson {i}",
+                "video_url": "https://www.youtube.com/watch?v=bulk",
+            }
+            for i in range(count)
+        ]
+
+    def post(self, data):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(self.url, data, format="json")
+        return response, len(ctx.captured_queries)
+
+    def test_bulk_create(self):
+        """Уроки создаются одним запросом, владелец — текущий пользователь"""
+        response, _ = self.post(self.payload(5))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data), 5)
+        self.assertEqual(Lesson.objects.filter(owner=self.user).count(), 5)
+
+    def test_max_items(self):
+        """Больше 1000 уроков за запрос — 400, ничего не создается и не обновляется"""
+        response, _ = self.post(self.payload(1001))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Lesson.objects.exists())
+
+        lesson = Lesson.objects.create(course=self.course, title="Lesson", owner=self.user)
+        response = self.client.patch(self.url, [{"id": lesson.id, "title": "Changed"}] * 1001, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        lesson.refresh_from_db()
+        self.assertEqual(lesson.title, "Lesson")
+
+        response, _ = self.post(self.payload(1000))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_query_count_does_not_depend_on_size(self):
+        """Число запросов не растет с размером пачки"""
+        self.post(self.payload(1))
+        _, small = self.post(self.payload(2))
+        _, large = self.post(self.payload(50) + self.payload(50, self.second_course))
+        self.assertEqual(small, large)
+
+    def test_errors_per_item(self):
+        """Ошибки возвращаются по элементам, ничего не сохраняется"""
+        data = self.payload(3)
+        data[1]["video_url"] = "https://example.com/video"
+        data[2]["description"] = "see https://example.com"
+        response, _ = self.post(data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertIn("video_url", response.data[1])
+        self.assertIn("description", response.data[2])
+        self.assertFalse(Lesson.objects.exists())
+
+    def test_unknown_course(self):
+        """Несуществующий курс — ошибка конкретного элемента"""
+        data = self.payload(2)
+        data[1]["course"] = 999999
+        response, _ = self.post(data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("course", response.data[1])
+
+    def test_moderator_cannot_bulk_create(self):
+        """Модератор не может создавать уроки"""
+        moderators_group, _ = Group.objects.get_or_create(name="moderators")
+        self.other_user.groups.add(moderators_group)
+        self.client.force_authenticate(user=self.other_user)
+        response, _ = self.post(self.payload(1))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_notification_once_per_course(self):
+        """Уведомление отправляется один раз на курс"""
+        with mock.patch("lms.services.send_course_update_notification.delay") as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                response, _ = self.post(self.payload(10) + self.payload(10, self.second_course))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(sorted(call.args[0] for call in delay.call_args_list), [self.course.id, self.second_course.id])
+
+    def test_bulk_update(self):
+        """Массовое обновление своих уроков"""
+        self.post(self.payload(3))
+        lessons = list(Lesson.objects.order_by("id"))
+        data = [{"id": lesson.id, "title": f"Renamed {lesson.id}"} for lesson in lessons]
+        response = self.client.patch(self.url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            list(Lesson.objects.order_by("id").values_list("title", flat=True)),
+            [f"Renamed {lesson.id}" for lesson in lessons],
+        )
+
+    def test_bulk_update_foreign_lesson(self):
+        """Чужой урок при обновлении — ошибка элемента"""
+        foreign_course = Course.objects.create(title="Foreign", owner=self.other_user)
+        foreign = Lesson.objects.create(course=foreign_course, title="Foreign", owner=self.other_user)
+        response = self.client.patch(self.url, [{"id": foreign.id, "title": "Hacked"}], format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("id", response.data[0])
+        foreign.refresh_from_db()
+        self.assertEqual(foreign.title, "Foreign")
+
+
+class SubscriptionBulkTestCase(APITestCase):
+    """Тесты массовой подписки и пакетной проверки подписок"""
+
+    def setUp(self):
+        self.owner = User.objects.create_user(
+            email="owner@test.com",
+            password="testpass123"
+        )
+        self.stranger = User.objects.create_user(
+            email="stranger@test.com",
+            password="testpass123"
+        )
+        self.cohort = [
+            User.objects.create_user(email=f"student{i}@test.com", password="testpass123")
+            for i in range(5)
+        ]
+        self.courses = [Course.objects.create(title=f"Course {i}", owner=self.owner) for i in range(2)]
+        self.client.force_authenticate(user=self.owner)
+        self.url = reverse("subscription-bulk")
+
+    def post(self, action, users=None, courses=None):
+        return self.client.post(
+            self.url,
+            {
+                "action": action,
+                "users": [user.id for user in (users or self.cohort)],
+                "courses": [course.id for course in (courses or self.courses)],
+            },
+            format="json",
+        )
+
+    def test_subscribe_cohort(self):
+        """Вся когорта подписывается на все курсы, повтор не создает дублей"""
+        Subscription.objects.create(user=self.cohort[0], course=self.courses[0])
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.post("subscribe")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["created"], 9)
+        self.assertEqual(Subscription.objects.count(), 10)
+        # Плюс сверка, сдвиг subscribers_count и сводной статистики: число запросов не зависит от размера когорты
+        self.assertLess(len(ctx.captured_queries), 13)
+        self.assertEqual(self.post("subscribe").data["created"], 0)
+
+    def test_unsubscribe_cohort(self):
+        """Отписка удаляет подписки одним запросом"""
+        self.post("subscribe")
+        response = self.post("unsubscribe", users=self.cohort[:2])
+        self.assertEqual(response.data["deleted"], 4)
+        self.assertEqual(Subscription.objects.count(), 6)
+
+    def test_foreign_course_forbidden(self):
+        """Нельзя подписывать пользователей на чужой курс"""
+        self.client.force_authenticate(user=self.stranger)
+        response = self.post("subscribe")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertFalse(Subscription.objects.exists())
+
+    def test_unknown_users(self):
+        """Несуществующие пользователи — ошибка валидации"""
+        response = self.client.post(
+            self.url,
+            {"action": "subscribe", "users": [999999], "courses": [self.courses[0].id]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("users", response.data)
+
+    def test_status_lookup(self):
+        """Пакетная проверка подписок — один запрос к БД"""
+        Subscription.objects.create(user=self.owner, course=self.courses[1])
+        url = reverse("subscription-status")
+        self.client.get(url, {"course_ids": "1"})
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, {"course_ids": f"{self.courses[0].id},{self.courses[1].id},999"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["subscribed"], [self.courses[1].id])
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+    def test_status_lookup_invalid(self):
+        """Некорректный список id — 400"""
+        response = self.client.get(reverse("subscription-status"), {"course_ids": "1,abc"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_enroll_cohort_command(self):
+        """Команда enroll_cohort подписывает пользователей по id"""
+        out = StringIO()
+        args = ["enroll_cohort", "--course", str(self.courses[0].id)]
+        for user in self.cohort:
+            args += ["--user", str(user.id)]
+        call_command(*args, stdout=out)
+        self.assertEqual(Subscription.objects.filter(course=self.courses[0]).count(), 5)
+        call_command(*args, "--unenroll", stdout=out)
+        self.assertFalse(Subscription.objects.exists())
+
+    def test_enroll_cohort_by_emails_ignores_case(self):
+        """Адреса из файла сопоставляются без учета регистра, в том числе с адресами в БД"""
+        mixed = User.objects.create_user(email="Mixed.Case@Test.com", password="testpass123")
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", encoding="utf-8", delete=False) as fh:
+            fh.write("mixed.case@test.com\nSTUDENT0@TEST.COM\nnobody@test.com\n")
+        self.addCleanup(os.remove, fh.name)
+        out = StringIO()
+        call_command("enroll_cohort", "--course", str(self.courses[0].id), "--emails-file", fh.name, stdout=out)
+        self.assertEqual(
+            set(Subscription.objects.values_list("user_id", flat=True)), {mixed.id, self.cohort[0].id}
+        )
+        self.assertIn("1 emails not found", out.getvalue())
+
+
+class CourseCountersTestCase(APITestCase):
+    """Тесты денормализованных счетчиков курса"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email="owner@test.com",
+            password="testpass123"
+        )
+        self.student = User.objects.create_user(
+            email="student@test.com",
+            password="testpass123"
+        )
+        self.course = Course.objects.create(title="Course", owner=self.user)
+        self.second_course = Course.objects.create(title="Second", owner=self.user)
+        self.client.force_authenticate(user=self.user)
+
+    def counters(self, course):
+        course.refresh_from_db()
+        return course.lessons_count, course.subscribers_count
+
+    def lesson_data(self, course, title="Lesson"):
+        return {"course": course.id, "title": title, "video_url": "https://www.youtube.com/watch?v=counter"}
+
+    def test_lesson_create_move_delete(self):
+        """Создание, перенос и удаление урока сдвигают lessons_count"""
+        response = self.client.post(reverse("lesson-list"), self.lesson_data(self.course))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.counters(self.course), (1, 0))
+
+        url = reverse("lesson-detail", kwargs={"pk": response.data["id"]})
+        self.client.patch(url, {"course": self.second_course.id})
+        self.assertEqual(self.counters(self.course), (0, 0))
+        self.assertEqual(self.counters(self.second_course), (1, 0))
+
+        self.client.delete(url)
+        self.assertEqual(self.counters(self.second_course), (0, 0))
+
+    def test_bulk_lessons(self):
+        """Массовые создание и перенос уроков поддерживают lessons_count"""
+        url = reverse("lesson-bulk")
+        self.client.post(url, [self.lesson_data(self.course, f"Lesson {i}") for i in range(3)], format="json")
+        self.assertEqual(self.counters(self.course), (3, 0))
+
+        moved = Lesson.objects.order_by("id")[:2]
+        response = self.client.patch(
+            url, [{"id": lesson.id, "course": self.second_course.id} for lesson in moved], format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.counters(self.course), (1, 0))
+        self.assertEqual(self.counters(self.second_course), (2, 0))
+
+    def test_subscriptions(self):
+        """Подписка, отписка и массовые операции сдвигают subscribers_count"""
+        self.client.force_authenticate(user=self.student)
+        self.client.post(reverse("subscription"), {"course_id": self.course.id})
+        self.assertEqual(self.counters(self.course), (0, 1))
+        self.client.post(reverse("subscription"), {"course_id": self.course.id})
+        self.assertEqual(self.counters(self.course), (0, 0))
+
+        self.client.force_authenticate(user=self.user)
+        url = reverse("subscription-bulk")
+        users = [self.user.id, self.student.id]
+        self.client.post(url, {"action": "subscribe", "users": users, "courses": [self.course.id]}, format="json")
+        self.assertEqual(self.counters(self.course), (0, 2))
+        self.client.post(
+            url, {"action": "unsubscribe", "users": [self.student.id], "courses": [self.course.id]}, format="json"
+        )
+        self.assertEqual(self.counters(self.course), (0, 1))
+
+    def test_counters_in_response(self):
+        """Счетчики отдаются из колонок курса без подсчета в запросе"""
+        Lesson.objects.create(course=self.course, title="Lesson", owner=self.user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("course-detail", kwargs={"pk": self.course.id}))
+        self.assertEqual(response.data["lessons_count"], 1)
+        self.assertEqual(response.data["subscribers_count"], 0)
+        self.assertFalse(any("COUNT(" in query["sql"] for query in ctx.captured_queries[1:]))
+
+    def test_repair_course_counters(self):
+        """Задача сверки исправляет только разошедшиеся счетчики"""
+        Lesson.objects.create(course=self.course, title="Lesson", owner=self.user)
+        Subscription.objects.create(user=self.student, course=self.second_course)
+        Course.objects.filter(pk=self.course.pk).update(lessons_count=7)
+
+        self.assertEqual(repair_course_counters(batch_size=1), 2)
+        self.assertEqual(self.counters(self.course), (1, 0))
+        self.assertEqual(self.counters(self.second_course), (0, 1))
+        self.assertEqual(repair_course_counters(), 0)
+
+
+class CourseNotificationTestCase(APITestCase):
+    """Тесты рассылки уведомлений об обновлении курса"""
+
+    def setUp(self):
+        self.owner = User.objects.create_user(
+            email="owner@test.com",
+            password="testpass123"
+        )
+        self.course = Course.objects.create(title="Course", owner=self.owner)
+        self.students = [
+            User.objects.create_user(email=f"student{i}@test.com", password="testpass123")
+            for i in range(5)
+        ]
+        for student in self.students:
+            Subscription.objects.create(user=student, course=self.course)
+
+    def test_fan_out_by_chunks(self):
+        """Подписчики делятся на пачки, каждому уходит отдельное письмо"""
+        with mock.patch.object(
+            send_course_update_chunk, "delay", side_effect=send_course_update_chunk
+        ) as delay:
+            result = send_course_update_notification.apply(args=(self.course.id,), kwargs={"chunk_size": 2})
+        self.assertEqual(result.get(), 5)
+        self.assertEqual([len(call.args[1]) for call in delay.call_args_list], [2, 2, 1])
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(
+            sorted(message.to[0] for message in mail.outbox),
+            sorted(student.email for student in self.students),
+        )
+        self.assertTrue(all(len(message.to) == 1 for message in mail.outbox))
+
+    def test_chunk_retries_only_unsent(self):
+        """Повтор пачки после сбоя SMTP получает только неотправленные адреса"""
+        recipients = [student.email for student in self.students]
+        with mock.patch(
+            "django.core.mail.backends.locmem.EmailBackend.send_messages",
+            side_effect=[1, 1, SMTPException("down")],
+        ), mock.patch.object(send_course_update_chunk, "retry", side_effect=Retry()) as retry:
+            send_course_update_chunk.apply(args=(self.course.id, recipients))
+        self.assertEqual(retry.call_args.kwargs["args"], (self.course.id, recipients[2:]))
+
+    def test_refused_recipient_is_skipped(self):
+        """Окончательно отвергнутый адрес в середине пачки пропускается, остальные получают письмо"""
+        recipients = [student.email for student in self.students]
+        refused = recipients[1]
+        send_messages = mail.backends.locmem.EmailBackend.send_messages
+
+        def send(backend, messages):
+            if messages[0].to == [refused]:
+                raise SMTPRecipientsRefused({refused: (550, b"No such user")})
+            return send_messages(backend, messages)
+
+        with mock.patch("django.core.mail.backends.locmem.EmailBackend.send_messages", autospec=True, side_effect=send), \
+                mock.patch.object(send_course_update_chunk, "retry") as retry, \
+                self.assertLogs("lms.tasks", "WARNING"):
+            result = send_course_update_chunk.apply(args=(self.course.id, recipients))
+        retry.assert_not_called()
+        self.assertEqual(result.get(), len(recipients) - 1)
+        self.assertEqual([message.to[0] for message in mail.outbox], [r for r in recipients if r != refused])
+
+    def test_permanent_reply_is_skipped_transient_is_retried(self):
+        """5xx на письмо — пропуск адреса, 4xx — повтор с этого адреса"""
+        recipients = [student.email for student in self.students]
+        with mock.patch(
+            "django.core.mail.backends.locmem.EmailBackend.send_messages",
+            side_effect=[1, SMTPDataError(554, b"Rejected"), 1, SMTPDataError(451, b"Try later")],
+        ), mock.patch.object(send_course_update_chunk, "retry", side_effect=Retry()) as retry, \
+                self.assertLogs("lms.tasks", "WARNING"):
+            send_course_update_chunk.apply(args=(self.course.id, recipients))
+        self.assertEqual(retry.call_args.kwargs["args"], (self.course.id, recipients[3:]))
+
+
+class CourseNotifyWindowTestCase(APITestCase):
+    """Тесты окна объединения уведомлений об обновлении курса"""
+
+    def setUp(self):
+        self.owner = User.objects.create_user(
+            email="owner@test.com",
+            password="testpass123"
+        )
+        self.course = Course.objects.create(title="Course", owner=self.owner)
+        self.lesson = Lesson.objects.create(course=self.course, title="Lesson", owner=self.owner)
+        self.client.force_authenticate(user=self.owner)
+        cache.clear()
+
+    def patch_lesson(self, title):
+        url = reverse("lesson-detail", kwargs={"pk": self.lesson.id})
+        return self.client.patch(url, {"title": title})
+
+    def test_one_notification_per_window(self):
+        """Изменения курса и его уроков в одном окне дают одно уведомление"""
+        with mock.patch("lms.services.send_course_update_notification.delay") as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.patch_lesson("First")
+            with self.captureOnCommitCallbacks(execute=True):
+                self.patch_lesson("Second")
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.patch(reverse("course-detail", kwargs={"pk": self.course.id}), {"title": "Renamed"})
+            delay.assert_called_once_with(self.course.id)
+
+            # Окно истекло — следующее изменение снова уведомляет
+            cache.delete(course_notify_key(self.course.id))
+            with self.captureOnCommitCallbacks(execute=True):
+                self.patch_lesson("Third")
+        self.assertEqual(delay.call_count, 2)
+
+    def test_rollback_keeps_window_open(self):
+        """Откаченное изменение не занимает окно"""
+        with mock.patch("lms.services.send_course_update_notification.delay") as delay:
+            with self.captureOnCommitCallbacks(execute=False):
+                notify_courses_changed([self.course.id])
+            delay.assert_not_called()
+            with self.captureOnCommitCallbacks(execute=True):
+                notify_courses_changed([self.course.id, self.course.id])
+        delay.assert_called_once_with(self.course.id)
+
+
+class LinkPolicyTestCase(SimpleTestCase):
+    """Тесты проверки ссылок в материалах"""
+
+    def setUp(self):
+        self.policy = LinkPolicy(["youtube.com", "youtu.be"])
+
+    def test_allowed_hosts_and_subdomains(self):
+        """Разрешены хосты списка и их поддомены"""
+        for url in (
+            "https://youtube.com/watch?v=1",
+            "https://www.youtube.com/watch?v=1",
+            "https://M.YouTube.com:443/watch?v=1",
+            "https://youtu.be/abc",
+        ):
+            self.assertTrue(self.policy.is_allowed_url(url), url)
+
+    def test_lookalike_hosts_rejected(self):
+        """Похожие на YouTube хосты не проходят"""
+        for url in (
+            "https://notyoutube.com/watch",
+            "https://youtube.com.evil.org/watch",
+            "https://youtube.com@evil.org/watch",
+            "https://evil.org/youtube.com",
+            "youtube.com/watch",
+        ):
+            self.assertFalse(self.policy.is_allowed_url(url), url)
+
+    def test_first_rejected_link(self):
+        """Поиск останавливается на первой запрещенной ссылке"""
+        text = "a https://youtu.be/x b https://evil.org/1 c https://other.org/2"
+        self.assertEqual(self.policy.first_rejected_link(text), "https://evil.org")
+        self.assertIsNone(self.policy.first_rejected_link("https://www.youtube.com/a и https://youtu.be/b"))
+        self.assertIsNone(self.policy.first_rejected_link("Текст без ссылок"))
+
+    def test_large_description(self):
+        """Многомегабайтное описание проверяется целиком"""
+        text = "Смотрите https://www.youtube.com/watch?v=abc. " * 50000
+        validate_no_external_links(text)
+        with self.assertRaises(serializers.ValidationError):
+            validate_no_external_links(text + "https://example.com")
+
+    @override_settings(LMS_ALLOWED_LINK_HOSTS=["vimeo.com"])
+    def test_allowlist_from_settings(self):
+        """Список хостов берется из настроек"""
+        validate_youtube_url("https://player.vimeo.com/video/1")
+        with self.assertRaises(serializers.ValidationError):
+            validate_youtube_url("https://www.youtube.com/watch?v=1")
+
+
+class SearchTestCase(APITestCase):
+    """Тесты полнотекстового поиска"""
+
+    def setUp(self):
+        reset_fallback_index()
+        self.owner = User.objects.create_user(
+            email="owner@test.com",
+            password="testpass123"
+        )
+        self.other = User.objects.create_user(
+            email="other@test.com",
+            password="testpass123"
+        )
+        self.python = Course.objects.create(
+            title="Python для начинающих", description="Основы программирования", owner=self.owner
+        )
+        self.django = Course.objects.create(
+            title="Django", description="Веб-разработка на Python", owner=self.owner
+        )
+        self.lesson = Lesson.objects.create(
+            course=self.django, title="Модели Django", description="ORM и миграции", owner=self.owner
+        )
+        self.foreign = Course.objects.create(title="Python для профи", owner=self.other)
+        self.url = reverse("search")
+        self.client.force_authenticate(user=self.owner)
+
+    def tearDown(self):
+        reset_fallback_index()
+
+    def found(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [(item["type"], item["id"]) for item in response.data["results"]]
+
+    def test_ranking_and_visibility(self):
+        """Совпадение в заголовке выше совпадения в описании, чужие курсы скрыты"""
+        self.assertEqual(self.found(q="python"), [("course", self.python.id), ("course", self.django.id)])
+
+    def test_prefix_and_all_terms(self):
+        """Слова ищутся как префиксы, документ должен содержать все слова"""
+        self.assertEqual(self.found(q="мод djan"), [("lesson", self.lesson.id)])
+        self.assertEqual(self.found(q="djan", type="course"), [("course", self.django.id)])
+        self.assertEqual(self.found(q="python миграции"), [])
+
+    def test_moderator_sees_all(self):
+        """Модератор находит курсы всех владельцев"""
+        moderators_group, _ = Group.objects.get_or_create(name="moderators")
+        self.other.groups.add(moderators_group)
+        self.client.force_authenticate(user=self.other)
+        self.assertIn(("course", self.python.id), self.found(q="python"))
+        self.assertIn(("course", self.foreign.id), self.found(q="python"))
+
+    def test_index_follows_changes(self):
+        """Индекс обновляется после коммита изменений"""
+        self.assertEqual(self.found(q="python", type="course", limit=1), [("course", self.python.id)])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.python.title = "Go"
+            self.python.save()
+            self.lesson.delete()
+        self.assertEqual(self.found(q="python"), [("course", self.django.id)])
+        self.assertEqual(self.found(q="модели"), [])
+
+    def test_empty_query(self):
+        """Запрос без слов — ошибка валидации"""
+        response = self.client.get(self.url, {"q": " ,. "})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_short_terms_match_whole_words(self):
+        """Слова короче MIN_PREFIX_LENGTH ищутся только целиком"""
+        self.assertEqual(self.found(q="dj"), [])
+        self.assertEqual(self.found(q="на python", type="course"), [("course", self.django.id)])
+
+    @skipUnless(connection.vendor != "postgresql", "индекс в памяти используется только вне PostgreSQL")
+    def test_stale_index_is_rebuilt_without_blocking(self):
+        """Пока индекс перестраивается, поиск идет по прежнему, изменения не теряются"""
+        stale = get_fallback_index()
+        search_module._index_built_at -= search_module.FALLBACK_INDEX_TTL + 1
+        with search_module._rebuild_lock:
+            self.assertIs(get_fallback_index(), stale)
+
+        real_rows = search_module._document_rows
+
+        def rows_with_concurrent_commit(kind, pks=None):
+            rows = list(real_rows(kind, pks))
+            if pks is None and kind == "lesson":
+                # Изменение, закоммиченное после чтения строк перестройкой
+                Lesson.objects.filter(pk=self.lesson.pk).update(title="Шаблоны")
+                search_module._reindex("lesson", [self.lesson.pk])
+            return iter(rows)
+
+        with mock.patch.object(search_module, "_document_rows", rows_with_concurrent_commit):
+            rebuilt = get_fallback_index()
+        self.assertIsNot(rebuilt, stale)
+        self.assertIs(get_fallback_index(), rebuilt)
+        self.assertEqual(self.found(q="шабл"), [("lesson", self.lesson.id)])
+        self.assertEqual(self.found(q="модели"), [])
+
+
+@skipUnless(connection.vendor == "postgresql", "search_vector и индекс GIN есть только на PostgreSQL")
+class PostgresSearchTestCase(APITestCase):
+    """Тесты поиска по search_vector на PostgreSQL"""
+
+    def setUp(self):
+        self.owner = User.objects.create_user(email="owner@test.com", password="testpass123")
+        self.course = Course.objects.create(title="Python для начинающих", description="Основы", owner=self.owner)
+        self.lesson = Lesson.objects.create(
+            course=self.course, title="Модели Django", description="ORM и миграции", owner=self.owner
+        )
+        self.client.force_authenticate(user=self.owner)
+
+    def found(self, q):
+        response = self.client.get(reverse("search"), {"q": q})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [(item["type"], item["id"]) for item in response.data["results"]]
+
+    def test_trigger_keeps_search_vector(self):
+        """Триггер заполняет search_vector при вставке и пересчитывает при UPDATE в обход ORM"""
+        self.assertEqual(self.found("pyth"), [("course", self.course.id)])
+        Course.objects.filter(pk=self.course.pk).update(title="Go для начинающих")
+        self.assertEqual(self.found("pyth"), [])
+        self.assertEqual(self.found("go начин"), [("course", self.course.id)])
+
+    def test_prefix_queries(self):
+        """Длинные слова ищутся как префиксы, короткие — целиком"""
+        self.assertEqual(self.found("мод djan"), [("lesson", self.lesson.id)])
+        self.assertEqual(self.found("dj"), [])
+        self.assertEqual(self.found("и миграц"), [("lesson", self.lesson.id)])
+
+    def test_query_uses_gin_index(self):
+        """Поиск по префиксу читает индексы GIN"""
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        for model, index_name in ((Course, "lms_course_search_idx"), (Lesson, "lms_lesson_search_idx")):
+            query = SearchQuery("'pyth':*", search_type="raw", config=SEARCH_CONFIG)
+            plan = model.objects.filter(search_vector=query).explain()
+            self.assertIn(index_name, plan)
+
+
+class CourseAnalyticsTestCase(APITestCase):
+    """Тесты сводной статистики по курсам"""
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(
+            email="owner@test.com",
+            password="testpass123"
+        )
+        self.student = User.objects.create_user(
+            email="student@test.com",
+            password="testpass123"
+        )
+        self.course = Course.objects.create(title="Course", owner=self.owner)
+        self.lesson = Lesson.objects.create(course=self.course, title="Lesson", owner=self.owner)
+        self.foreign = Course.objects.create(title="Foreign", owner=self.student)
+        self.today = timezone.localdate()
+
+    def stats(self, course=None):
+        stats = CourseDailyStats.objects.filter(course=course or self.course, date=self.today).first()
+        return (stats.revenue, stats.payments, stats.new_subscribers) if stats else None
+
+    def pay(self, amount, **target):
+        payment = Payment.objects.create(user=self.student, amount=Decimal(amount), **target)
+        payment = Payment.objects.get(pk=payment.pk)
+        payment.payment_status = Payment.PaymentStatus.PAID
+        payment.save()
+        return payment
+
+    def test_payment_status_transitions(self):
+        """Оплата курса и урока попадает в срез курса, отмена оплаты вычитается"""
+        self.pay("100.00", paid_course=self.course)
+        payment = self.pay("25.50", paid_lesson=self.lesson)
+        self.assertEqual(self.stats(), (Decimal("125.50"), 2, 0))
+
+        payment.payment_status = Payment.PaymentStatus.CANCELLED
+        payment.save()
+        payment.save()
+        self.assertEqual(self.stats(), (Decimal("100.00"), 1, 0))
+
+    def test_subscriptions(self):
+        """Подписки и отписки сдвигают new_subscribers дня оформления"""
+        self.client.force_authenticate(user=self.student)
+        self.client.post(reverse("subscription"), {"course_id": self.course.id})
+        self.assertEqual(self.stats(), (Decimal("0"), 0, 1))
+        subscribe_users([self.owner.id], [self.course.id, self.foreign.id])
+        self.assertEqual(self.stats(), (Decimal("0"), 0, 2))
+        self.assertEqual(self.stats(self.foreign), (Decimal("0"), 0, 1))
+        unsubscribe_users([self.owner.id, self.student.id], [self.course.id])
+        self.assertEqual(self.stats(), (Decimal("0"), 0, 0))
+
+    def test_refresh_catches_up(self):
+        """Задача пересчета исправляет изменения в обход инкрементальных обновлений"""
+        self.pay("100.00", paid_course=self.course)
+        Payment.objects.create(
+            user=self.student, amount=Decimal("40.00"), paid_lesson=self.lesson,
+            payment_status=Payment.PaymentStatus.PAID,
+        )
+        Payment.objects.filter(amount=Decimal("100.00")).update(payment_status=Payment.PaymentStatus.CANCELLED)
+        Subscription.objects.create(user=self.student, course=self.course)
+        self.assertEqual(self.stats(), (Decimal("140.00"), 2, 0))
+
+        refresh_course_stats.apply()
+        self.assertEqual(self.stats(), (Decimal("40.00"), 1, 1))
+
+    def test_analytics_endpoint(self):
+        """Владелец видит только свои курсы, ответ собирается из срезов"""
+        CourseDailyStats.objects.create(
+            course=self.course, date=self.today - timedelta(days=1), revenue=Decimal("10"), payments=1
+        )
+        CourseDailyStats.objects.create(course=self.course, date=self.today, revenue=Decimal("5"), new_subscribers=3)
+        CourseDailyStats.objects.create(course=self.foreign, date=self.today, revenue=Decimal("99"))
+        self.client.force_authenticate(user=self.owner)
+        url = reverse("analytics")
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row["revenue"] for row in response.data["results"]], ["10.00", "5.00"])
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, {"bucket": "month", "course": self.course.id})
+        self.assertEqual(len(ctx.captured_queries), 1)
+        months = {self.today.replace(day=1), (self.today - timedelta(days=1)).replace(day=1)}
+        self.assertEqual(len(response.data["results"]), len(months))
+        self.assertEqual(sum(row["new_subscribers"] for row in response.data["results"]), 3)
+
+    def test_analytics_invalid_range(self):
+        """Слишком длинный или перевернутый период — 400"""
+        self.client.force_authenticate(user=self.owner)
+        url = reverse("analytics")
+        self.assertEqual(
+            self.client.get(url, {"date_from": "2020-01-01", "date_to": "2024-01-01"}).status_code,
+            status.HTTP_400_BAD_REQUEST,
+        )
+        self.assertEqual(
+            self.client.get(url, {"date_from": "2024-02-01", "date_to": "2024-01-01"}).status_code,
+            status.HTTP_400_BAD_REQUEST,
+        )
+
+
+class EndpointBenchmarkTestCase(APITestCase):
+    """Бюджеты SQL-запросов эндпоинтов (lms.benchmarks, lms/benchmark_budgets.json)"""
+
+    def test_every_route_has_scenario(self):
+        self.assertEqual(uncovered_routes(), [])
+
+    def test_every_scenario_has_budget(self):
+        self.assertEqual({scenario.name for scenario in SCENARIOS} - set(load_budgets()), set())
+
+    def test_query_budgets(self):
+        """Задержки зависят от машины, поэтому в тестах проверяется только число запросов"""
+        cache.set("users:tokens-revoked:1", 1.0)
+        report = run_benchmarks(
+            iterations=1,
+            seed_options={"users": 30, "courses": 20, "lessons_per_course": 3, "payments": 20},
+        )
+        self.assertEqual(check_budgets(report, load_budgets(), metrics=["queries"]), [])
+        self.assertEqual(Course.objects.count(), 0)
+        # Замеры идут на своем кеше и не очищают общий
+        self.assertEqual(cache.get("users:tokens-revoked:1"), 1.0)
+
+    def test_compare_reports(self):
+        baseline = {"results": {"a": {"queries": 3, "p50_ms": 10.0, "p95_ms": 20.0, "alloc_kb": 100.0}}}
+        report = {"results": {"a": {"queries": 4, "p50_ms": 10.5, "p95_ms": 30.0, "alloc_kb": 100.0}}}
+        self.assertEqual(compare_reports(report, baseline), {"a": {"queries": (3, 4), "p95_ms": (20.0, 30.0)}})
+
+
+class SyntheticDataTestCase(APITestCase):
+    """Генератор синтетических данных (lms.synthetic, generate_synthetic_data)"""
+
+    def generate(self, **options):
+        call_command("generate_synthetic_data", workers=1, stdout=StringIO(), **options)
+
+    now = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+
+    def plan(self, seed=0):
+        return prepare_plan(Plan(
+            users=300, courses=20, payments=400, password_hash="x", now=self.now, seed=seed, chunk_size=100
+        ))
+
+    def test_requested_volumes(self):
+        self.generate(users=300, courses=20, payments=1000, password="secret-pass")
+        self.assertEqual(get_user_model().objects.count(), 300)
+        self.assertEqual(Course.objects.count(), 20)
+        self.assertEqual(Payment.objects.count(), 1000)
+        self.assertTrue(Subscription.objects.exists())
+        self.assertTrue(get_user_model().objects.order_by("?").first().check_password("secret-pass"))
+        # Счетчики и сводная статистика пересчитаны после вставки в обход сигналов
+        self.assertEqual(repair_course_counters(), 0)
+        self.assertTrue(CourseDailyStats.objects.exists())
+
+    def test_appends_after_existing_rows(self):
+        self.generate(users=50, courses=5, payments=50)
+        self.generate(users=50, courses=5, payments=50)
+        self.assertEqual(get_user_model().objects.count(), 100)
+        self.assertEqual(Payment.objects.count(), 100)
+        # Последовательности сдвинуты за явно заданные id
+        self.assertEqual(get_user_model().objects.create(email="after@example.com").pk, 101)
+
+    def test_rejects_non_positive_options(self):
+        """Нулевые и отрицательные объемы и параметры распределений отклоняются до генерации"""
+        for option, value in (
+            ("users", 0), ("courses", 0), ("lessons_per_course", 0.0), ("subscriptions_per_user", -1.0),
+            ("payments", -5), ("days", 0), ("zipf", 0.0), ("chunk_size", 0),
+        ):
+            with self.assertRaisesMessage(CommandError, f"--{option.replace('_', '-')} must be positive"):
+                self.generate(**{"users": 10, option: value})
+        with self.assertRaisesMessage(CommandError, "--workers must be positive"):
+            call_command("generate_synthetic_data", users=10, workers=0, stdout=StringIO())
+        self.assertFalse(get_user_model().objects.exists())
+
+    def test_zero_lesson_mean_does_not_break_chunks(self):
+        plan = replace(self.plan(), lessons_per_course=0)
+        self.assertEqual(chunks(plan, "lessons"), [(0, 20)])
+
+    def test_rows_depend_only_on_seed(self):
+        first, second, other = self.plan(), self.plan(), self.plan(seed=1)
+        for kind in ("users", "courses", "lessons", "subscriptions", "payments"):
+            self.assertEqual(chunk_rows(first, kind, 0, 10)[2], chunk_rows(second, kind, 0, 10)[2])
+        self.assertNotEqual(chunk_rows(first, "payments", 0, 10)[2], chunk_rows(other, "payments", 0, 10)[2])
+
+    def test_course_popularity_is_skewed(self):
+        plan = self.plan()
+        _, columns, rows = chunk_rows(plan, "payments", 0, plan.payments)
+        course = columns.index("paid_course_id")
+        counts = sorted(Counter(row[course] for row in rows if row[course]).values(), reverse=True)
+        # Два самых популярных курса из 20 собирают больше трети оплат курсов
+        self.assertGreater(sum(counts[:2]), sum(counts) / 3)
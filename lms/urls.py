@@ -1,7 +1,17 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from lms.views import CourseViewSet, LessonDetailView, LessonListCreateView, SubscriptionAPIView
+from lms.views import (
+    AnalyticsAPIView,
+    CourseViewSet,
+    LessonBulkView,
+    LessonDetailView,
+    LessonListCreateView,
+    SearchAPIView,
+    SubscriptionAPIView,
+    SubscriptionBulkAPIView,
+    SubscriptionStatusAPIView,
+)
 
 router = DefaultRouter()
 router.register(r"courses", CourseViewSet, basename="course")
@@ -9,8 +19,13 @@ router.register(r"courses", CourseViewSet, basename="course")
 urlpatterns = [
     path("", include(router.urls)),
     path("lessons/", LessonListCreateView.as_view(), name="lesson-list"),
+    path("lessons/bulk/", LessonBulkView.as_view(), name="lesson-bulk"),
     path("lessons/<int:pk>/", LessonDetailView.as_view(), name="lesson-detail"),
     path("subscriptions/", SubscriptionAPIView.as_view(), name="subscription"),
+    path("subscriptions/bulk/", SubscriptionBulkAPIView.as_view(), name="subscription-bulk"),
+    path("subscriptions/status/", SubscriptionStatusAPIView.as_view(), name="subscription-status"),
+    path("search/", SearchAPIView.as_view(), name="search"),
+    path("analytics/", AnalyticsAPIView.as_view(), name="analytics"),
 ]
 
 
@@ -1,7 +1,83 @@
 import re
-from django.core.exceptions import ValidationError
+from functools import lru_cache
+
+from django.conf import settings
 from rest_framework import serializers
-from urllib.parse import urlparse
+
+# Хосты, ссылки на которые разрешены в материалах (вместе с поддоменами)
+DEFAULT_ALLOWED_LINK_HOSTS = ("youtube.com", "youtu.be")
+
+YOUTUBE_URL_MESSAGE = "Ссылка должна вести на youtube.com. Разрешены только ссылки на YouTube."
+EXTERNAL_LINK_MESSAGE = "В материалах запрещены ссылки на сторонние ресурсы, кроме youtube.com"
+
+# Из ссылки нужна только authority (userinfo@host:port): она заканчивается на первом
+# "/", "?", "#" или символе, который не может входить в URL. Класс символов без
+# альтернатив не дает откатов, поэтому поиск по тексту линеен по его длине.
+_AUTHORITY = r'([^\s<>"{}|\\^`\[\]/?#]*)'
+_TEXT_LINK_RE = re.compile(r"https?://" + _AUTHORITY)
+_URL_RE = re.compile(r"[A-Za-z][A-Za-z0-9+.\-]*://" + _AUTHORITY)
+
+
+def _authority_host(authority):
+    host = authority.rpartition("@")[2]
+    if host.startswith("["):
+        # IPv6-литерал: [::1]:8000
+        return host[1:].partition("]")[0].lower()
+    return host.partition(":")[0].rstrip(".").lower()
+
+
+class LinkPolicy:
+    """
+    Скомпилированная проверка ссылок по списку разрешенных хостов.
+
+    Хост разрешен, если он совпадает с одним из хостов списка или является
+    его поддоменом (www.youtube.com, m.youtube.com). Проверка хоста — не
+    больше одного поиска в множестве на каждую метку домена.
+    """
+
+    def __init__(self, allowed_hosts):
+        self.allowed_hosts = frozenset(host.strip(".").lower() for host in allowed_hosts)
+
+    def is_allowed_host(self, host):
+        while host:
+            if host in self.allowed_hosts:
+                return True
+            host = host.partition(".")[2]
+        return False
+
+    def is_allowed_url(self, url):
+        match = _URL_RE.match(url)
+        return match is not None and self.is_allowed_host(_authority_host(match.group(1)))
+
+    def first_rejected_link(self, text):
+        """
+        Возвращает первую ссылку в тексте, ведущую на неразрешенный хост, или None.
+
+        Текст без "http" (большинство описаний) отсекается поиском подстроки,
+        остальной просматривается за один проход до первой запрещенной ссылки.
+        """
+        if "http" not in text:
+            return None
+        # В длинных текстах одни и те же хосты повторяются: разбираем каждый один раз
+        checked = set()
+        for match in _TEXT_LINK_RE.finditer(text):
+            authority = match.group(1)
+            if authority in checked:
+                continue
+            if not self.is_allowed_host(_authority_host(authority)):
+                return match.group(0)
+            checked.add(authority)
+        return None
+
+
+@lru_cache(maxsize=8)
+def _link_policy(allowed_hosts):
+    return LinkPolicy(allowed_hosts)
+
+
+def get_link_policy():
+    """Политика для хостов из настройки LMS_ALLOWED_LINK_HOSTS"""
+    return _link_policy(tuple(getattr(settings, "LMS_ALLOWED_LINK_HOSTS", DEFAULT_ALLOWED_LINK_HOSTS)))
 
 
 def validate_youtube_url(value):
@@ -10,14 +86,9 @@ def validate_youtube_url(value):
     """
     if not value:
         return  # Пустые значения разрешены (blank=True)
-    
-    parsed = urlparse(value)
-    
-    # Проверяем, что домен содержит youtube.com
-    if 'youtube.com' not in parsed.netloc and 'youtu.be' not in parsed.netloc:
-        raise serializers.ValidationError(
-            "Ссылка должна вести на youtube.com. Разрешены только ссылки на YouTube."
-        )
+
+    if not get_link_policy().is_allowed_url(value):
+        raise serializers.ValidationError(YOUTUBE_URL_MESSAGE)
 
 
 def validate_no_external_links(value):
@@ -27,29 +98,6 @@ def validate_no_external_links(value):
     """
     if not value:
         return
-    
-    # Ищем все URL в тексте
-    url_pattern = r'https?://[^\s<>"{}|\\^`\[\]]+'
-    urls = re.findall(url_pattern, value)
-    
-    for url in urls:
-        parsed = urlparse(url)
-        # Если найдена ссылка не на youtube.com
-        if 'youtube.com' not in parsed.netloc and 'youtu.be' not in parsed.netloc:
-            raise serializers.ValidationError(
-                "В материалах запрещены ссылки на сторонние ресурсы, кроме youtube.com"
-            )
-
-
-class YouTubeURLValidator:
-    """
-    Класс-валидатор для проверки YouTube ссылок в сериализаторах
-    """
-    def __init__(self, field='video_url'):
-        self.field = field
-    
-    def __call__(self, attrs):
-        field_value = attrs.get(self.field)
-        if field_value:
-            validate_youtube_url(field_value)
 
+    if get_link_policy().first_rejected_link(value) is not None:
+        raise serializers.ValidationError(EXTERNAL_LINK_MESSAGE)
@@ -1,31 +1,132 @@
-from datetime import timedelta
+from collections import Counter
 
+from django.db import transaction
+from django.db.models import Count, Exists, F, FilteredRelation, Max, OuterRef, Prefetch, Q, Sum, Value
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
+from drf_spectacular.utils import OpenApiParameter, extend_schema
 from rest_framework import generics, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from lms.mixins import ConditionalGetMixin, RowListMixin, SparseFieldsetMixin
 from lms.models import Course, Lesson, Subscription
-from lms.paginators import CourseLessonPagination
+from lms.paginators import CourseLessonKeysetPagination, CourseLessonPagination
 from lms.permissions import IsCourseOwner, IsLessonOwner, IsOwnerOrModerator
-from lms.serializers import CourseSerializer, LessonSerializer
-from lms.tasks import send_course_update_notification
-from users.permissions import IsModerator, MODERATOR_GROUP
+from lms.analytics import course_stats, record_subscriptions
+from lms.search import reindex_documents, search
+from lms.serializers import (
+    AnalyticsQuerySerializer,
+    SearchQuerySerializer,
+    SearchResultSerializer,
+    CourseSerializer,
+    CourseStatsSerializer,
+    LessonListSerializer,
+    LessonSerializer,
+    SubscriptionBulkSerializer,
+    SubscriptionStatusSerializer,
+)
+from lms.services import (
+    adjust_course_counters,
+    get_subscribed_course_ids,
+    mark_courses_updated,
+    notify_courses_changed,
+    subscribe_users,
+    unsubscribe_users,
+    visible_courses,
+    visible_lessons,
+)
+from users.permissions import IsModerator, is_moderator
 
 
 
-class CourseViewSet(viewsets.ModelViewSet):
+class CourseViewSet(ConditionalGetMixin, RowListMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     serializer_class = CourseSerializer
     pagination_class = CourseLessonPagination
+    sparse_model_fields = {
+        "owner": "owner",
+        "title": "title",
+        "description": "description",
+        "preview": "preview",
+        "lessons_count": "lessons_count",
+        "subscribers_count": "subscribers_count",
+    }
+    expandable_fields = ("lessons",)
+
+    def get_visible_queryset(self):
+        return visible_courses(self.request.user)
 
     def get_queryset(self):
-        qs = Course.objects.all()
+        return self.annotate_queryset(self.get_visible_queryset().order_by("id"))
+
+    def get_conditional_state(self, many):
+        """
+        Состояние курсов для ETag одним запросом: updated_at курса (его обновляют
+        и изменения уроков, см. lms.signals), счетчики уроков и подписчиков и
+        подписка текущего пользователя.
+        """
+        user = self.request.user
+        qs = self.get_visible_queryset().annotate(
+            my_subscription=FilteredRelation("subscriptions", condition=Q(subscriptions__user=user))
+        )
+        if many:
+            state = qs.aggregate(
+                count=Count("id"),
+                last_id=Max("id"),
+                updated_at=Max("updated_at"),
+                subscribers=Sum("subscribers_count"),
+                # Взвешенная сумма замечает перенос подписчиков между курсами при той же общей сумме
+                subscribers_weighted=Sum(F("subscribers_count") * F("id")),
+                lessons=Sum("lessons_count"),
+                lessons_weighted=Sum(F("lessons_count") * F("id")),
+                subscriptions=Count("my_subscription"),
+                last_subscription=Max("my_subscription__id"),
+            )
+        else:
+            lookup = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+            try:
+                state = qs.filter(pk=lookup).values(
+                    "updated_at",
+                    "lessons_count",
+                    "subscribers_count",
+                    last_subscription=F("my_subscription__id"),
+                ).first()
+            except (TypeError, ValueError):
+                state = None
+            if state is None:
+                return None
+        return sorted(state.items())
+
+    def annotate_queryset(self, qs):
+        """
+        Подготавливает всё, что нужно CourseSerializer, за фиксированное число запросов:
+        счетчики хранятся в самом курсе, флаг подписки считается в основном запросе,
+        уроки (не больше lessons_limit + 1 на курс) подгружаются одним prefetch-запросом.
+        Незапрошенные через ?fields= поля не считаются и не загружаются.
+        """
         user = self.request.user
-        if user.is_authenticated and user.groups.filter(name=MODERATOR_GROUP).exists():
-            return qs
-        return qs.filter(owner=user)
+        annotations = {}
+        if self.is_field_requested("is_subscribed"):
+            if user.is_authenticated:
+                annotations["annotated_is_subscribed"] = Exists(
+                    Subscription.objects.filter(user=user, course=OuterRef("pk"))
+                )
+            else:
+                annotations["annotated_is_subscribed"] = Value(False)
+        qs = self.defer_unrequested_fields(qs.annotate(**annotations))
+        if "lessons" in self.get_expand():
+            limit = self.serializer_class.lessons_limit
+            qs = qs.prefetch_related(
+                Prefetch(
+                    "lessons",
+                    queryset=Lesson.objects.order_by("id")[:limit + 1],
+                    to_attr="expanded_lessons",
+                )
+            )
+        return qs
 
     def get_permissions(self):
         if self.action in ["list", "retrieve"]:
@@ -52,71 +153,142 @@ class CourseViewSet(viewsets.ModelViewSet):
         serializer.save(owner=self.request.user)
 
     def perform_update(self, serializer):
-        course = self.get_object()
-        last_updated = course.updated_at
-        now = timezone.now()
+        course = serializer.save(owner=self.request.user)
+        notify_courses_changed([course.id])
 
-        serializer.save(owner=self.request.user)
+    @extend_schema(responses=LessonSerializer(many=True))
+    @action(detail=True, methods=["get"], pagination_class=CourseLessonKeysetPagination)
+    def lessons(self, request, pk=None):
+        """
+        Уроки курса с keyset-пагинацией — продолжение lessons_next. Доступны
+        всем, кто видит курс, в том числе уроки других авторов этого курса.
+        """
+        course = get_object_or_404(self.get_visible_queryset().only("id"), pk=pk)
+        self.check_object_permissions(request, course)
+        page = self.paginate_queryset(Lesson.objects.filter(course=course))
+        return self.get_paginated_response(LessonSerializer(page, many=True, context=self.get_serializer_context()).data)
+
+
+LESSON_SPARSE_MODEL_FIELDS = {
+    "owner": "owner",
+    "course": "course",
+    "title": "title",
+    "description": "description",
+    "preview": "preview",
+    "video_url": "video_url",
+}
+
+
+class LessonQuerysetMixin:
+    """Видимость уроков (свои или все для модератора) и валидаторы для условных GET."""
+
+    def get_visible_queryset(self):
+        return visible_lessons(self.request.user)
+
+    def get_queryset(self):
+        # Тот же порядок, что и у keyset-пагинации: страницы ?page= стабильны
+        return self.defer_unrequested_fields(self.get_visible_queryset().order_by("pk"))
 
-        # Уведомляем подписчиков об обновлении курса,
-        # только если курс не обновлялся более 4 часов
-        if not last_updated or now - last_updated >= timedelta(hours=4):
-            send_course_update_notification.delay(course.id)
+    def get_conditional_state(self, many):
+        if many:
+            state = self.filter_queryset(self.get_visible_queryset()).aggregate(
+                count=Count("id"),
+                last_id=Max("id"),
+                updated_at=Max("updated_at"),
+            )
+        else:
+            state = self.get_visible_queryset().filter(pk=self.kwargs["pk"]).values("updated_at").first()
+            if state is None:
+                return None
+        return sorted(state.items())
 
 
-class LessonListCreateView(generics.ListCreateAPIView):
+class LessonListCreateView(
+    LessonQuerysetMixin, ConditionalGetMixin, RowListMixin, SparseFieldsetMixin, generics.ListCreateAPIView
+):
     serializer_class = LessonSerializer
     permission_classes = [IsAuthenticated]
     pagination_class = CourseLessonPagination
-
-    def get_queryset(self):
-        qs = Lesson.objects.all()
-        user = self.request.user
-        if user.is_authenticated and user.groups.filter(name=MODERATOR_GROUP).exists():
-            return qs
-        return qs.filter(owner=user)
+    filterset_fields = ["course"]
+    sparse_model_fields = LESSON_SPARSE_MODEL_FIELDS
 
     def get_permissions(self):
         if self.request.method.lower() == "post":
-            return [IsAuthenticated(), ~IsModerator()]
+            return [IsAuthenticated(), (~IsModerator)()]
         return [permission() for permission in self.permission_classes]
 
     def perform_create(self, serializer):
-        serializer.save(owner=self.request.user)
+        lesson = serializer.save(owner=self.request.user)
+        notify_courses_changed([lesson.course_id])
 
 
-class LessonDetailView(generics.RetrieveUpdateDestroyAPIView):
+class LessonDetailView(
+    LessonQuerysetMixin, ConditionalGetMixin, SparseFieldsetMixin, generics.RetrieveUpdateDestroyAPIView
+):
     serializer_class = LessonSerializer
     permission_classes = [IsAuthenticated, IsOwnerOrModerator]
-
-    def get_queryset(self):
-        qs = Lesson.objects.all()
-        user = self.request.user
-        if user.is_authenticated and user.groups.filter(name=MODERATOR_GROUP).exists():
-            return qs
-        return qs.filter(owner=user)
+    sparse_model_fields = LESSON_SPARSE_MODEL_FIELDS
 
     def get_permissions(self):
         if self.request.method.lower() == "delete":
-            return [IsAuthenticated(), IsLessonOwner(), ~IsModerator()]
+            return [IsAuthenticated(), IsLessonOwner(), (~IsModerator)()]
         return super().get_permissions()
 
     def perform_update(self, serializer):
-        lesson = self.get_object()
-        course = lesson.course
-        last_updated = course.updated_at
-        now = timezone.now()
+        previous_course_id = serializer.instance.course_id
+        lesson = serializer.save(owner=self.request.user)
+        # Обновление урока считается обновлением курса (и прежнего курса при переносе)
+        notify_courses_changed({previous_course_id, lesson.course_id})
 
-        serializer.save(owner=self.request.user)
 
-        # Считаем обновление урока обновлением курса.
-        # Уведомляем подписчиков только если курс не обновлялся более 4 часов.
-        if not last_updated or now - last_updated >= timedelta(hours=4):
-            send_course_update_notification.delay(course.id)
+class LessonBulkView(LessonQuerysetMixin, SparseFieldsetMixin, generics.GenericAPIView):
+    """
+    Массовый импорт уроков.
+
+    POST — список новых уроков, PATCH — список частичных изменений с `id`.
+    Все элементы проверяются за один проход; при ошибках ничего не пишется,
+    а в ответе возвращается список ошибок по элементам (пустой для валидных).
+    Запись — одной транзакцией через bulk_create / bulk_update; курсы
+    отмечаются обновленными один раз на курс.
+    """
+    serializer_class = LessonSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_permissions(self):
+        if self.request.method.lower() == "post":
+            return [IsAuthenticated(), (~IsModerator)()]
+        return [permission() for permission in self.permission_classes]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            lessons = serializer.save(owner=request.user)
+            added = Counter(lesson.course_id for lesson in lessons)
+            mark_courses_updated(added)
+            adjust_course_counters("lessons_count", added)
+            reindex_documents("lesson", [lesson.pk for lesson in lessons])
+        return Response(self.get_serializer(lessons, many=True).data, status=status.HTTP_201_CREATED)
 
-        # Обновляем время последнего обновления курса
-        course.updated_at = now
-        course.save(update_fields=["updated_at"])
+    def patch(self, request, *args, **kwargs):
+        items = request.data if isinstance(request.data, list) else []
+        ids = {LessonListSerializer.get_item_id(item) for item in items} - {None}
+        with transaction.atomic():
+            instances = self.get_visible_queryset().select_for_update().in_bulk(ids)
+            previous_courses = {lesson.pk: lesson.course_id for lesson in instances.values()}
+            serializer = self.get_serializer(instances, data=request.data, many=True, partial=True)
+            serializer.is_valid(raise_exception=True)
+            lessons = serializer.save()
+            # Перенос уроков между курсами меняет счетчики обоих курсов
+            moved = Counter()
+            for lesson in lessons:
+                if lesson.course_id != previous_courses[lesson.pk]:
+                    moved[previous_courses[lesson.pk]] -= 1
+                    moved[lesson.course_id] += 1
+            mark_courses_updated(set(previous_courses.values()) | {lesson.course_id for lesson in lessons})
+            adjust_course_counters("lessons_count", moved)
+            reindex_documents("lesson", [lesson.pk for lesson in lessons])
+        return Response(self.get_serializer(lessons, many=True).data)
 
 
 class SubscriptionAPIView(APIView):
@@ -142,9 +314,112 @@ class SubscriptionAPIView(APIView):
         if not created:
             # Подписка уже существует - удаляем
             subscription.delete()
+            adjust_course_counters("subscribers_count", {course.id: -1})
+            record_subscriptions({(course.id, timezone.localdate(subscription.created_at)): -1})
             message = "подписка удалена"
         else:
             # Подписка создана
+            adjust_course_counters("subscribers_count", {course.id: 1})
+            record_subscriptions({course.id: 1})
             message = "подписка добавлена"
         
         return Response({"message": message}, status=status.HTTP_200_OK)
+
+
+class SubscriptionBulkAPIView(generics.GenericAPIView):
+    """
+    Массовая подписка/отписка когорты пользователей на курсы.
+
+    Доступна владельцу всех перечисленных курсов и модераторам. Запись —
+    множественными INSERT ... ON CONFLICT DO NOTHING или одним DELETE.
+    """
+    serializer_class = SubscriptionBulkSerializer
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        users = serializer.validated_data["users"]
+        courses = serializer.validated_data["courses"]
+
+        if not is_moderator(request.user):
+            foreign = Course.objects.filter(pk__in=courses).exclude(owner=request.user).exists()
+            if foreign:
+                raise PermissionDenied("Управлять подписками можно только на свои курсы")
+
+        with transaction.atomic():
+            if serializer.validated_data["action"] == SubscriptionBulkSerializer.SUBSCRIBE:
+                result = {"created": subscribe_users(users, courses)}
+            else:
+                result = {"deleted": unsubscribe_users(users, courses)}
+        return Response(result, status=status.HTTP_200_OK)
+
+
+class SubscriptionStatusAPIView(APIView):
+    """На какие из перечисленных курсов подписан текущий пользователь (`?course_ids=1,2,3`)"""
+    permission_classes = [IsAuthenticated]
+    max_course_ids = 500
+
+    @extend_schema(
+        parameters=[OpenApiParameter("course_ids", str, description="id курсов через запятую")],
+        responses={200: SubscriptionStatusSerializer},
+    )
+    def get(self, request, *args, **kwargs):
+        raw = request.query_params.get("course_ids", "")
+        try:
+            course_ids = {int(pk) for pk in raw.split(",") if pk.strip()}
+        except ValueError:
+            return Response(
+                {"error": "course_ids должен быть списком чисел через запятую"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(course_ids) > self.max_course_ids:
+            return Response(
+                {"error": f"Не больше {self.max_course_ids} курсов за запрос"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        subscribed = get_subscribed_course_ids(request.user, course_ids) if course_ids else set()
+        return Response({"subscribed": sorted(subscribed)})
+
+
+class SearchAPIView(APIView):
+    """
+    Полнотекстовый поиск по курсам и урокам, доступным пользователю (`?q=`).
+
+    Каждое слово запроса ищется как префикс, поэтому подходит для автодополнения.
+    Результаты обоих типов идут одним списком по убыванию релевантности.
+    """
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(parameters=[SearchQuerySerializer], responses={200: SearchResultSerializer(many=True)})
+    def get(self, request, *args, **kwargs):
+        params = SearchQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        types = [params.validated_data["type"]] if params.validated_data.get("type") else None
+        results = search(request.user, params.validated_data["q"], types=types, limit=params.validated_data["limit"])
+        return Response({"results": SearchResultSerializer(results, many=True).data})
+
+
+class AnalyticsAPIView(APIView):
+    """
+    Выручка, число оплат и новые подписчики по курсам пользователя
+    (модератору — по всем курсам) с шагом день / неделя / месяц.
+
+    Отвечает из сводной таблицы CourseDailyStats, не обращаясь к платежам и подпискам.
+    """
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(parameters=[AnalyticsQuerySerializer], responses={200: CourseStatsSerializer(many=True)})
+    def get(self, request, *args, **kwargs):
+        params = AnalyticsQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        courses = visible_courses(request.user)
+        if "course" in params.validated_data:
+            courses = courses.filter(pk=params.validated_data["course"])
+        rows = course_stats(
+            courses,
+            params.validated_data["date_from"],
+            params.validated_data["date_to"],
+            params.validated_data["bucket"],
+        )
+        return Response({"results": CourseStatsSerializer(rows, many=True).data})
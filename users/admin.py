@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 
-from users.models import Payment, User
+from users.models import Payment, StripeEvent, User
 
 
 @admin.register(User)
@@ -32,6 +32,13 @@ class CustomUserAdmin(UserAdmin):
 
 @admin.register(Payment)
 class PaymentAdmin(admin.ModelAdmin):
-    list_display = ("user", "payment_date", "paid_course", "paid_lesson", "amount", "payment_method")
-    list_filter = ("payment_method", "payment_date")
+    list_display = ("user", "payment_date", "paid_course", "paid_lesson", "amount", "payment_method", "payment_status")
+    list_filter = ("payment_method", "payment_status", "payment_date")
     search_fields = ("user__email", "paid_course__title", "paid_lesson__title")
+
+
+@admin.register(StripeEvent)
+class StripeEventAdmin(admin.ModelAdmin):
+    list_display = ("event_id", "type", "created_at")
+    list_filter = ("type",)
+    search_fields = ("event_id",)
@@ -0,0 +1,143 @@
+from django.core.cache import cache
+from django.db import router
+from django.db.models import DEFERRED
+from django.utils.translation import gettext_lazy as _
+from drf_spectacular.contrib.rest_framework_simplejwt import SimpleJWTScheme
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from users.tokens import USER_CLAIMS, is_token_revoked, revoked_cache_key
+
+# Сколько живет в общем кеше пользователь, прочитанный для токена без claims
+USER_CACHE_TIMEOUT = 60
+
+
+def user_cache_key(user_id):
+    return f"users:auth-user:{user_id}"
+
+
+class AsyncJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication с асинхронным вариантом для AsyncAPIView: токен
+    проверяется так же, а пользователь читается через асинхронный ORM.
+    """
+
+    async def aauthenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+    async def aget_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        try:
+            user = await self.user_model.objects.aget(**{api_settings.USER_ID_FIELD: user_id})
+        except self.user_model.DoesNotExist as e:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found") from e
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
+
+
+class ClaimsJWTAuthentication(AsyncJWTAuthentication):
+    """
+    Аутентификация по claims access-токена (users.tokens) без запросов к БД.
+
+    Пользователь собирается из claims: загружены только id, is_staff и
+    is_active, роль модератора уже известна is_moderator(), остальные поля
+    отложены и читаются из БД при первом обращении. Единственное обращение
+    к кешу на запрос — проверка, не отозваны ли токены пользователя. Для
+    токенов без claims (выданных раньше) пользователь берется из общего кеша
+    на USER_CACHE_TIMEOUT секунд, а при промахе — из БД.
+    """
+
+    def get_user(self, validated_token):
+        user_id = self.get_user_id(validated_token)
+        keys = self.cache_keys(validated_token, user_id)
+        cached = cache.get_many(keys)
+        if is_token_revoked(validated_token, cached.get(keys[0])):
+            raise AuthenticationFailed(_("Token has been revoked"), code="token_revoked")
+        if self.has_claims(validated_token):
+            return self.user_from_claims(validated_token, user_id)
+
+        user = cached.get(keys[1])
+        if user is None:
+            user = super().get_user(validated_token)
+            cache.set(keys[1], user, USER_CACHE_TIMEOUT)
+        return user
+
+    async def aget_user(self, validated_token):
+        user_id = self.get_user_id(validated_token)
+        keys = self.cache_keys(validated_token, user_id)
+        cached = await cache.aget_many(keys)
+        if is_token_revoked(validated_token, cached.get(keys[0])):
+            raise AuthenticationFailed(_("Token has been revoked"), code="token_revoked")
+        if self.has_claims(validated_token):
+            return self.user_from_claims(validated_token, user_id)
+
+        user = cached.get(keys[1])
+        if user is None:
+            user = await super().aget_user(validated_token)
+            await cache.aset(keys[1], user, USER_CACHE_TIMEOUT)
+        return user
+
+    def get_user_id(self, validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+    def has_claims(self, validated_token):
+        # Для CHECK_REVOKE_TOKEN нужен хеш пароля — его в claims нет
+        return not api_settings.CHECK_REVOKE_TOKEN and all(claim in validated_token for claim in USER_CLAIMS)
+
+    def cache_keys(self, validated_token, user_id):
+        if self.has_claims(validated_token):
+            return [revoked_cache_key(user_id)]
+        return [revoked_cache_key(user_id), user_cache_key(user_id)]
+
+    def user_from_claims(self, validated_token, user_id):
+        if api_settings.CHECK_USER_IS_ACTIVE and not validated_token["is_active"]:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        # simplejwt пишет id в токен строкой — приводим к типу поля, иначе user != obj.owner
+        id_field = self.user_model._meta.get_field(api_settings.USER_ID_FIELD)
+        loaded = {
+            id_field.attname: id_field.to_python(user_id),
+            "is_staff": validated_token["is_staff"],
+            "is_active": validated_token["is_active"],
+        }
+        fields = self.user_model._meta.concrete_fields
+        user = self.user_model.from_db(
+            router.db_for_read(self.user_model),
+            list(loaded),
+            [loaded.get(field.attname, DEFERRED) for field in fields],
+        )
+        user._is_moderator = validated_token["is_moderator"]
+        return user
+
+
+class AsyncJWTScheme(SimpleJWTScheme):
+    """Схема Bearer JWT в OpenAPI для AsyncJWTAuthentication"""
+    target_class = "users.authentication.AsyncJWTAuthentication"
+
+
+class ClaimsJWTScheme(SimpleJWTScheme):
+    """Схема Bearer JWT в OpenAPI для ClaimsJWTAuthentication"""
+    target_class = "users.authentication.ClaimsJWTAuthentication"
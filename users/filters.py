@@ -0,0 +1,19 @@
+import django_filters
+
+from users.models import Payment
+
+
+class PaymentFilter(django_filters.FilterSet):
+    """
+    Фильтры списка платежей.
+
+    Диапазоны: `?payment_date_after=&payment_date_before=` и `?amount_min=&amount_max=`.
+    Фильтры по пользователю, курсу и уроку вместе с диапазоном дат идут по
+    составным индексам (..., payment_date, id) модели Payment.
+    """
+    payment_date = django_filters.IsoDateTimeFromToRangeFilter()
+    amount = django_filters.RangeFilter()
+
+    class Meta:
+        model = Payment
+        fields = ["paid_course", "paid_lesson", "payment_method", "payment_date", "amount"]
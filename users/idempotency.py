@@ -0,0 +1,100 @@
+"""
+Idempotency-Key для создания платежей.
+
+Первый запрос с ключом резервирует его (IdempotencyKey без ответа), выполняется
+и сохраняет ответ. Повтор с тем же ключом получает сохраненный ответ, а
+одновременный дубликат ждет, пока первый запрос закончится. Ответы 5xx не
+сохраняются: ключ освобождается, и клиент может повторить запрос. Тот же ключ
+передается в Stripe, поэтому и повтор после сбоя не создаст в Stripe дубликатов.
+
+Резерв — это аренда на LEASE_TIMEOUT секунд от created_at. Если процесс упал,
+не сохранив ответ, повтор после истечения аренды перехватывает ключ и
+выполняет запрос заново. Прежний владелец после перехвата уже не может ни
+сохранить ответ, ни освободить ключ: его created_at больше не совпадает.
+"""
+import asyncio
+import hashlib
+import json
+from datetime import timedelta
+
+from django.utils import timezone
+
+from users.models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 200
+# Сколько одновременный дубликат ждет ответа первого запроса
+WAIT_TIMEOUT = 10.0
+POLL_INTERVAL = 0.05
+# Срок аренды ключа: дольше худшего случая для запроса (три вызова Stripe с повторами)
+LEASE_TIMEOUT = 120
+
+
+def request_fingerprint(data):
+    """Отпечаток проверенных данных запроса"""
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def stripe_idempotency_key(record):
+    """Основа ключей для Stripe: ключи Stripe общие на весь аккаунт, поэтому с id пользователя"""
+    return f"payment-create:{record.user_id}:{record.key}"
+
+
+async def reserve_key(user, key, fingerprint):
+    """(IdempotencyKey, True), если ключ зарезервирован этим запросом"""
+    return await IdempotencyKey.objects.aget_or_create(
+        user=user, key=key, defaults={"request_fingerprint": fingerprint}
+    )
+
+
+async def reclaim_stale_key(record):
+    """
+    Перехватывает ключ, аренда которого истекла без ответа. True, если ключ
+    теперь принадлежит этому запросу; одновременные повторы перехватывают его
+    только один раз.
+    """
+    if record.response_status is not None:
+        return False
+    now = timezone.now()
+    reclaimed = await IdempotencyKey.objects.filter(
+        pk=record.pk, response_status__isnull=True, created_at__lt=now - timedelta(seconds=LEASE_TIMEOUT)
+    ).aupdate(created_at=now)
+    if reclaimed:
+        record.created_at = now
+    return bool(reclaimed)
+
+
+async def wait_for_response(record):
+    """
+    Ждет, пока запрос, зарезервировавший ключ, сохранит ответ. Возвращает
+    запись с ответом или None, если его нет за WAIT_TIMEOUT или ключ освобожден.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + WAIT_TIMEOUT
+    while record.response_status is None:
+        if loop.time() >= deadline:
+            return None
+        await asyncio.sleep(POLL_INTERVAL)
+        record = await IdempotencyKey.objects.filter(pk=record.pk).afirst()
+        if record is None:
+            return None
+    return record
+
+
+def _owned(record):
+    # Ключ, который не перехватили после истечения аренды
+    return IdempotencyKey.objects.filter(pk=record.pk, created_at=record.created_at)
+
+
+async def save_response(record, response):
+    """Сохраняет ответ; ответ 5xx вместо этого освобождает ключ"""
+    if response.status_code >= 500:
+        await release_key(record)
+        return
+    record.response_status = response.status_code
+    record.response_body = response.data
+    await _owned(record).aupdate(response_status=record.response_status, response_body=record.response_body)
+
+
+async def release_key(record):
+    await _owned(record).adelete()
@@ -0,0 +1,113 @@
+import asyncio
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.test import AsyncClient, Client, override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from lms.models import Course
+from users.models import Payment, StripePrice, User
+from users.stripe_gateway import get_stripe_gateway, reset_stripe_gateway
+from users.stripe_stub import StripeStub
+
+CHECKOUT_URL = "/api/payments/create/"
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test POST /api/payments/create/ against a local Stripe stub with added latency: "
+        "a pool of blocking workers (WSGI) vs one event loop (ASGI)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200, help="Checkouts per mode")
+        parser.add_argument("--latency", type=float, default=0.2, help="Stripe stub latency per call, seconds")
+        parser.add_argument("--workers", type=int, default=8, help="Blocking workers in WSGI mode")
+        parser.add_argument("--concurrency", type=int, default=200, help="In-flight requests in ASGI mode")
+        parser.add_argument("--pool-size", type=int, default=100, help="STRIPE_POOL_SIZE for the test")
+
+    def handle(self, *args, **options):
+        stub = StripeStub(latency=options["latency"])
+        stub.start()
+        settings_override = override_settings(
+            STRIPE_API_BASE=stub.url, STRIPE_SECRET_KEY="sk_test_stub", STRIPE_POOL_SIZE=options["pool_size"]
+        )
+        settings_override.enable()
+        reset_stripe_gateway()
+        suffix = uuid.uuid4().hex[:8]
+        user = User.objects.create_user(email=f"loadtest-{suffix}@example.com", password=uuid.uuid4().hex)
+        course = Course.objects.create(title=f"Load test {suffix}", owner=user)
+        self.body = {"paid_course": course.id, "amount": "10.00"}
+        self.headers = {"authorization": f"Bearer {AccessToken.for_user(user)}"}
+        try:
+            # Первая оплата создает продукт и цену; дальше каждая оплата — один вызов Stripe
+            self.ensure_created(Client().post(CHECKOUT_URL, self.body, content_type="application/json", headers=self.headers))
+            self.stdout.write(
+                f"{options['requests']} checkouts, Stripe latency {options['latency'] * 1000:.0f} ms, "
+                f"pool {options['pool_size']}"
+            )
+            self.report(f"WSGI, {options['workers']} workers", *self.run_wsgi(options["requests"], options["workers"]))
+            self.report(
+                f"ASGI, {options['concurrency']} in flight",
+                *asyncio.run(self.run_asgi(options["requests"], options["concurrency"])),
+            )
+            for operation, metrics in get_stripe_gateway().metrics.snapshot().items():
+                self.stdout.write(f"  stripe {operation}: {metrics}")
+        finally:
+            Payment.objects.filter(user=user).delete()
+            StripePrice.objects.filter(paid_course=course).delete()
+            course.delete()
+            user.delete()
+            settings_override.disable()
+            reset_stripe_gateway()
+            stub.stop()
+
+    def ensure_created(self, response):
+        if response.status_code != 201:
+            raise RuntimeError(f"Checkout failed: {response.status_code} {response.content[:200]!r}")
+
+    def run_wsgi(self, total, workers):
+        # Каждый поток — воркер WSGI: держит запрос, пока ждет Stripe
+        local = threading.local()
+
+        def one(_):
+            if not hasattr(local, "client"):
+                local.client = Client()
+            started = time.perf_counter()
+            self.ensure_created(local.client.post(CHECKOUT_URL, self.body, content_type="application/json", headers=self.headers))
+            close_old_connections()
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            latencies = list(executor.map(one, range(total)))
+        return latencies, time.perf_counter() - started
+
+    async def run_asgi(self, total, concurrency):
+        client = AsyncClient()
+        limit = asyncio.Semaphore(concurrency)
+
+        async def one():
+            async with limit:
+                started = time.perf_counter()
+                self.ensure_created(
+                    await client.post(CHECKOUT_URL, self.body, content_type="application/json", headers=self.headers)
+                )
+                return time.perf_counter() - started
+
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*(one() for _ in range(total)))
+        return latencies, time.perf_counter() - started
+
+    def report(self, name, latencies, elapsed):
+        ordered = sorted(latencies)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        self.stdout.write(
+            f"{name}: {len(latencies) / elapsed:,.1f} req/s, "
+            f"p50 {statistics.median(ordered) * 1000:.0f} ms, p95 {p95 * 1000:.0f} ms, total {elapsed:.2f} s"
+        )
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from users.stripe_stub import StripeStub
+
+
+class Command(BaseCommand):
+    help = "Run a local Stripe API stub (point STRIPE_API_BASE at it)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=12111)
+        parser.add_argument("--latency", type=float, default=0.0, help="Delay per request, seconds")
+        parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 500")
+
+    def handle(self, *args, **options):
+        stub = StripeStub(options["host"], options["port"], options["latency"], options["error_rate"])
+        self.stdout.write(f"Stripe stub listening on {stub.url} (STRIPE_API_BASE={stub.url})")
+        try:
+            stub.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stub.server.server_close()
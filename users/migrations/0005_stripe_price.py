@@ -0,0 +1,30 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lms', '0001_initial'),
+        ('users', '0004_payment_history_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripePrice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('currency', models.CharField(max_length=3)),
+                ('stripe_product_id', models.CharField(max_length=255)),
+                ('stripe_price_id', models.CharField(max_length=255)),
+                ('content_hash', models.CharField(max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('paid_course', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='stripe_prices', to='lms.course')),
+                ('paid_lesson', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='stripe_prices', to='lms.lesson')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(condition=models.Q(('paid_course__isnull', False)), fields=('paid_course', 'amount', 'currency'), name='users_stripeprice_course_uniq'), models.UniqueConstraint(condition=models.Q(('paid_lesson__isnull', False)), fields=('paid_lesson', 'amount', 'currency'), name='users_stripeprice_lesson_uniq'), models.CheckConstraint(condition=models.Q(('paid_course__isnull', True), ('paid_lesson__isnull', True), _connector='XOR'), name='users_stripeprice_one_target')],
+            },
+        ),
+    ]
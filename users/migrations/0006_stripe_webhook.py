@@ -0,0 +1,32 @@
+from django.db import migrations, models
+
+
+def blank_session_ids_to_null(apps, schema_editor):
+    # Пустые строки нарушили бы уникальность, NULL — нет
+    Payment = apps.get_model("users", "Payment")
+    Payment.objects.filter(stripe_session_id="").update(stripe_session_id=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_stripe_price'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripeEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=255, unique=True)),
+                ('type', models.CharField(max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+        migrations.RunPython(blank_session_ids_to_null, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='payment',
+            name='stripe_session_id',
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_stripe_webhook'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(condition=models.Q(('payment_status', 'pending'), ('stripe_session_id__isnull', False)), fields=['payment_date', 'id'], name='users_payment_pending_idx'),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.contrib.auth.models import AbstractUser, BaseUserManager
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 
 
@@ -41,6 +42,17 @@ class User(AbstractUser):
 
     objects = UserManager()
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # users.tasks.deactivate_inactive_users: WHERE is_active AND last_login < ? AND id > ?
+            # ORDER BY id — только активные, last_login проверяется по самому индексу
+            models.Index(
+                fields=["id", "last_login"],
+                condition=models.Q(is_active=True),
+                name="users_user_active_login_idx",
+            ),
+        ]
+
     def __str__(self):
         return self.email
 
@@ -56,13 +68,24 @@ class Payment(models.Model):
         PAID = "paid", "Оплачено"
         CANCELLED = "cancelled", "Отменено"
 
-    user = models.ForeignKey("users.User", related_name="payments", on_delete=models.CASCADE)
+    # Отдельные индексы внешних ключей не нужны: их покрывают составные индексы из Meta
+    user = models.ForeignKey("users.User", related_name="payments", on_delete=models.CASCADE, db_index=False)
     payment_date = models.DateTimeField(auto_now_add=True)
     paid_course = models.ForeignKey(
-        "lms.Course", related_name="course_payments", on_delete=models.SET_NULL, null=True, blank=True
+        "lms.Course",
+        related_name="course_payments",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        db_index=False,
     )
     paid_lesson = models.ForeignKey(
-        "lms.Lesson", related_name="lesson_payments", on_delete=models.SET_NULL, null=True, blank=True
+        "lms.Lesson",
+        related_name="lesson_payments",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        db_index=False,
     )
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     payment_method = models.CharField(max_length=20, choices=PaymentMethod.choices, default=PaymentMethod.CASH)
@@ -72,9 +95,117 @@ class Payment(models.Model):
     # Stripe fields
     stripe_product_id = models.CharField(max_length=255, blank=True, null=True)
     stripe_price_id = models.CharField(max_length=255, blank=True, null=True)
-    stripe_session_id = models.CharField(max_length=255, blank=True, null=True)
+    # Уникальный индекс: по нему вебхук Stripe находит платеж своей сессии
+    stripe_session_id = models.CharField(max_length=255, blank=True, null=True, unique=True)
     payment_url = models.URLField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # Keyset-пагинация истории: WHERE <фильтр> AND (payment_date, id) < (?, ?)
+            # ORDER BY payment_date DESC, id DESC — индекс читается в обратном порядке
+            models.Index(fields=["user", "payment_date", "id"], name="users_payment_user_date_idx"),
+            models.Index(fields=["paid_course", "payment_date", "id"], name="users_payment_course_date_idx"),
+            models.Index(fields=["paid_lesson", "payment_date", "id"], name="users_payment_lesson_date_idx"),
+            # Список модератора без фильтров
+            models.Index(fields=["payment_date", "id"], name="users_payment_date_idx"),
+            # Сверка ожидающих платежей со Stripe (users.reconciliation): только строки
+            # в статусе pending, поэтому индекс остается маленьким
+            models.Index(
+                fields=["payment_date", "id"],
+                condition=models.Q(payment_status="pending", stripe_session_id__isnull=False),
+                name="users_payment_pending_idx",
+            ),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Запоминаем статус, чтобы сводная статистика учла переход в PAID и обратно
+        instance._loaded_payment_status = instance.__dict__.get("payment_status")
+        return instance
+
     def __str__(self):
         target = self.paid_course or self.paid_lesson
         return f"{self.user} -> {target or 'no target'} [{self.amount}]"
+
+
+class StripePrice(models.Model):
+    """
+    Продукт и цена в Stripe для курса или урока по конкретной сумме и валюте.
+
+    Позволяет не создавать продукт и цену при каждой оплате. content_hash —
+    отпечаток названия и описания, с которыми создан продукт: если они
+    изменились, продукт в Stripe обновляется (см. users.services.get_stripe_price).
+    """
+    paid_course = models.ForeignKey(
+        "lms.Course", related_name="stripe_prices", on_delete=models.CASCADE, null=True, blank=True
+    )
+    paid_lesson = models.ForeignKey(
+        "lms.Lesson", related_name="stripe_prices", on_delete=models.CASCADE, null=True, blank=True
+    )
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    currency = models.CharField(max_length=3)
+    stripe_product_id = models.CharField(max_length=255)
+    stripe_price_id = models.CharField(max_length=255)
+    content_hash = models.CharField(max_length=64)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["paid_course", "amount", "currency"],
+                condition=models.Q(paid_course__isnull=False),
+                name="users_stripeprice_course_uniq",
+            ),
+            models.UniqueConstraint(
+                fields=["paid_lesson", "amount", "currency"],
+                condition=models.Q(paid_lesson__isnull=False),
+                name="users_stripeprice_lesson_uniq",
+            ),
+            models.CheckConstraint(
+                condition=models.Q(paid_course__isnull=True) ^ models.Q(paid_lesson__isnull=True),
+                name="users_stripeprice_one_target",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.paid_course or self.paid_lesson} {self.amount} {self.currency} -> {self.stripe_price_id}"
+
+
+class StripeEvent(models.Model):
+    """
+    Обработанное событие вебхука Stripe.
+
+    Stripe доставляет событие хотя бы один раз и повторяет доставку, пока не
+    получит ответ 2xx: по event_id повторная доставка узнается и пропускается.
+    """
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.event_id} ({self.type})"
+
+
+class IdempotencyKey(models.Model):
+    """
+    Ключ Idempotency-Key запроса на создание платежа и сохраненный ответ.
+
+    Пока response_status пуст, запрос с этим ключом выполняется. Повтор с тем
+    же ключом получает сохраненный ответ, а не создает второй платеж.
+    """
+    user = models.ForeignKey("users.User", related_name="idempotency_keys", on_delete=models.CASCADE)
+    key = models.CharField(max_length=200)
+    # Отпечаток тела запроса: ключ нельзя использовать для другого запроса
+    request_fingerprint = models.CharField(max_length=64)
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "key"], name="users_idempotencykey_user_key_uniq"),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}:{self.key}"
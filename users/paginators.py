@@ -0,0 +1,9 @@
+from lms.paginators import KeysetPagination
+
+
+class PaymentKeysetPagination(KeysetPagination):
+    """Keyset-пагинатор истории платежей: по умолчанию от новых к старым"""
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    ordering = "-payment_date"
@@ -1,101 +1,161 @@
 """
 Views для работы с платежами через Stripe
+
+Создание платежа и проверка статуса — асинхронные (AsyncAPIView): под ASGI
+ожидание Stripe и БД не занимает воркер, и сотни оплат в процессе
+обслуживаются одним циклом событий. Под WSGI они тоже работают.
 """
-from django.shortcuts import get_object_or_404
-from rest_framework import generics, status
-from rest_framework.permissions import IsAuthenticated
+from django.conf import settings
+from django.http import Http404
+from rest_framework import status
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from drf_spectacular.utils import extend_schema, OpenApiParameter
 
 from lms.models import Course, Lesson
 from users.models import Payment
 from users.serializers import PaymentCreateSerializer, PaymentSerializer
-from users.services import (
-    create_stripe_product,
-    create_stripe_price,
-    create_stripe_session,
-    retrieve_stripe_session,
+from users.async_views import AsyncAPIView
+from users.idempotency import (
+    IDEMPOTENCY_HEADER,
+    MAX_KEY_LENGTH,
+    reclaim_stale_key,
+    release_key,
+    request_fingerprint,
+    reserve_key,
+    save_response,
+    stripe_idempotency_key,
+    wait_for_response,
 )
+from users.services import acreate_stripe_session, afind_stripe_price, aget_stripe_price
+from users.stripe_gateway import StripeGatewayError, StripeUnavailable
+from users.webhooks import WebhookSignatureError, construct_event, handle_stripe_event
+
+
+def stripe_error_response(error, prefix=""):
+    """502, если Stripe отклонил запрос, и 503, если он недоступен"""
+    code = status.HTTP_503_SERVICE_UNAVAILABLE if isinstance(error, StripeUnavailable) else status.HTTP_502_BAD_GATEWAY
+    return Response({"error": f"{prefix}{error}"}, status=code)
 
 
-class PaymentCreateView(generics.CreateAPIView):
+class PaymentCreateView(AsyncAPIView):
     """
     Создание платежа через Stripe
     """
     permission_classes = [IsAuthenticated]
-    serializer_class = PaymentCreateSerializer
 
     @extend_schema(
         summary="Создать платеж через Stripe",
         description="Создает платеж для курса или урока через Stripe. "
-                    "Возвращает ссылку на оплату.",
+                    "Возвращает ссылку на оплату. С заголовком Idempotency-Key "
+                    "повтор запроса возвращает первый ответ и не создает второй платеж.",
         request=PaymentCreateSerializer,
+        parameters=[
+            OpenApiParameter(
+                IDEMPOTENCY_HEADER,
+                str,
+                OpenApiParameter.HEADER,
+                description="Уникальный ключ попытки оплаты (до 200 символов), например UUID",
+            ),
+        ],
         responses={201: PaymentSerializer},
     )
-    def post(self, request, *args, **kwargs):
-        serializer = self.get_serializer(data=request.data)
+    async def post(self, request, *args, **kwargs):
+        serializer = PaymentCreateSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        
-        user = request.user
-        paid_course_id = serializer.validated_data.get("paid_course")
-        paid_lesson_id = serializer.validated_data.get("paid_lesson")
-        amount = serializer.validated_data.get("amount")
-        
-        # Проверяем, что указан либо курс, либо урок
-        if not paid_course_id and not paid_lesson_id:
+
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return await self.create_payment(request, serializer.validated_data)
+        if len(key) > MAX_KEY_LENGTH:
             return Response(
-                {"error": "Необходимо указать либо курс, либо урок"},
+                {"error": f"{IDEMPOTENCY_HEADER} длиннее {MAX_KEY_LENGTH} символов"},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        
-        if paid_course_id and paid_lesson_id:
+
+        fingerprint = request_fingerprint(serializer.validated_data)
+        record, reserved = await reserve_key(request.user, key, fingerprint)
+        # Запрос, зарезервировавший ключ, мог упасть, не сохранив ответ: после аренды ключ перехватывается
+        reclaimed = not reserved and record.request_fingerprint == fingerprint and await reclaim_stale_key(record)
+        if not reserved and not reclaimed:
+            return await self.replay(record, fingerprint)
+        try:
+            response = await self.create_payment(
+                request, serializer.validated_data, idempotency_key=stripe_idempotency_key(record), reclaimed=reclaimed
+            )
+        except BaseException:
+            await release_key(record)
+            raise
+        await save_response(record, response)
+        return response
+
+    async def replay(self, record, fingerprint):
+        """Ответ на повтор запроса с уже использованным ключом"""
+        if record.request_fingerprint != fingerprint:
             return Response(
-                {"error": "Укажите либо курс, либо урок, но не оба одновременно"},
-                status=status.HTTP_400_BAD_REQUEST
+                {"error": f"{IDEMPOTENCY_HEADER} уже использован для другого запроса"},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY
             )
-        
-        # Получаем объект курса или урока
+        # Одновременный дубликат: ждем ответа первого запроса, а не обращаемся к Stripe
+        record = await wait_for_response(record)
+        if record is None:
+            return Response(
+                {"error": "Запрос с этим ключом еще выполняется, повторите позже"},
+                status=status.HTTP_409_CONFLICT,
+                headers={"Retry-After": "1"}
+            )
+        return Response(record.response_body, status=record.response_status, headers={"Idempotent-Replayed": "true"})
+
+    async def create_payment(self, request, data, idempotency_key=None, reclaimed=False):
+        user = request.user
+        paid_course_id = data.get("paid_course")
+        paid_lesson_id = data.get("paid_lesson")
+        amount = data.get("amount")
+        currency = settings.STRIPE_CURRENCY
+
+        # Курс или урок вместе с сохраненной ценой Stripe — одним запросом
         if paid_course_id:
-            course_or_lesson = get_object_or_404(Course, id=paid_course_id)
-            name = course_or_lesson.title
-            description = course_or_lesson.description or ""
+            course_or_lesson, stripe_price = await afind_stripe_price(Course, paid_course_id, amount, currency)
         else:
-            course_or_lesson = get_object_or_404(Lesson, id=paid_lesson_id)
-            name = course_or_lesson.title
-            description = course_or_lesson.description or ""
-        
+            course_or_lesson, stripe_price = await afind_stripe_price(Lesson, paid_lesson_id, amount, currency)
+        if course_or_lesson is None:
+            raise Http404
+
         try:
-            # Создаем продукт в Stripe
-            product = create_stripe_product(name=name, description=description)
-            
-            # Создаем цену в Stripe
-            price = create_stripe_price(
-                product_id=product.id,
-                amount=float(amount)
+            # Продукт и цена создаются в Stripe только при первой продаже по этой сумме
+            stripe_price = await aget_stripe_price(
+                course_or_lesson, amount, currency, mapping=stripe_price, idempotency_key=idempotency_key
             )
-            
+
             # Формируем URL для перенаправления
             base_url = request.build_absolute_uri("/")
             success_url = f"{base_url}api/payments/success/"
             cancel_url = f"{base_url}api/payments/cancel/"
             
             # Создаем сессию оплаты в Stripe
-            session = create_stripe_session(
-                price_id=price.id,
+            session = await acreate_stripe_session(
+                price_id=stripe_price.stripe_price_id,
                 success_url=success_url,
-                cancel_url=cancel_url
+                cancel_url=cancel_url,
+                idempotency_key=f"{idempotency_key}:session" if idempotency_key else None,
             )
             
+            # Перехваченный ключ: упавший запрос мог успеть сохранить платеж по этой же сессии
+            payment = None
+            if reclaimed:
+                payment = await Payment.objects.filter(user=user, stripe_session_id=session.id).afirst()
+
             # Создаем платеж в нашей системе
-            payment = Payment.objects.create(
+            payment = payment or await Payment.objects.acreate(
                 user=user,
                 paid_course=course_or_lesson if isinstance(course_or_lesson, Course) else None,
                 paid_lesson=course_or_lesson if isinstance(course_or_lesson, Lesson) else None,
                 amount=amount,
                 payment_method=Payment.PaymentMethod.STRIPE,
                 payment_status=Payment.PaymentStatus.PENDING,
-                stripe_product_id=product.id,
-                stripe_price_id=price.id,
+                stripe_product_id=stripe_price.stripe_product_id,
+                stripe_price_id=stripe_price.stripe_price_id,
                 stripe_session_id=session.id,
                 payment_url=session.url,
             )
@@ -110,65 +170,60 @@ class PaymentCreateView(generics.CreateAPIView):
                 status=status.HTTP_201_CREATED
             )
             
-        except Exception as e:
-            return Response(
-                {"error": str(e)},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+        except StripeGatewayError as e:
+            return stripe_error_response(e)
 
 
-class PaymentStatusView(generics.RetrieveAPIView):
+class PaymentStatusView(AsyncAPIView):
     """
-    Проверка статуса платежа через Stripe
+    Статус платежа из БД. Его обновляют вебхуки Stripe (StripeWebhookView),
+    поэтому запрос статуса не обращается к Stripe.
     """
     permission_classes = [IsAuthenticated]
-    serializer_class = PaymentSerializer
-    queryset = Payment.objects.all()
 
     @extend_schema(
         summary="Проверить статус платежа",
-        description="Проверяет статус платежа через Stripe API",
+        description="Возвращает платеж со статусом, который обновляют вебхуки Stripe",
         responses={200: PaymentSerializer},
     )
-    def get(self, request, *args, **kwargs):
-        payment = self.get_object()
-        
+    async def get(self, request, pk, *args, **kwargs):
+        payment = await Payment.objects.filter(pk=pk).afirst()
+        if payment is None:
+            raise Http404
+
         # Проверяем, что платеж принадлежит текущему пользователю
-        if payment.user != request.user:
+        if payment.user_id != request.user.pk:
             return Response(
                 {"error": "Доступ запрещен"},
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        # Если есть session_id, проверяем статус в Stripe
-        if payment.stripe_session_id:
-            try:
-                session = retrieve_stripe_session(payment.stripe_session_id)
-                
-                # Обновляем статус платежа на основе статуса сессии
-                if session.payment_status == "paid":
-                    payment.payment_status = Payment.PaymentStatus.PAID
-                elif session.payment_status == "unpaid":
-                    payment.payment_status = Payment.PaymentStatus.PENDING
-                else:
-                    payment.payment_status = Payment.PaymentStatus.CANCELLED
-                
-                payment.save()
-                
-            except Exception as e:
-                return Response(
-                    {"error": f"Ошибка при проверке статуса: {str(e)}"},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                )
-        
-        serializer = self.get_serializer(payment)
+        serializer = PaymentSerializer(payment)
         return Response(serializer.data)
 
 
+class StripeWebhookView(APIView):
+    """
+    Вебхук Stripe: события сессий оплаты обновляют статус платежей.
+    Запрос подписан Stripe (заголовок Stripe-Signature, секрет STRIPE_WEBHOOK_SECRET).
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
 
+    @extend_schema(exclude=True)
+    def post(self, request, *args, **kwargs):
+        if not settings.STRIPE_WEBHOOK_SECRET:
+            return Response(
+                {"error": "Вебхук Stripe не настроен"},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        try:
+            # Подпись считается по исходному телу запроса, поэтому request.data не используется
+            event = construct_event(
+                request.body, request.headers.get("Stripe-Signature", ""), settings.STRIPE_WEBHOOK_SECRET
+            )
+        except WebhookSignatureError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-
-
-
-
-
+        processed = handle_stripe_event(event)
+        return Response({"received": True, "duplicate": not processed})
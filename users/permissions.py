@@ -1,32 +1,55 @@
+from django.core.cache import cache
 from rest_framework.permissions import BasePermission
 
 
 MODERATOR_GROUP = "moderators"
+MODERATOR_CACHE_TIMEOUT = 60 * 60
 
 
-class IsModerator(BasePermission):
-    """Checks if user is in moderators group."""
+def moderator_cache_key(user_id):
+    return f"users:is_moderator:{user_id}"
 
-    def has_permission(self, request, view):
-        return bool(
-            request.user
-            and request.user.is_authenticated
-            and request.user.groups.filter(name=MODERATOR_GROUP).exists()
-        )
 
+def is_moderator(user) -> bool:
+    """
+    Проверяет, состоит ли пользователь в группе модераторов.
 
-class IsSelfOrAdmin(BasePermission):
-    """Allows access to self or staff."""
-
-    def has_object_permission(self, request, view, obj):
-        return bool(request.user and request.user.is_authenticated and (request.user.is_staff or obj == request.user))
-
+    Результат запоминается на объекте пользователя (один запрос к БД
+    на HTTP-запрос) и в общем кеше между запросами. Кеш сбрасывается
+    сигналами при изменении групп пользователя (users.signals).
+    """
+    if not user or not user.is_authenticated:
+        return False
+    cached = getattr(user, "_is_moderator", None)
+    if cached is not None:
+        return cached
+    key = moderator_cache_key(user.pk)
+    value = cache.get(key)
+    if value is None:
+        value = user.groups.filter(name=MODERATOR_GROUP).exists()
+        cache.set(key, value, MODERATOR_CACHE_TIMEOUT)
+    user._is_moderator = value
+    return value
 
 
+def invalidate_moderator_cache(user_ids):
+    """Сбрасывает закешированную роль модератора для указанных пользователей."""
+    cache.delete_many([moderator_cache_key(user_id) for user_id in user_ids])
 
 
+class IsModerator(BasePermission):
+    """Checks if user is in moderators group."""
 
+    def has_permission(self, request, view):
+        return is_moderator(request.user)
 
+    def has_object_permission(self, request, view, obj):
+        # Роль не зависит от объекта; без этого ~IsModerator запрещал бы всем
+        return self.has_permission(request, view)
 
 
+class IsSelfOrAdmin(BasePermission):
+    """Allows access to self or staff."""
 
+    def has_object_permission(self, request, view, obj):
+        return bool(request.user and request.user.is_authenticated and (request.user.is_staff or obj == request.user))
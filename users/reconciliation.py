@@ -0,0 +1,185 @@
+"""
+Сверка ожидающих оплаты платежей со Stripe — на случай потерянных вебхуков.
+
+Ожидающие платежи старше min_age читаются пачками в порядке создания по
+частичному индексу users_payment_pending_idx. Сессии пачки запрашиваются у
+Stripe параллельно, не больше concurrency одновременно. Открытые сессии
+старше abandon_after завершаются (expire), чтобы по ним уже нельзя было
+заплатить. Платежи, сессий которых в Stripe нет (удалены или не
+существовали), отменяются, если они старше missing_after — срока жизни
+сессии: иначе они оставались бы ожидающими и каждый запуск тратил бы на них
+лимит max_payments раньше, чем на более новые. Если же сессий не нашлось
+для всей пачки или больше max_missing_share ее платежей, скорее всего
+задача обращается не к тому аккаунту Stripe (например, с тестовым ключом),
+и сверка прерывается, ничего не отменяя по ненайденным сессиям.
+Новые статусы записываются одним UPDATE на статус для всей пачки.
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from lms.analytics import bump_course_stats, payment_course_id
+from users.models import Payment
+from users.stripe_gateway import StripeRequestError, StripeUnavailable, get_stripe_gateway
+from users.webhooks import session_payment_status
+
+logger = logging.getLogger(__name__)
+
+PENDING = Payment.PaymentStatus.PENDING
+
+# Сессия Checkout живет в Stripe не дольше суток
+CHECKOUT_SESSION_LIFETIME = timedelta(hours=24)
+
+
+@dataclass
+class ReconciliationReport:
+    processed: int = 0
+    paid: int = 0
+    cancelled: int = 0
+    expired: int = 0
+    missing: int = 0
+    still_pending: int = 0
+    errors: int = 0
+    stopped_early: bool = False
+    duration_seconds: float = 0.0
+
+
+def pending_payments(created_before):
+    """Ожидающие платежи со сессией Stripe, созданные раньше created_before; идут по индексу"""
+    return (
+        Payment.objects.filter(
+            payment_status=PENDING, stripe_session_id__isnull=False, payment_date__lt=created_before
+        )
+        .select_related("paid_lesson")
+        .order_by("payment_date", "id")
+    )
+
+
+def reconcile_pending_payments(
+    min_age=timedelta(minutes=15),
+    abandon_after=timedelta(hours=2),
+    batch_size=100,
+    concurrency=8,
+    max_payments=2000,
+    missing_after=CHECKOUT_SESSION_LIFETIME,
+    max_missing_share=0.5,
+):
+    """
+    Сверяет до max_payments ожидающих платежей старше min_age.
+    Если Stripe недоступен или не находит сессии массово, прерывается до
+    следующего запуска. Возвращает ReconciliationReport.
+    """
+    started = time.perf_counter()
+    now = timezone.now()
+    report = ReconciliationReport()
+    queryset = pending_payments(now - min_age)
+    abandon_before = now - abandon_after
+    missing_before = now - missing_after
+    gateway = get_stripe_gateway()
+
+    last = None
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while report.processed < max_payments:
+            page = queryset
+            if last is not None:
+                page = page.filter(Q(payment_date__gt=last[0]) | Q(payment_date=last[0], id__gt=last[1]))
+            batch = list(page[: min(batch_size, max_payments - report.processed)])
+            if not batch:
+                break
+            last = (batch[-1].payment_date, batch[-1].id)
+
+            results = list(executor.map(lambda payment: _check_session(gateway, payment, abandon_before), batch))
+            report.processed += len(batch)
+            statuses = {}
+            missing = []
+            for payment, (payment_status, expired, error) in zip(batch, results):
+                if isinstance(error, StripeRequestError) and error.is_not_found:
+                    missing.append(payment)
+                elif error is not None:
+                    report.errors += 1
+                    report.stopped_early = report.stopped_early or isinstance(error, StripeUnavailable)
+                elif payment_status == PENDING:
+                    report.still_pending += 1
+                else:
+                    report.expired += expired
+                    statuses.setdefault(payment_status, []).append(payment)
+            report.missing += len(missing)
+            if _too_many_missing(len(missing), len(batch), max_missing_share):
+                logger.error(
+                    "Stripe did not find sessions of %s of %s payments in a batch, stopping without cancelling them",
+                    len(missing), len(batch),
+                )
+                report.stopped_early = True
+            else:
+                for payment in missing:
+                    logger.warning("Stripe session %s of payment %s not found", payment.stripe_session_id, payment.pk)
+                    if payment.payment_date < missing_before:
+                        statuses.setdefault(Payment.PaymentStatus.CANCELLED, []).append(payment)
+            updated = _apply_statuses(statuses)
+            report.paid += updated.get(Payment.PaymentStatus.PAID, 0)
+            report.cancelled += updated.get(Payment.PaymentStatus.CANCELLED, 0)
+            if report.stopped_early:
+                break
+
+    report.duration_seconds = round(time.perf_counter() - started, 3)
+    logger.info("Stripe reconciliation: %s", asdict(report))
+    return report
+
+
+def _too_many_missing(missing, checked, max_missing_share):
+    # Одна пропавшая сессия — обычное дело, массовые 404 — признак чужого ключа
+    return missing > 1 and (missing == checked or missing > checked * max_missing_share)
+
+
+def _check_session(gateway, payment, abandon_before):
+    """(статус платежа, завершена ли сессия сверкой, ошибка Stripe)"""
+    try:
+        session = gateway.retrieve_checkout_session(payment.stripe_session_id)
+        payment_status = session_payment_status(session)
+        if payment_status == PENDING and session.get("status") == "open" and payment.payment_date < abandon_before:
+            session = gateway.expire_checkout_session(payment.stripe_session_id)
+            return session_payment_status(session), True, None
+        return payment_status, False, None
+    except (StripeRequestError, StripeUnavailable) as e:
+        return None, False, e
+
+
+def _apply_statuses(statuses):
+    """
+    Записывает статусы одним UPDATE на статус. Платежи, статус которых за
+    время сверки изменил вебхук, пропускаются. Возвращает {статус: число}.
+    """
+    updated = {}
+    deltas = {}
+    with transaction.atomic():
+        for payment_status, payments in statuses.items():
+            by_pk = {payment.pk: payment for payment in payments}
+            pks = list(
+                Payment.objects.select_for_update()
+                .filter(pk__in=by_pk, payment_status=PENDING)
+                .values_list("pk", flat=True)
+            )
+            if not pks:
+                continue
+            updated[payment_status] = Payment.objects.filter(pk__in=pks).update(payment_status=payment_status)
+            if payment_status != Payment.PaymentStatus.PAID:
+                continue
+            # update() минует сигнал Payment — учитываем оплаты в статистике сами
+            for pk in pks:
+                payment = by_pk[pk]
+                course_id = payment_course_id(payment)
+                if course_id is None:
+                    continue
+                values = deltas.setdefault(
+                    (course_id, timezone.localdate(payment.payment_date)), {"revenue": 0, "payments": 0}
+                )
+                values["revenue"] += payment.amount
+                values["payments"] += 1
+        bump_course_stats(deltas)
+    return updated
@@ -1,6 +1,5 @@
 from rest_framework import serializers
 
-from lms.models import Course, Lesson
 from users.models import Payment, User
 
 
@@ -61,12 +60,9 @@ class PaymentSerializer(serializers.ModelSerializer):
 
 class PaymentCreateSerializer(serializers.Serializer):
     """Сериализатор для создания платежа"""
-    paid_course = serializers.PrimaryKeyRelatedField(
-        queryset=Course.objects.all(), required=False, allow_null=True
-    )
-    paid_lesson = serializers.PrimaryKeyRelatedField(
-        queryset=Lesson.objects.all(), required=False, allow_null=True
-    )
+    # Только id: курс или урок загружается во view вместе с сохраненной ценой Stripe
+    paid_course = serializers.IntegerField(required=False, allow_null=True)
+    paid_lesson = serializers.IntegerField(required=False, allow_null=True)
     amount = serializers.DecimalField(max_digits=10, decimal_places=2)
 
     def validate(self, attrs):
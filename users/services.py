@@ -1,36 +1,37 @@
 """
 Сервисные функции для работы со Stripe API
 """
-import stripe
-from django.conf import settings
+import hashlib
 
-# Инициализация Stripe API ключа
-if settings.STRIPE_SECRET_KEY:
-    stripe.api_key = settings.STRIPE_SECRET_KEY
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, transaction
 
+from lms.models import Course
+from users.models import StripePrice
+from users.stripe_gateway import get_stripe_gateway
 
-def create_stripe_product(name: str, description: str = "") -> dict:
+
+def create_stripe_product(name: str, description: str = "", idempotency_key: str | None = None) -> dict:
     """
     Создает продукт в Stripe
     
     Args:
         name: Название продукта
         description: Описание продукта
+        idempotency_key: Ключ идемпотентности Stripe (по умолчанию — новый на каждый вызов)
         
     Returns:
         dict: Данные созданного продукта
+
+    Raises:
+        StripeGatewayError: Stripe отклонил запрос или недоступен
     """
-    try:
-        product = stripe.Product.create(
-            name=name,
-            description=description,
-        )
-        return product
-    except stripe.error.StripeError as e:
-        raise Exception(f"Ошибка при создании продукта в Stripe: {str(e)}")
+    return get_stripe_gateway().create_product(name=name, description=description, idempotency_key=idempotency_key)
 
 
-def create_stripe_price(product_id: str, amount: float, currency: str = "usd") -> dict:
+def create_stripe_price(
+    product_id: str, amount: float, currency: str = "usd", idempotency_key: str | None = None
+) -> dict:
     """
     Создает цену в Stripe
     
@@ -38,25 +39,21 @@ def create_stripe_price(product_id: str, amount: float, currency: str = "usd") -
         product_id: ID продукта в Stripe
         amount: Сумма в долларах (будет преобразована в центы)
         currency: Валюта (по умолчанию USD)
+        idempotency_key: Ключ идемпотентности Stripe
         
     Returns:
         dict: Данные созданной цены
     """
-    try:
-        # Преобразуем сумму в центы (копейки)
-        amount_cents = int(amount * 100)
-        
-        price = stripe.Price.create(
-            product=product_id,
-            unit_amount=amount_cents,
-            currency=currency,
-        )
-        return price
-    except stripe.error.StripeError as e:
-        raise Exception(f"Ошибка при создании цены в Stripe: {str(e)}")
+    # Преобразуем сумму в центы (копейки)
+    amount_cents = int(round(amount * 100))
+    return get_stripe_gateway().create_price(
+        product_id=product_id, unit_amount=amount_cents, currency=currency, idempotency_key=idempotency_key
+    )
 
 
-def create_stripe_session(price_id: str, success_url: str, cancel_url: str) -> dict:
+def create_stripe_session(
+    price_id: str, success_url: str, cancel_url: str, idempotency_key: str | None = None
+) -> dict:
     """
     Создает сессию оплаты в Stripe
     
@@ -64,26 +61,14 @@ def create_stripe_session(price_id: str, success_url: str, cancel_url: str) -> d
         price_id: ID цены в Stripe
         success_url: URL для перенаправления после успешной оплаты
         cancel_url: URL для перенаправления при отмене оплаты
+        idempotency_key: Ключ идемпотентности Stripe
         
     Returns:
         dict: Данные созданной сессии
     """
-    try:
-        session = stripe.checkout.Session.create(
-            payment_method_types=["card"],
-            line_items=[
-                {
-                    "price": price_id,
-                    "quantity": 1,
-                }
-            ],
-            mode="payment",
-            success_url=success_url,
-            cancel_url=cancel_url,
-        )
-        return session
-    except stripe.error.StripeError as e:
-        raise Exception(f"Ошибка при создании сессии в Stripe: {str(e)}")
+    return get_stripe_gateway().create_checkout_session(
+        price_id=price_id, success_url=success_url, cancel_url=cancel_url, idempotency_key=idempotency_key
+    )
 
 
 def retrieve_stripe_session(session_id: str) -> dict:
@@ -96,9 +81,137 @@ def retrieve_stripe_session(session_id: str) -> dict:
     Returns:
         dict: Данные сессии
     """
+    return get_stripe_gateway().retrieve_checkout_session(session_id)
+
+
+async def acreate_stripe_session(price_id: str, success_url: str, cancel_url: str, idempotency_key=None):
+    """Асинхронный create_stripe_session: запрос к Stripe не блокирует цикл событий"""
+    gateway = get_stripe_gateway()
+    return await gateway.run_async(
+        gateway.create_checkout_session,
+        price_id=price_id,
+        success_url=success_url,
+        cancel_url=cancel_url,
+        idempotency_key=idempotency_key,
+    )
+
+
+def stripe_content_hash(name: str, description: str) -> str:
+    """Отпечаток названия и описания, с которыми создан продукт в Stripe"""
+    return hashlib.sha256(f"{name}\0{description}".encode()).hexdigest()
+
+
+def find_stripe_price(model, pk, amount, currency):
+    """
+    Ищет сохраненную цену Stripe вместе с курсом или уроком одним запросом.
+
+    Возвращает (объект, StripePrice) или (объект, None), если цены еще нет;
+    объект равен None, если курса или урока с таким id нет.
+    """
+    target_field = "paid_course" if model is Course else "paid_lesson"
+    mapping = (
+        StripePrice.objects.select_related(target_field)
+        .filter(**{f"{target_field}_id": pk}, amount=amount, currency=currency)
+        .first()
+    )
+    if mapping is not None:
+        return getattr(mapping, target_field), mapping
+    return model.objects.filter(pk=pk).first(), None
+
+
+async def afind_stripe_price(model, pk, amount, currency):
+    """Асинхронный find_stripe_price"""
+    target_field = "paid_course" if model is Course else "paid_lesson"
+    mapping = await (
+        StripePrice.objects.select_related(target_field)
+        .filter(**{f"{target_field}_id": pk}, amount=amount, currency=currency)
+        .afirst()
+    )
+    if mapping is not None:
+        return getattr(mapping, target_field), mapping
+    return await model.objects.filter(pk=pk).afirst(), None
+
+
+def get_stripe_price(target, amount, currency, mapping=None, idempotency_key=None) -> StripePrice:
+    """
+    Возвращает продукт и цену Stripe для курса или урока, создавая их только
+    при первой продаже по этой сумме и валюте.
+
+    Если название или описание изменились после создания продукта, продукт
+    в Stripe обновляется (цена остается прежней). Если для объекта уже есть
+    продукт с другой суммой, создается только новая цена. С idempotency_key
+    повтор запроса после сбоя получит из Stripe те же продукт и цену.
+    """
+    name, description = target.title, target.description or ""
+    content_hash = stripe_content_hash(name, description)
+    if mapping is not None:
+        if mapping.content_hash != content_hash:
+            _refresh_stripe_product(mapping, name, description, content_hash)
+        return mapping
+
+    target_field = "paid_course" if isinstance(target, Course) else "paid_lesson"
+    existing = StripePrice.objects.filter(**{target_field: target}).first()
+    if existing is None:
+        product_id = create_stripe_product(
+            name=name, description=description, idempotency_key=_step_key(idempotency_key, "product")
+        ).id
+    else:
+        product_id = existing.stripe_product_id
+        if existing.content_hash != content_hash:
+            _refresh_stripe_product(existing, name, description, content_hash)
+    price = create_stripe_price(
+        product_id=product_id,
+        amount=float(amount),
+        currency=currency,
+        idempotency_key=_step_key(idempotency_key, "price"),
+    )
     try:
-        session = stripe.checkout.Session.retrieve(session_id)
-        return session
-    except stripe.error.StripeError as e:
-        raise Exception(f"Ошибка при получении сессии из Stripe: {str(e)}")
+        with transaction.atomic():
+            return StripePrice.objects.create(
+                **{target_field: target},
+                amount=amount,
+                currency=currency,
+                stripe_product_id=product_id,
+                stripe_price_id=price.id,
+                content_hash=content_hash,
+            )
+    except IntegrityError:
+        # Параллельная оплата успела сохранить свою цену — используем ее
+        return StripePrice.objects.get(**{target_field: target}, amount=amount, currency=currency)
+
+
+async def aget_stripe_price(target, amount, currency, mapping=None, idempotency_key=None) -> StripePrice:
+    """
+    Асинхронный get_stripe_price. Обычно цена уже сохранена и актуальна — тогда
+    ни БД, ни Stripe не нужны. Первая продажа и смена названия (редкий путь
+    с транзакцией) выполняются синхронной версией в потоке.
+    """
+    if mapping is not None and mapping.content_hash == stripe_content_hash(target.title, target.description or ""):
+        return mapping
+    return await sync_to_async(get_stripe_price)(target, amount, currency, mapping, idempotency_key)
+
+
+def _step_key(idempotency_key, step):
+    return f"{idempotency_key}:{step}" if idempotency_key else None
+
+
+def _refresh_stripe_product(mapping, name, description, content_hash):
+    update_stripe_product(mapping.stripe_product_id, name=name, description=description)
+    # Все цены продукта ссылаются на один продукт Stripe — отмечаем их разом
+    StripePrice.objects.filter(stripe_product_id=mapping.stripe_product_id).update(content_hash=content_hash)
+    mapping.content_hash = content_hash
 
+
+def update_stripe_product(product_id: str, name: str, description: str = "") -> dict:
+    """
+    Обновляет название и описание продукта в Stripe
+
+    Args:
+        product_id: ID продукта в Stripe
+        name: Название продукта
+        description: Описание продукта
+
+    Returns:
+        dict: Данные обновленного продукта
+    """
+    return get_stripe_gateway().update_product(product_id, name=name, description=description)
@@ -0,0 +1,61 @@
+from django.contrib.auth.models import Group
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from users.models import User
+from users.permissions import MODERATOR_GROUP, invalidate_moderator_cache
+from users.tokens import revoke_user_tokens
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def reset_moderator_cache_on_groups_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """Сбрасывает кеш роли модератора при изменении User.groups с любой стороны связи."""
+    # Роль модератора есть в claims токенов — выданные токены отзываются
+    if not reverse:
+        # user.groups.add/remove/clear(...)
+        if action in ("post_add", "post_remove", "post_clear"):
+            instance.__dict__.pop("_is_moderator", None)
+            invalidate_moderator_cache([instance.pk])
+            revoke_user_tokens([instance.pk])
+        return
+
+    # group.user_set.add/remove/clear(...)
+    if action in ("post_add", "post_remove"):
+        invalidate_moderator_cache(pk_set)
+        revoke_user_tokens(pk_set)
+    elif action == "pre_clear":
+        user_ids = list(instance.user_set.values_list("pk", flat=True))
+        invalidate_moderator_cache(user_ids)
+        revoke_user_tokens(user_ids)
+
+
+@receiver(pre_delete, sender=Group)
+def reset_moderator_cache_on_group_delete(sender, instance, **kwargs):
+    if instance.name == MODERATOR_GROUP:
+        user_ids = list(instance.user_set.values_list("pk", flat=True))
+        invalidate_moderator_cache(user_ids)
+        revoke_user_tokens(user_ids)
+
+
+@receiver(post_save, sender=User)
+def reset_moderator_cache_on_user_create(sender, instance, created, **kwargs):
+    # id нового пользователя мог принадлежать удаленному (или откатанному) пользователю
+    if created:
+        invalidate_moderator_cache([instance.pk])
+
+
+@receiver(pre_save, sender=User)
+def revoke_tokens_on_claims_change(sender, instance, update_fields=None, **kwargs):
+    """Отзывает токены пользователя, если изменились is_active или is_staff из claims"""
+    if instance._state.adding or instance.pk is None:
+        return
+    if update_fields is not None and not {"is_active", "is_staff"} & set(update_fields):
+        return
+    stored = User.objects.filter(pk=instance.pk).values("is_active", "is_staff").first()
+    if stored and (stored["is_active"], stored["is_staff"]) != (instance.is_active, instance.is_staff):
+        revoke_user_tokens([instance.pk])
+
+
+@receiver(post_delete, sender=User)
+def revoke_tokens_on_user_delete(sender, instance, **kwargs):
+    revoke_user_tokens([instance.pk])
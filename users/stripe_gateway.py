@@ -0,0 +1,361 @@
+"""
+Шлюз к Stripe API.
+
+Все обращения к Stripe идут через StripeGateway:
+
+* один requests.Session с пулом keep-alive соединений на процесс;
+* таймаут на каждый вызов (соединение и чтение), а не 80 секунд по умолчанию;
+* повторы с экспоненциальной задержкой и случайным разбросом только для
+  идемпотентных вызовов — чтения и запросов с Idempotency-Key, который шлюз
+  добавляет ко всем POST;
+* автомат (circuit breaker): после серии сбоев Stripe вызовы сразу
+  отклоняются на STRIPE_BREAKER_RESET секунд, не занимая воркеры;
+* задержки и ошибки по операциям (см. StripeGateway.metrics);
+* run_async() для асинхронных view: вызов выполняется в пуле потоков шлюза
+  размером с пул соединений и не блокирует цикл событий.
+
+STRIPE_API_BASE направляет шлюз на локальную заглушку (users.stripe_stub).
+"""
+import asyncio
+import contextvars
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import requests
+import stripe
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+# Таймаут чтения текущего вызова; читается сессией внутри клиента Stripe
+_call_timeout = contextvars.ContextVar("stripe_call_timeout", default=None)
+
+# Сбои на стороне Stripe или сети: их имеет смысл повторять, и они открывают автомат
+RETRYABLE_ERRORS = (stripe.APIConnectionError, stripe.RateLimitError, stripe.APIError)
+
+
+class StripeGatewayError(Exception):
+    """Ошибка обращения к Stripe"""
+
+    def __init__(self, operation, message):
+        super().__init__(message)
+        self.operation = operation
+
+
+class StripeUnavailable(StripeGatewayError):
+    """Stripe недоступен: сбой сети или сервера после всех повторов, либо открыт автомат"""
+
+
+class StripeRequestError(StripeGatewayError):
+    """Stripe отклонил запрос (неверные параметры, ключ, объект не найден)"""
+
+    def __init__(self, operation, message, http_status=None, code=None):
+        super().__init__(operation, message)
+        self.http_status = http_status
+        self.code = code
+
+    @property
+    def is_not_found(self):
+        """Объекта в Stripe нет (удален или не существовал): повтор не поможет"""
+        return self.http_status == 404 or self.code == "resource_missing"
+
+
+class _TimeoutSession(requests.Session):
+    # Клиент Stripe передает один таймаут на все запросы — подменяем его таймаутом вызова
+    def __init__(self, connect_timeout):
+        super().__init__()
+        self.connect_timeout = connect_timeout
+
+    def request(self, method, url, timeout=None, **kwargs):
+        read_timeout = _call_timeout.get()
+        if read_timeout is not None:
+            timeout = (self.connect_timeout, read_timeout)
+        return super().request(method, url, timeout=timeout, **kwargs)
+
+
+class CircuitBreaker:
+    """
+    Автомат: после failure_threshold сбоев подряд размыкается на reset_timeout
+    секунд. Затем пропускает один пробный вызов: успех замыкает автомат,
+    сбой снова размыкает его.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+            self._probing = False
+
+
+class LatencyMetrics:
+    """Число вызовов, ошибок и задержки (по последним samples вызовам) для каждой операции"""
+
+    def __init__(self, samples=1000):
+        self.samples = samples
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._latencies = defaultdict(lambda: deque(maxlen=self.samples))
+            self._calls = defaultdict(int)
+            self._errors = defaultdict(int)
+
+    def record(self, operation, seconds, ok=True):
+        """seconds=None — вызов не дошел до Stripe (разомкнут автомат)"""
+        with self._lock:
+            if seconds is not None:
+                self._latencies[operation].append(seconds)
+            self._calls[operation] += 1
+            if not ok:
+                self._errors[operation] += 1
+
+    def snapshot(self):
+        """{операция: {"calls", "errors", "p50_ms", "p95_ms", "max_ms"}}"""
+        with self._lock:
+            result = {}
+            for operation, calls in self._calls.items():
+                ordered = sorted(self._latencies[operation])
+                result[operation] = {
+                    "calls": calls,
+                    "errors": self._errors[operation],
+                    "p50_ms": _percentile_ms(ordered, 0.50),
+                    "p95_ms": _percentile_ms(ordered, 0.95),
+                    "max_ms": _percentile_ms(ordered, 1.0),
+                }
+            return result
+
+
+def _percentile_ms(ordered, fraction):
+    if not ordered:
+        return None
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] * 1000, 1)
+
+
+class StripeGateway:
+    """
+    Обращения к Stripe с пулом соединений, таймаутами, повторами и автоматом.
+    Методы возвращают объекты Stripe и бросают только StripeGatewayError.
+    """
+
+    def __init__(
+        self,
+        api_key,
+        api_base=None,
+        timeout=10.0,
+        connect_timeout=3.0,
+        pool_size=10,
+        max_retries=2,
+        backoff=0.25,
+        max_backoff=2.0,
+        breaker=None,
+    ):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.metrics = LatencyMetrics()
+        # Одновременных вызовов из async-кода не больше, чем соединений в пуле
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="stripe")
+
+        self.session = session = _TimeoutSession(connect_timeout)
+        # Повторы urllib3 отключены: повторяет только сам шлюз, с учетом идемпотентности
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        http_client = stripe.RequestsClient(timeout=(connect_timeout, timeout), session=session)
+        self.client = stripe.StripeClient(
+            api_key,
+            base_addresses={"api": api_base} if api_base else {},
+            max_network_retries=0,
+            http_client=http_client,
+        )
+
+    def call(self, operation, func, *, idempotent, timeout=None):
+        """
+        Выполняет func() как операцию operation. Идемпотентные вызовы повторяются
+        до max_retries раз при сбоях сети, 5xx и 429.
+        """
+        if not self.breaker.allow():
+            self.metrics.record(operation, None, ok=False)
+            raise StripeUnavailable(operation, f"Stripe временно недоступен ({operation}): автомат разомкнут")
+
+        token = _call_timeout.set(timeout or self.timeout)
+        try:
+            attempt = 0
+            while True:
+                start = time.perf_counter()
+                try:
+                    result = func()
+                except RETRYABLE_ERRORS as e:
+                    self.metrics.record(operation, time.perf_counter() - start, ok=False)
+                    if not idempotent or attempt >= self.max_retries:
+                        self.breaker.record_failure()
+                        raise StripeUnavailable(operation, f"Stripe недоступен ({operation}): {e}") from e
+                    attempt += 1
+                    time.sleep(self.retry_delay(attempt))
+                except stripe.StripeError as e:
+                    # Stripe ответил — он работает, автомат это учитывает
+                    self.metrics.record(operation, time.perf_counter() - start, ok=False)
+                    self.breaker.record_success()
+                    raise StripeRequestError(
+                        operation, f"Stripe отклонил запрос ({operation}): {e}", e.http_status, e.code
+                    ) from e
+                else:
+                    self.metrics.record(operation, time.perf_counter() - start)
+                    self.breaker.record_success()
+                    return result
+        except (StripeUnavailable, StripeRequestError):
+            raise
+        except BaseException:
+            # Неожиданная ошибка или прерывание, в том числе в паузе между
+            # повторами: иначе пробный вызов полуоткрытого автомата не
+            # завершился бы и автомат больше не пропускал бы ни одного вызова
+            self.breaker.record_failure()
+            raise
+        finally:
+            _call_timeout.reset(token)
+
+    async def run_async(self, method, *args, **kwargs):
+        """Выполняет метод шлюза в его пуле потоков: await не блокирует цикл событий"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(method, *args, **kwargs))
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+    def retry_delay(self, attempt):
+        # Full jitter: случайная задержка до экспоненциальной границы разводит повторы клиентов
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+
+    def _post(self, operation, method, *args, params, idempotency_key=None, timeout=None):
+        # Ключ создается один раз на вызов: все повторы Stripe узнает как один запрос
+        options = {"idempotency_key": idempotency_key or uuid.uuid4().hex}
+        return self.call(
+            operation, lambda: method(*args, params=params, options=options), idempotent=True, timeout=timeout
+        )
+
+    def create_product(self, name, description="", idempotency_key=None, timeout=None):
+        params = {"name": name}
+        if description:
+            params["description"] = description
+        return self._post(
+            "product.create",
+            self.client.products.create,
+            params=params,
+            idempotency_key=idempotency_key,
+            timeout=timeout,
+        )
+
+    def update_product(self, product_id, name, description="", timeout=None):
+        params = {"name": name, "description": description}
+        return self._post("product.update", self.client.products.update, product_id, params=params, timeout=timeout)
+
+    def create_price(self, product_id, unit_amount, currency, idempotency_key=None, timeout=None):
+        params = {"product": product_id, "unit_amount": unit_amount, "currency": currency}
+        return self._post(
+            "price.create",
+            self.client.prices.create,
+            params=params,
+            idempotency_key=idempotency_key,
+            timeout=timeout,
+        )
+
+    def create_checkout_session(self, price_id, success_url, cancel_url, idempotency_key=None, timeout=None):
+        params = {
+            "payment_method_types": ["card"],
+            "line_items": [{"price": price_id, "quantity": 1}],
+            "mode": "payment",
+            "success_url": success_url,
+            "cancel_url": cancel_url,
+        }
+        return self._post(
+            "checkout_session.create",
+            self.client.checkout.sessions.create,
+            params=params,
+            idempotency_key=idempotency_key,
+            timeout=timeout,
+        )
+
+    def retrieve_checkout_session(self, session_id, timeout=None):
+        return self.call(
+            "checkout_session.retrieve",
+            lambda: self.client.checkout.sessions.retrieve(session_id),
+            idempotent=True,
+            timeout=timeout,
+        )
+
+    def expire_checkout_session(self, session_id, timeout=None):
+        return self._post(
+            "checkout_session.expire", self.client.checkout.sessions.expire, session_id, params={}, timeout=timeout
+        )
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_stripe_gateway():
+    """Шлюз процесса, настроенный из STRIPE_* (создается при первом обращении)"""
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = StripeGateway(
+                settings.STRIPE_SECRET_KEY,
+                api_base=settings.STRIPE_API_BASE,
+                timeout=settings.STRIPE_TIMEOUT,
+                connect_timeout=settings.STRIPE_CONNECT_TIMEOUT,
+                pool_size=settings.STRIPE_POOL_SIZE,
+                max_retries=settings.STRIPE_MAX_RETRIES,
+                breaker=CircuitBreaker(settings.STRIPE_BREAKER_THRESHOLD, settings.STRIPE_BREAKER_RESET),
+            )
+        return _gateway
+
+
+def reset_stripe_gateway():
+    """Сбрасывает шлюз процесса: следующий вызов создаст его заново из настроек"""
+    global _gateway
+    with _gateway_lock:
+        if _gateway is not None:
+            _gateway.close()
+        _gateway = None
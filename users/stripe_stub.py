@@ -0,0 +1,211 @@
+"""
+Локальная заглушка Stripe API для тестов и нагрузочных прогонов без сети.
+
+Поддерживает то, чем пользуется StripeGateway: создание и обновление
+продуктов, создание цен, создание, получение и завершение сессий оплаты.
+Повторный POST с тем же Idempotency-Key возвращает сохраненный ответ, как
+Stripe. Задержка (latency) и доля ответов 500 (error_rate) задаются при
+запуске, fail_next() обрывает ближайшие запросы ошибкой.
+
+    python manage.py stripe_stub --port 12111 --latency 0.05
+    STRIPE_API_BASE=http://127.0.0.1:12111 python manage.py runserver
+"""
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+ROUTES = []
+
+
+def route(method, pattern):
+    def decorator(func):
+        ROUTES.append((method, re.compile(f"^{pattern}$"), func))
+        return func
+    return decorator
+
+
+class StubError(Exception):
+    def __init__(self, status, message, error_type="invalid_request_error", code=None):
+        super().__init__(message)
+        self.status = status
+        self.body = {"error": {"type": error_type, "message": message}}
+        if code:
+            self.body["error"]["code"] = code
+
+
+class StripeStub:
+    """Состояние заглушки и HTTP-сервер в фоновом потоке"""
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, error_rate=0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.products = {}
+        self.prices = {}
+        self.sessions = {}
+        # (метод, путь) каждого запроса — для проверок в тестах
+        self.requests = []
+        # Адреса клиентов: по ним видно, переиспользуются ли соединения
+        self.connections = set()
+        self._idempotent = {}
+        self._fail_next = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), _handler_for(self))
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        # Короткий интервал опроса — чтобы stop() не ждал полсекунды
+        self._thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def fail_next(self, count=1, status=500):
+        """Следующие count запросов получат ответ status"""
+        with self._lock:
+            self._fail_next.extend([status] * count)
+
+    def calls(self, method, path):
+        return sum(1 for request in self.requests if request == (method, path))
+
+    def set_session(self, session_id, **fields):
+        """Меняет сессию, как это сделал бы Stripe (оплата, истечение)"""
+        with self._lock:
+            self.sessions[session_id].update(fields)
+
+    def new_id(self, prefix):
+        return f"{prefix}_stub_{next(self._ids)}"
+
+    def handle(self, method, path, params, idempotency_key):
+        with self._lock:
+            self.requests.append((method, re.sub(r"/(prod|price|cs)_stub_\d+", r"/{\1}", path)))
+            if self._fail_next:
+                raise StubError(self._fail_next.pop(0), "Injected failure", "api_error")
+            if idempotency_key and idempotency_key in self._idempotent:
+                return self._idempotent[idempotency_key]
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            raise StubError(500, "Injected failure", "api_error")
+        for route_method, pattern, func in ROUTES:
+            match = pattern.match(path)
+            if route_method == method and match:
+                with self._lock:
+                    result = func(self, params, *match.groups())
+                    if idempotency_key:
+                        self._idempotent[idempotency_key] = result
+                    return result
+        raise StubError(404, f"Unrecognized request URL ({method}: {path})")
+
+    @route("POST", r"/v1/products")
+    def create_product(self, params):
+        product_id = self.new_id("prod")
+        self.products[product_id] = {
+            "id": product_id,
+            "object": "product",
+            "name": params.get("name", ""),
+            "description": params.get("description"),
+        }
+        return self.products[product_id]
+
+    @route("POST", r"/v1/products/([^/]+)")
+    def update_product(self, params, product_id):
+        product = self._get(self.products, product_id, "product")
+        product.update({key: params[key] for key in ("name", "description") if key in params})
+        return product
+
+    @route("POST", r"/v1/prices")
+    def create_price(self, params):
+        self._get(self.products, params.get("product"), "product")
+        price_id = self.new_id("price")
+        self.prices[price_id] = {
+            "id": price_id,
+            "object": "price",
+            "product": params["product"],
+            "unit_amount": int(params["unit_amount"]),
+            "currency": params["currency"],
+        }
+        return self.prices[price_id]
+
+    @route("POST", r"/v1/checkout/sessions")
+    def create_session(self, params):
+        price = self._get(self.prices, params.get("line_items[0][price]"), "price")
+        session_id = self.new_id("cs")
+        self.sessions[session_id] = {
+            "id": session_id,
+            "object": "checkout.session",
+            "url": f"{self.url}/pay/{session_id}",
+            "status": "open",
+            "payment_status": "unpaid",
+            "amount_total": price["unit_amount"],
+            "currency": price["currency"],
+            "created": int(time.time()),
+            "success_url": params.get("success_url"),
+            "cancel_url": params.get("cancel_url"),
+        }
+        return self.sessions[session_id]
+
+    @route("GET", r"/v1/checkout/sessions/([^/]+)")
+    def retrieve_session(self, params, session_id):
+        return self._get(self.sessions, session_id, "checkout.session")
+
+    @route("POST", r"/v1/checkout/sessions/([^/]+)/expire")
+    def expire_session(self, params, session_id):
+        session = self._get(self.sessions, session_id, "checkout.session")
+        if session["status"] != "open":
+            raise StubError(400, f"Only open sessions can be expired (session is {session['status']})")
+        session["status"] = "expired"
+        return session
+
+    def _get(self, objects, object_id, name):
+        if object_id not in objects:
+            raise StubError(404, f"No such {name}: '{object_id}'", code="resource_missing")
+        return objects[object_id]
+
+
+def _handler_for(stub):
+    class Handler(BaseHTTPRequestHandler):
+        # Keep-alive, как у api.stripe.com: клиент переиспользует соединения из пула
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            self.dispatch("GET")
+
+        def do_POST(self):
+            self.dispatch("POST")
+
+        def dispatch(self, method):
+            stub.connections.add(self.client_address)
+            path, _, query = self.path.partition("?")
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length).decode() if length else query
+            params = dict(parse_qsl(body, keep_blank_values=True))
+            try:
+                status, payload = 200, stub.handle(method, path, params, self.headers.get("Idempotency-Key"))
+            except StubError as e:
+                status, payload = e.status, e.body
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
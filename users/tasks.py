@@ -1,23 +1,129 @@
+import logging
+import time
+from dataclasses import asdict
 from datetime import timedelta
 
 from celery import shared_task
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
 from django.utils import timezone
 
+logger = logging.getLogger(__name__)
+
+
+# Точка продолжения прерванного прохода: {"last_pk": ..., "deactivated": ...}
+DEACTIVATE_CHECKPOINT_KEY = "users:deactivate-inactive:checkpoint"
+DEACTIVATE_CHECKPOINT_TTL = 2 * 24 * 60 * 60
+
 
 @shared_task
-def deactivate_inactive_users() -> int:
+def deactivate_inactive_users(days: int = 30, batch_size: int = 1000, sleep: float = 0.05) -> dict:
     """
-    Деактивирует пользователей, которые не заходили более месяца.
+    Деактивирует пользователей, которые не заходили более days дней.
 
-    Основано на поле last_login и флаге is_active.
-    Возвращает количество деактивированных пользователей.
+    Основано на поле last_login и флаге is_active. Пользователи обходятся
+    пачками по batch_size в порядке id по частичному индексу
+    users_user_active_login_idx; каждая пачка — отдельный короткий UPDATE,
+    между пачками пауза sleep секунд, чтобы не задерживать входы. После каждой
+    пачки в кеш пишется точка продолжения: после сбоя следующий запуск
+    продолжит с нее. Возвращает отчет о проходе.
     """
+    from users.tokens import revoke_user_tokens
+
     User = get_user_model()
-    threshold = timezone.now() - timedelta(days=30)
+    started = time.perf_counter()
+    threshold = timezone.now() - timedelta(days=days)
+    checkpoint = cache.get(DEACTIVATE_CHECKPOINT_KEY) or {"last_pk": 0, "deactivated": 0}
+    report = {"resumed_from": checkpoint["last_pk"], "batches": 0, **checkpoint}
 
     # last_login может быть None для никогда не заходивших пользователей – их не трогаем
-    qs = User.objects.filter(is_active=True, last_login__lt=threshold)
-    updated = qs.update(is_active=False)
-    return updated
+    candidates = User.objects.filter(is_active=True, last_login__lt=threshold).order_by("pk")
+    while True:
+        pks = list(candidates.filter(pk__gt=report["last_pk"]).values_list("pk", flat=True)[:batch_size])
+        if not pks:
+            break
+        with transaction.atomic():
+            # Условие проверяется заново под блокировкой: пользователь мог войти
+            # после выборки, и ни деактивировать его, ни отзывать его токены нельзя
+            updated = list(candidates.select_for_update().filter(pk__in=pks).values_list("pk", flat=True))
+            if updated:
+                report["deactivated"] += User.objects.filter(pk__in=updated).update(is_active=False)
+                # update() минует сигналы User — отзываем токены с claim is_active сами
+                revoke_user_tokens(updated)
+        report["last_pk"] = pks[-1]
+        report["batches"] += 1
+        cache.set(
+            DEACTIVATE_CHECKPOINT_KEY,
+            {"last_pk": report["last_pk"], "deactivated": report["deactivated"]},
+            DEACTIVATE_CHECKPOINT_TTL,
+        )
+        logger.info(
+            "deactivate_inactive_users: batch %d, up to id %d, %d deactivated",
+            report["batches"], report["last_pk"], report["deactivated"],
+        )
+        if len(pks) < batch_size:
+            break
+        if sleep:
+            time.sleep(sleep)
+
+    cache.delete(DEACTIVATE_CHECKPOINT_KEY)
+    report["duration_seconds"] = round(time.perf_counter() - started, 3)
+    logger.info("deactivate_inactive_users: %s", report)
+    return report
+
+
+@shared_task
+def prune_stripe_events(days: int = 30) -> int:
+    """
+    Удаляет записи обработанных событий Stripe старше days дней.
+
+    Stripe повторяет доставку события не дольше трех суток, поэтому старые
+    записи для защиты от повторов уже не нужны. Возвращает число удаленных.
+    """
+    from users.models import StripeEvent
+
+    deleted, _ = StripeEvent.objects.filter(created_at__lt=timezone.now() - timedelta(days=days)).delete()
+    return deleted
+
+
+@shared_task
+def prune_idempotency_keys(hours: int = 24) -> int:
+    """
+    Удаляет ключи Idempotency-Key старше hours часов. Stripe хранит свои ключи
+    идемпотентности 24 часа, поэтому дольше хранить ответы незачем.
+    Возвращает число удаленных.
+    """
+    from users.models import IdempotencyKey
+
+    deleted, _ = IdempotencyKey.objects.filter(created_at__lt=timezone.now() - timedelta(hours=hours)).delete()
+    return deleted
+
+
+@shared_task
+def reconcile_pending_payments(
+    min_age_minutes: int = 15,
+    abandon_after_minutes: int = 120,
+    batch_size: int = 100,
+    concurrency: int = 8,
+    max_payments: int = 2000,
+    missing_after_hours: int = 24,
+    max_missing_share: float = 0.5,
+) -> dict:
+    """
+    Сверяет ожидающие оплаты платежи со Stripe и завершает брошенные сессии
+    (см. users.reconciliation). Возвращает отчет: сколько платежей обработано,
+    с каким итогом и за сколько секунд.
+    """
+    from users.reconciliation import reconcile_pending_payments as reconcile
 
+    report = reconcile(
+        min_age=timedelta(minutes=min_age_minutes),
+        abandon_after=timedelta(minutes=abandon_after_minutes),
+        batch_size=batch_size,
+        concurrency=concurrency,
+        max_payments=max_payments,
+        missing_after=timedelta(hours=missing_after_hours),
+        max_missing_share=max_missing_share,
+    )
+    return asdict(report)
@@ -1,3 +1,1010 @@
-from django.test import TestCase
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import QuerySet
+from django.test import AsyncClient, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from lms.models import Course, CourseDailyStats
+from users.idempotency import LEASE_TIMEOUT, reclaim_stale_key, release_key, save_response
+from users.models import IdempotencyKey, Payment, StripeEvent, User
+from users.permissions import MODERATOR_GROUP, is_moderator, moderator_cache_key
+from users.reconciliation import pending_payments
+from users.stripe_gateway import (
+    CircuitBreaker,
+    StripeGateway,
+    StripeRequestError,
+    StripeUnavailable,
+    get_stripe_gateway,
+    reset_stripe_gateway,
+)
+from users.stripe_stub import StripeStub
+from users.tasks import (
+    DEACTIVATE_CHECKPOINT_KEY,
+    deactivate_inactive_users,
+    prune_idempotency_keys,
+    prune_stripe_events,
+    reconcile_pending_payments,
+)
+from users.tokens import revoked_cache_key
+from users.views import PaymentListView
+
+def prefer_index_scans():
+    """
+    Запрещает Seq Scan до конца транзакции теста на PostgreSQL: для таблиц в
+    несколько строк планировщик иначе законно выбирает полный просмотр, и
+    проверка плана ничего бы не говорила о пригодности индекса.
+    """
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+
+# Тесты не должны зависеть от Redis и от данных, оставшихся в нем после прошлых
+# прогонов, а cache.clear() в тестах не должен очищать общий кеш
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+locmem_cache = override_settings(CACHES=LOCMEM_CACHES)
+
+
+def setUpModule():
+    locmem_cache.enable()
+
+
+def tearDownModule():
+    locmem_cache.disable()
+
+
+def count_group_queries(queries):
+    return sum(1 for q in queries if '"auth_group"' in q["sql"])
+
+
+class ModeratorRoleCacheTestCase(APITestCase):
+    """Тесты кеширования роли модератора"""
+
+    def setUp(self):
+        cache.clear()
+        self.group, _ = Group.objects.get_or_create(name=MODERATOR_GROUP)
+        self.moderator = User.objects.create_user(email="moderator@test.com", password="testpass123")
+        self.moderator.groups.add(self.group)
+        self.owner = User.objects.create_user(email="owner@test.com", password="testpass123")
+        Course.objects.create(title="Course", owner=self.owner)
+
+    def fresh(self, user):
+        """Новый объект пользователя, как при аутентификации очередного запроса"""
+        return User.objects.get(pk=user.pk)
+
+    def test_role_resolved_once_per_request(self):
+        """Роль модератора вычисляется не больше одного раза за запрос"""
+        self.client.force_authenticate(user=self.fresh(self.moderator))
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.patch(f"/api/courses/{Course.objects.get().pk}/", {"title": "New"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertLessEqual(count_group_queries(ctx.captured_queries), 1)
+
+    def test_role_cached_across_requests(self):
+        """Повторный запрос берет роль из общего кеша"""
+        self.client.force_authenticate(user=self.fresh(self.moderator))
+        self.client.get("/api/courses/")
+        self.client.force_authenticate(user=self.fresh(self.moderator))
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get("/api/courses/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(count_group_queries(ctx.captured_queries), 0)
+        self.assertEqual(len(response.data["results"]), 1)
+
+    def test_cache_invalidated_on_group_remove(self):
+        """Удаление из группы сбрасывает кеш"""
+        self.assertTrue(is_moderator(self.fresh(self.moderator)))
+        self.moderator.groups.remove(self.group)
+        self.assertIsNone(cache.get(moderator_cache_key(self.moderator.pk)))
+        self.assertFalse(is_moderator(self.fresh(self.moderator)))
+
+    def test_cache_invalidated_on_reverse_add(self):
+        """Добавление через group.user_set тоже сбрасывает кеш"""
+        self.assertFalse(is_moderator(self.fresh(self.owner)))
+        self.group.user_set.add(self.owner)
+        self.assertTrue(is_moderator(self.fresh(self.owner)))
+
+    def test_cache_invalidated_on_reverse_clear(self):
+        """Очистка группы сбрасывает кеш всех ее участников"""
+        self.assertTrue(is_moderator(self.fresh(self.moderator)))
+        self.group.user_set.clear()
+        self.assertFalse(is_moderator(self.fresh(self.moderator)))
+
+
+class PaymentListRowSerializerTestCase(APITestCase):
+    """Быстрый путь списка платежей совпадает со стандартным"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email="payer@test.com", password="testpass123")
+        course = Course.objects.create(title="Course", owner=self.user)
+        Payment.objects.create(user=self.user, paid_course=course, amount=Decimal("10.5"))
+        Payment.objects.create(
+            user=self.user,
+            paid_course=course,
+            amount=Decimal("99.99"),
+            payment_method=Payment.PaymentMethod.STRIPE,
+            stripe_session_id="cs_test",
+            payment_url="https://checkout.stripe.com/pay/cs_test",
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def test_same_content(self):
+        fast = self.client.get("/api/payments/")
+        with mock.patch.object(PaymentListView, "use_row_serializer", False):
+            slow = self.client.get("/api/payments/")
+        self.assertEqual(fast.status_code, status.HTTP_200_OK)
+        self.assertEqual(fast.content, slow.content)
+        self.assertEqual(fast.json()["results"][0]["amount"], "99.99")
+
+
+class PaymentHistoryTestCase(APITestCase):
+    """Тесты keyset-пагинации, фильтров и индексов истории платежей"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="payer@test.com", password="testpass123")
+        self.other = User.objects.create_user(email="other@test.com", password="testpass123")
+        self.course = Course.objects.create(title="Course", owner=self.user)
+        start = timezone.now() - timedelta(days=30)
+        payments = Payment.objects.bulk_create(
+            Payment(user=self.user, paid_course=self.course, amount=Decimal(10 * (i + 1))) for i in range(30)
+        )
+        # auto_now_add не дает задать дату при создании: по дню на платеж
+        for i, payment in enumerate(payments):
+            payment.payment_date = start + timedelta(days=i)
+        Payment.objects.bulk_update(payments, ["payment_date"])
+        Payment.objects.create(user=self.other, amount=Decimal("1.00"))
+        self.start = start
+        self.client.force_authenticate(user=self.user)
+
+    def amounts(self, response):
+        return [Decimal(item["amount"]) for item in response.json()["results"]]
+
+    def test_keyset_pages(self):
+        """Страницы идут от новых платежей к старым без пропусков и повторов"""
+        seen = []
+        url = "/api/payments/?page_size=7"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen += self.amounts(response)
+            url = response.json()["next"]
+        self.assertEqual(seen, [Decimal(10 * i) for i in range(30, 0, -1)])
+
+    def test_ascending_ordering(self):
+        """?ordering=payment_date — от старых к новым"""
+        response = self.client.get("/api/payments/", {"ordering": "payment_date", "page_size": 3})
+        self.assertEqual(self.amounts(response), [Decimal(10), Decimal(20), Decimal(30)])
+
+    def test_range_filters(self):
+        """Фильтры по диапазону дат и сумм"""
+        response = self.client.get("/api/payments/", {
+            "payment_date_after": (self.start + timedelta(days=10)).isoformat(),
+            "payment_date_before": (self.start + timedelta(days=19)).isoformat(),
+            "amount_min": "150",
+            "amount_max": "180",
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.amounts(response), [Decimal(180), Decimal(170), Decimal(160), Decimal(150)])
+
+    def test_forged_cursor(self):
+        """Курсор с некорректными для полей значениями дает 404, а не 500"""
+        positions = [
+            {"v": "not-a-date", "i": 1},
+            {"v": None, "i": 1},
+            {"v": [1], "i": 1},
+            {"v": timezone.now().isoformat(), "i": 10 ** 30},
+            {"v": timezone.now().isoformat(), "i": None},
+            [1, 2],
+        ]
+        for position in positions:
+            cursor = base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+            response = self.client.get("/api/payments/", {"cursor": cursor})
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, position)
+
+    def query_plan(self, params):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get("/api/payments/", params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        sql = next(q["sql"] for q in ctx.captured_queries if 'FROM "users_payment"' in q["sql"])
+        with connection.cursor() as cursor:
+            cursor.execute(connection.ops.explain_query_prefix() + " " + sql)
+            return " ".join(str(row) for row in cursor.fetchall())
+
+    def test_query_plans_use_indexes(self):
+        """Частые комбинации фильтров читают составной индекс, а не всю таблицу"""
+        prefer_index_scans()
+        date_after = self.start.isoformat()
+        cases = [
+            ({}, "users_payment_user_date_idx"),
+            ({"payment_date_after": date_after}, "users_payment_user_date_idx"),
+            ({"payment_method": "cash", "amount_min": "10"}, "users_payment_user_date_idx"),
+            ({"paid_course": self.course.id, "payment_date_after": date_after}, "users_payment_"),
+        ]
+        for params, index in cases:
+            plan = self.query_plan(params)
+            self.assertIn(index, plan, params)
+            if connection.vendor == "sqlite":
+                self.assertNotIn("TEMP B-TREE", plan, params)
+
+        moderators_group, _ = Group.objects.get_or_create(name=MODERATOR_GROUP)
+        self.other.groups.add(moderators_group)
+        self.client.force_authenticate(user=self.other)
+        self.assertIn("users_payment_date_idx", self.query_plan({}))
+        self.assertIn("users_payment_course_date_idx", self.query_plan({"paid_course": self.course.id}))
+
+
+class StripeStubMixin:
+    """Шлюз Stripe направлен на локальную заглушку, запущенную на время теста"""
+
+    stub_latency = 0.0
+
+    def setUp(self):
+        super().setUp()
+        self.stub = StripeStub(latency=self.stub_latency)
+        self.stub.start()
+        self.addCleanup(self.stub.stop)
+        settings_override = override_settings(STRIPE_API_BASE=self.stub.url, STRIPE_SECRET_KEY="sk_test_stub")
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        reset_stripe_gateway()
+        self.addCleanup(reset_stripe_gateway)
+
+
+class PaymentCreateStripeReuseTestCase(StripeStubMixin, APITestCase):
+    """Повторные оплаты используют сохраненные продукт и цену Stripe"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create_user(email="payer@test.com", password="testpass123")
+        self.course = Course.objects.create(title="Course", description="About", owner=self.user)
+        self.client.force_authenticate(user=self.user)
+
+    def checkout(self, amount="10.00"):
+        return self.client.post("/api/payments/create/", {"paid_course": self.course.id, "amount": amount})
+
+    def test_second_checkout_makes_one_stripe_call(self):
+        """Вторая оплата того же курса на ту же сумму — только создание сессии"""
+        self.assertEqual(self.checkout().status_code, status.HTTP_201_CREATED)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.checkout()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.stub.prices[response.data["stripe_price_id"]]["unit_amount"], 1000)
+        self.assertEqual(self.stub.calls("POST", "/v1/products"), 1)
+        self.assertEqual(self.stub.calls("POST", "/v1/prices"), 1)
+        self.assertEqual(self.stub.calls("POST", "/v1/checkout/sessions"), 2)
+        lookups = [q for q in ctx.captured_queries if q["sql"].startswith("SELECT")]
+        self.assertEqual(len(lookups), 1)
+
+    def test_new_amount_reuses_product(self):
+        """Новая сумма создает только цену для существующего продукта"""
+        first = self.checkout("10.00")
+        response = self.checkout("15.00")
+        self.assertEqual(response.data["stripe_product_id"], first.data["stripe_product_id"])
+        self.assertEqual(self.stub.calls("POST", "/v1/products"), 1)
+        self.assertEqual(self.stub.calls("POST", "/v1/prices"), 2)
+
+    def test_content_change_updates_product(self):
+        """Смена названия курса обновляет продукт в Stripe один раз"""
+        product_id = self.checkout().data["stripe_product_id"]
+        Course.objects.filter(pk=self.course.pk).update(title="Renamed")
+        self.checkout()
+        self.checkout()
+        self.assertEqual(self.stub.calls("POST", "/v1/products/{prod}"), 1)
+        self.assertEqual(self.stub.products[product_id]["name"], "Renamed")
+        self.assertEqual(self.stub.calls("POST", "/v1/prices"), 1)
+
+    def test_unknown_course(self):
+        """Несуществующий курс — 404 без обращения к Stripe"""
+        response = self.client.post("/api/payments/create/", {"paid_course": 999999, "amount": "10.00"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.stub.requests, [])
+
+    def test_stripe_unavailable(self):
+        """Сбой Stripe после всех повторов — 503, платеж не создается"""
+        get_stripe_gateway().backoff = 0
+        self.stub.fail_next(3)
+        response = self.checkout()
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(self.stub.calls("POST", "/v1/products"), 3)
+        self.assertFalse(Payment.objects.exists())
+
+
+class StripeGatewayTestCase(StripeStubMixin, SimpleTestCase):
+    """Пул соединений, таймауты, повторы и автомат шлюза Stripe"""
+
+    def gateway(self, **kwargs):
+        kwargs = {"api_base": self.stub.url, "backoff": 0, **kwargs}
+        return StripeGateway("sk_test_stub", **kwargs)
+
+    def test_reuses_connections(self):
+        """Последовательные вызовы идут через одно keep-alive соединение"""
+        gateway = self.gateway()
+        product = gateway.create_product("Course")
+        for _ in range(5):
+            gateway.create_price(product.id, 1000, "usd")
+        self.assertEqual(len(self.stub.requests), 6)
+        self.assertEqual(len(self.stub.connections), 1)
+
+    def test_retries_with_same_idempotency_key(self):
+        """Повтор POST после 500 не создает второй объект"""
+        gateway = self.gateway(max_retries=2)
+        self.stub.fail_next(2)
+        product = gateway.create_product("Course")
+        self.assertEqual(self.stub.calls("POST", "/v1/products"), 3)
+        self.assertEqual(list(self.stub.products), [product.id])
+
+        self.stub.fail_next(3)
+        with self.assertRaises(StripeUnavailable):
+            gateway.create_product("Course")
+        self.assertEqual(self.stub.calls("POST", "/v1/products"), 6)
+
+    def test_non_idempotent_call_is_not_retried(self):
+        gateway = self.gateway(max_retries=2)
+        self.stub.fail_next(1)
+        with self.assertRaises(StripeUnavailable):
+            gateway.call("product.list", lambda: gateway.client.products.list(), idempotent=False)
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_rejected_request_is_not_retried(self):
+        """4xx не повторяется и не размыкает автомат"""
+        gateway = self.gateway(breaker=CircuitBreaker(failure_threshold=1))
+        with self.assertRaises(StripeRequestError):
+            gateway.retrieve_checkout_session("cs_missing")
+        self.assertEqual(len(self.stub.requests), 1)
+        self.assertEqual(gateway.breaker.state, "closed")
+
+    def test_timeout(self):
+        """Медленный ответ обрывается по таймауту вызова"""
+        self.stub.latency = 1.0
+        gateway = self.gateway(max_retries=0)
+        started = time.monotonic()
+        with self.assertRaises(StripeUnavailable):
+            gateway.create_product("Course", timeout=0.1)
+        self.assertLess(time.monotonic() - started, 0.9)
+
+    def test_circuit_breaker(self):
+        """Серия сбоев размыкает автомат; после паузы пробный вызов замыкает его"""
+        now = [0.0]
+        gateway = self.gateway(max_retries=0, breaker=CircuitBreaker(2, 30, clock=lambda: now[0]))
+        self.stub.fail_next(2)
+        for _ in range(2):
+            with self.assertRaises(StripeUnavailable):
+                gateway.create_product("Course")
+        self.assertEqual(gateway.breaker.state, "open")
+        with self.assertRaises(StripeUnavailable):
+            gateway.create_product("Course")
+        self.assertEqual(len(self.stub.requests), 2)
+
+        now[0] = 31.0
+        self.assertEqual(gateway.breaker.state, "half-open")
+        gateway.create_product("Course")
+        self.assertEqual(gateway.breaker.state, "closed")
+
+    def test_unexpected_error_ends_probe(self):
+        """Неожиданное исключение в пробном вызове снова размыкает автомат, а не блокирует его"""
+        now = [0.0]
+        gateway = self.gateway(max_retries=0, breaker=CircuitBreaker(1, 30, clock=lambda: now[0]))
+        self.stub.fail_next(1)
+        with self.assertRaises(StripeUnavailable):
+            gateway.create_product("Course")
+
+        now[0] = 31.0
+
+        def broken():
+            raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            gateway.call("product.create", broken, idempotent=True)
+        self.assertEqual(gateway.breaker.state, "open")
+        self.assertFalse(gateway.breaker._probing)
+
+        now[0] = 62.0
+        gateway.create_product("Course")
+        self.assertEqual(gateway.breaker.state, "closed")
+
+    def test_metrics(self):
+        gateway = self.gateway(max_retries=0)
+        product = gateway.create_product("Course")
+        gateway.create_price(product.id, 1000, "usd")
+        self.stub.fail_next(1)
+        with self.assertRaises(StripeUnavailable):
+            gateway.create_price(product.id, 1000, "usd")
+        metrics = gateway.metrics.snapshot()
+        self.assertEqual(metrics["product.create"]["calls"], 1)
+        self.assertEqual(metrics["price.create"]["calls"], 2)
+        self.assertEqual(metrics["price.create"]["errors"], 1)
+        self.assertIsNotNone(metrics["price.create"]["p95_ms"])
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET="whsec_test")
+class StripeWebhookTestCase(APITestCase):
+    """Вебхук Stripe обновляет статус платежа по событиям сессии"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email="payer@test.com", password="testpass123")
+        self.course = Course.objects.create(title="Course", owner=self.user)
+        self.payment = Payment.objects.create(
+            user=self.user,
+            paid_course=self.course,
+            amount=Decimal("10.00"),
+            payment_method=Payment.PaymentMethod.STRIPE,
+            stripe_session_id="cs_test_1",
+        )
+
+    def deliver(self, event_id, event_type, secret="whsec_test", **session):
+        session = {"id": "cs_test_1", "object": "checkout.session", **session}
+        payload = json.dumps({"id": event_id, "object": "event", "type": event_type, "data": {"object": session}})
+        timestamp = int(time.time())
+        signature = hmac.new(secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+        return self.client.post(
+            "/api/payments/webhook/",
+            payload,
+            content_type="application/json",
+            HTTP_STRIPE_SIGNATURE=f"t={timestamp},v1={signature}",
+        )
+
+    def status_of_payment(self):
+        self.payment.refresh_from_db()
+        return self.payment.payment_status
+
+    def test_completed_marks_paid(self):
+        response = self.deliver("evt_1", "checkout.session.completed", payment_status="paid")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.status_of_payment(), Payment.PaymentStatus.PAID)
+        self.assertEqual(CourseDailyStats.objects.get(course=self.course).payments, 1)
+
+    def test_duplicate_delivery_is_ignored(self):
+        """Повторная доставка события ничего не меняет"""
+        self.deliver("evt_1", "checkout.session.completed", payment_status="paid")
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.deliver("evt_1", "checkout.session.completed", payment_status="paid")
+        self.assertTrue(response.data["duplicate"])
+        self.assertFalse([q for q in ctx.captured_queries if q["sql"].startswith("UPDATE")])
+        self.assertEqual(StripeEvent.objects.count(), 1)
+        self.assertEqual(CourseDailyStats.objects.get(course=self.course).payments, 1)
+
+    def test_late_expired_does_not_cancel_paid(self):
+        """Запоздавшее событие не отменяет оплаченный платеж"""
+        self.deliver("evt_1", "checkout.session.completed", payment_status="paid")
+        self.deliver("evt_2", "checkout.session.expired", payment_status="unpaid", status="expired")
+        self.assertEqual(self.status_of_payment(), Payment.PaymentStatus.PAID)
+
+    def test_async_payment_flow(self):
+        """Отложенная оплата: completed без оплаты, затем async_payment_failed"""
+        self.deliver("evt_1", "checkout.session.completed", payment_status="unpaid")
+        self.assertEqual(self.status_of_payment(), Payment.PaymentStatus.PENDING)
+        self.deliver("evt_2", "checkout.session.async_payment_failed", payment_status="unpaid")
+        self.assertEqual(self.status_of_payment(), Payment.PaymentStatus.CANCELLED)
+
+    def test_unknown_session_and_event_type(self):
+        response = self.deliver("evt_1", "checkout.session.completed", id="cs_other", payment_status="paid")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.deliver("evt_2", "customer.created")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.status_of_payment(), Payment.PaymentStatus.PENDING)
+
+    def test_bad_signature(self):
+        response = self.deliver("evt_1", "checkout.session.completed", secret="whsec_other", payment_status="paid")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.status_of_payment(), Payment.PaymentStatus.PENDING)
+        self.assertFalse(StripeEvent.objects.exists())
+
+    def test_status_view_reads_database(self):
+        """Статус платежа отдается из БД без обращения к Stripe"""
+        self.deliver("evt_1", "checkout.session.completed", payment_status="paid")
+        self.client.force_authenticate(user=self.user)
+        with mock.patch("users.services.get_stripe_gateway") as gateway:
+            response = self.client.get(f"/api/payments/{self.payment.id}/status/")
+        self.assertEqual(response.data["payment_status"], Payment.PaymentStatus.PAID)
+        gateway.assert_not_called()
+
+    def test_prune_events(self):
+        self.deliver("evt_1", "customer.created")
+        StripeEvent.objects.update(created_at=timezone.now() - timedelta(days=31))
+        self.deliver("evt_2", "customer.created")
+        self.assertEqual(prune_stripe_events(), 1)
+        self.assertEqual(list(StripeEvent.objects.values_list("event_id", flat=True)), ["evt_2"])
+
+
+class PaymentReconciliationTestCase(StripeStubMixin, APITestCase):
+    """Сверка ожидающих платежей со Stripe"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email="payer@test.com", password="testpass123")
+        self.course = Course.objects.create(title="Course", owner=self.user)
+        gateway = get_stripe_gateway()
+        gateway.backoff = 0
+        product = gateway.create_product("Course")
+        self.price = gateway.create_price(product.id, 1000, "usd")
+
+    def pending_payment(self, age, session_status=None):
+        session = get_stripe_gateway().create_checkout_session(self.price.id, "https://a/ok", "https://a/cancel")
+        if session_status:
+            self.stub.set_session(session.id, **session_status)
+        payment = Payment.objects.create(
+            user=self.user,
+            paid_course=self.course,
+            amount=Decimal("10.00"),
+            payment_method=Payment.PaymentMethod.STRIPE,
+            stripe_session_id=session.id,
+        )
+        Payment.objects.filter(pk=payment.pk).update(payment_date=timezone.now() - age)
+        return payment
+
+    def status_of(self, payment):
+        payment.refresh_from_db()
+        return payment.payment_status
+
+    def test_reconcile(self):
+        paid = self.pending_payment(timedelta(hours=1), {"payment_status": "paid", "status": "complete"})
+        expired = self.pending_payment(timedelta(hours=1), {"status": "expired"})
+        abandoned = self.pending_payment(timedelta(hours=3))
+        open_session = self.pending_payment(timedelta(minutes=30))
+        fresh = self.pending_payment(timedelta(minutes=5))
+
+        with CaptureQueriesContext(connection) as ctx:
+            report = reconcile_pending_payments()
+        self.assertEqual(
+            (report["processed"], report["paid"], report["cancelled"], report["expired"], report["still_pending"]),
+            (4, 1, 2, 1, 1),
+        )
+        self.assertIn("duration_seconds", report)
+        self.assertEqual(self.status_of(paid), Payment.PaymentStatus.PAID)
+        self.assertEqual(self.status_of(expired), Payment.PaymentStatus.CANCELLED)
+        self.assertEqual(self.status_of(abandoned), Payment.PaymentStatus.CANCELLED)
+        self.assertEqual(self.stub.sessions[abandoned.stripe_session_id]["status"], "expired")
+        self.assertEqual(self.status_of(open_session), Payment.PaymentStatus.PENDING)
+        self.assertEqual(self.status_of(fresh), Payment.PaymentStatus.PENDING)
+        # Один UPDATE на статус, оплата учтена в статистике курса
+        updates = [q for q in ctx.captured_queries if q["sql"].startswith('UPDATE "users_payment"')]
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(CourseDailyStats.objects.get(course=self.course).payments, 1)
+
+    def test_bounded_batches(self):
+        for _ in range(5):
+            self.pending_payment(timedelta(hours=1))
+        report = reconcile_pending_payments(batch_size=2, max_payments=3)
+        self.assertEqual(report["processed"], 3)
+        self.assertEqual(self.stub.calls("GET", "/v1/checkout/sessions/{cs}"), 3)
+
+    def missing_payment(self, age):
+        payment = Payment.objects.create(
+            user=self.user,
+            paid_course=self.course,
+            amount=Decimal("10.00"),
+            payment_method=Payment.PaymentMethod.STRIPE,
+            stripe_session_id=f"cs_deleted_{Payment.objects.count()}",
+        )
+        Payment.objects.filter(pk=payment.pk).update(payment_date=timezone.now() - age)
+        return payment
+
+    def test_missing_sessions_do_not_starve_newer_payments(self):
+        """Платежи с удаленными в Stripe сессиями отменяются после срока жизни сессии"""
+        old = self.missing_payment(timedelta(hours=30))
+        young = self.missing_payment(timedelta(hours=5))
+        paid = [
+            self.pending_payment(timedelta(hours=1), {"payment_status": "paid", "status": "complete"})
+            for _ in range(2)
+        ]
+
+        report = reconcile_pending_payments()
+        self.assertEqual((report["processed"], report["missing"], report["cancelled"], report["paid"]), (4, 2, 1, 2))
+        self.assertFalse(report["stopped_early"])
+        self.assertEqual(self.status_of(old), Payment.PaymentStatus.CANCELLED)
+        self.assertEqual(self.status_of(young), Payment.PaymentStatus.PENDING)
+        self.assertEqual({self.status_of(payment) for payment in paid}, {Payment.PaymentStatus.PAID})
+        # Следующий запуск проверяет только оставшийся платеж
+        report = reconcile_pending_payments(max_payments=1, missing_after_hours=4)
+        self.assertEqual((report["processed"], report["missing"], report["cancelled"]), (1, 1, 1))
+
+    def test_bulk_not_found_stops_without_cancelling(self):
+        """Массовые 404 (чужой аккаунт Stripe) прерывают сверку, ничего не отменяя"""
+        missing = [self.missing_payment(timedelta(hours=30)) for _ in range(3)]
+        report = reconcile_pending_payments(batch_size=3)
+        self.assertTrue(report["stopped_early"])
+        self.assertEqual((report["processed"], report["missing"], report["cancelled"]), (3, 3, 0))
+
+        paid = self.pending_payment(timedelta(hours=20), {"payment_status": "paid", "status": "complete"})
+        later = self.pending_payment(timedelta(hours=1), {"payment_status": "paid", "status": "complete"})
+        report = reconcile_pending_payments(batch_size=4)
+        self.assertTrue(report["stopped_early"])
+        self.assertEqual((report["processed"], report["paid"], report["cancelled"]), (4, 1, 0))
+        self.assertEqual({self.status_of(payment) for payment in missing}, {Payment.PaymentStatus.PENDING})
+        self.assertEqual(self.status_of(paid), Payment.PaymentStatus.PAID)
+        self.assertEqual(self.status_of(later), Payment.PaymentStatus.PENDING)
+
+    def test_stops_when_stripe_unavailable(self):
+        payments = [self.pending_payment(timedelta(hours=1)) for _ in range(4)]
+        self.stub.fail_next(100)
+        report = reconcile_pending_payments(batch_size=2)
+        self.assertTrue(report["stopped_early"])
+        self.assertEqual(report["processed"], 2)
+        self.assertEqual({self.status_of(payment) for payment in payments}, {Payment.PaymentStatus.PENDING})
+
+    def test_pending_scan_uses_index(self):
+        prefer_index_scans()
+        plan = pending_payments(timezone.now()).explain()
+        self.assertIn("users_payment_pending_idx", plan)
+
+
+class AsyncPaymentViewsTestCase(StripeStubMixin, TestCase):
+    """Асинхронные view оплаты: ожидание Stripe не блокирует другие запросы"""
+
+    stub_latency = 0.2
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email="payer@test.com", password="testpass123")
+        self.course = Course.objects.create(title="Course", owner=self.user)
+        self.client = AsyncClient()
+
+    def auth(self, user=None):
+        return {"authorization": f"Bearer {AccessToken.for_user(user or self.user)}"}
+
+    def checkout(self, headers=None):
+        return self.client.post(
+            "/api/payments/create/",
+            {"paid_course": self.course.id, "amount": "10.00"},
+            content_type="application/json",
+            headers=self.auth() if headers is None else headers,
+        )
+
+    async def test_concurrent_checkouts(self):
+        """20 оплат с задержкой Stripe 0.2 с выполняются параллельно, а не за 4 с"""
+        self.assertEqual((await self.checkout()).status_code, status.HTTP_201_CREATED)
+        started = time.monotonic()
+        responses = await asyncio.gather(*(self.checkout() for _ in range(20)))
+        elapsed = time.monotonic() - started
+        self.assertEqual({response.status_code for response in responses}, {status.HTTP_201_CREATED})
+        self.assertEqual(len({response.json()["stripe_session_id"] for response in responses}), 20)
+        self.assertLess(elapsed, 2.0)
+        self.assertEqual(await Payment.objects.acount(), 21)
+
+    async def test_authentication(self):
+        response = await self.checkout(headers={})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = await self.checkout(headers={"authorization": "Bearer broken"})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.stub.requests, [])
+
+    async def test_status(self):
+        payment_id = (await self.checkout()).json()["id"]
+        response = await self.client.get(f"/api/payments/{payment_id}/status/", headers=self.auth())
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["payment_status"], Payment.PaymentStatus.PENDING)
+        response = await self.client.get("/api/payments/999999/status/", headers=self.auth())
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        other = await User.objects.acreate(email="other@test.com")
+        response = await self.client.get(f"/api/payments/{payment_id}/status/", headers=self.auth(other))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class PaymentIdempotencyKeyTestCase(StripeStubMixin, TestCase):
+    """Повтор создания платежа с Idempotency-Key не создает второй платеж"""
+
+    stub_latency = 0.1
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email="payer@test.com", password="testpass123")
+        self.course = Course.objects.create(title="Course", owner=self.user)
+        self.client = AsyncClient()
+
+    def checkout(self, key, amount="10.00", user=None):
+        return self.client.post(
+            "/api/payments/create/",
+            {"paid_course": self.course.id, "amount": amount},
+            content_type="application/json",
+            headers={
+                "authorization": f"Bearer {AccessToken.for_user(user or self.user)}",
+                "idempotency-key": key,
+            },
+        )
+
+    async def test_replay_returns_stored_response(self):
+        first = await self.checkout("key-1")
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        replay = await self.checkout("key-1")
+        self.assertEqual(replay.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(replay.json(), first.json())
+        self.assertEqual(replay.headers["Idempotent-Replayed"], "true")
+        self.assertEqual(self.stub.calls("POST", "/v1/checkout/sessions"), 1)
+        self.assertEqual(await Payment.objects.acount(), 1)
+
+    async def test_concurrent_duplicates(self):
+        """Одновременные запросы с одним ключом: один поход в Stripe, один платеж"""
+        responses = await asyncio.gather(*(self.checkout("key-1") for _ in range(3)))
+        self.assertEqual({response.status_code for response in responses}, {status.HTTP_201_CREATED})
+        self.assertEqual(len({response.json()["id"] for response in responses}), 1)
+        self.assertEqual(self.stub.calls("POST", "/v1/checkout/sessions"), 1)
+        self.assertEqual(await Payment.objects.acount(), 1)
+
+    async def test_key_is_scoped(self):
+        """Ключ привязан к телу запроса и к пользователю"""
+        await self.checkout("key-1")
+        response = await self.checkout("key-1", amount="15.00")
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        other = await User.objects.acreate(email="other@test.com")
+        response = await self.checkout("key-1", user=other)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(await Payment.objects.acount(), 2)
+
+    async def test_key_passed_to_stripe(self):
+        await self.checkout("key-1")
+        self.assertEqual(
+            sorted(self.stub._idempotent),
+            [f"payment-create:{self.user.pk}:key-1:{step}" for step in ("price", "product", "session")],
+        )
+
+    async def test_failure_releases_key(self):
+        """После сбоя Stripe ключ свободен, повтор проходит без дубликатов в Stripe"""
+        get_stripe_gateway().max_retries = 0
+        await self.checkout("key-1")
+        self.stub.fail_next(1)
+        response = await self.checkout("key-2")
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertFalse(await IdempotencyKey.objects.filter(key="key-2").aexists())
+        response = await self.checkout("key-2")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(self.stub.sessions), 2)
+
+    async def crash_after_first_attempt(self, key, age):
+        """Первый запрос дошел до платежа, но процесс упал, не сохранив ответ"""
+        first = await self.checkout(key)
+        await IdempotencyKey.objects.filter(key=key).aupdate(
+            response_status=None, response_body=None, created_at=timezone.now() - age
+        )
+        return first
+
+    async def test_stale_reservation_is_reclaimed(self):
+        """Резерв без ответа старше аренды перехватывается повтором; дубликатов нет"""
+        first = await self.crash_after_first_attempt("key-1", timedelta(seconds=LEASE_TIMEOUT + 1))
+        response = await self.checkout("key-1")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn("Idempotent-Replayed", response.headers)
+        self.assertEqual(response.json()["id"], first.json()["id"])
+        # Повтор в Stripe идет с тем же ключом и получает ту же сессию
+        self.assertEqual(len(self.stub.sessions), 1)
+        self.assertEqual(await Payment.objects.acount(), 1)
+        record = await IdempotencyKey.objects.aget(key="key-1")
+        self.assertEqual(record.response_status, status.HTTP_201_CREATED)
+        replay = await self.checkout("key-1")
+        self.assertEqual(replay.headers["Idempotent-Replayed"], "true")
+
+    async def test_live_reservation_is_not_reclaimed(self):
+        """Пока аренда не истекла, повтор ждет и получает 409"""
+        await self.crash_after_first_attempt("key-1", timedelta(seconds=LEASE_TIMEOUT - 30))
+        with mock.patch("users.idempotency.WAIT_TIMEOUT", 0.1):
+            response = await self.checkout("key-1")
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    async def test_previous_owner_loses_reclaimed_key(self):
+        """После перехвата прежний владелец не сохраняет ответ и не освобождает ключ"""
+        record = await IdempotencyKey.objects.acreate(user=self.user, key="key-1", request_fingerprint="x")
+        await IdempotencyKey.objects.filter(pk=record.pk).aupdate(
+            created_at=timezone.now() - timedelta(seconds=LEASE_TIMEOUT + 1)
+        )
+        stale = await IdempotencyKey.objects.aget(pk=record.pk)
+        owner = await IdempotencyKey.objects.aget(pk=record.pk)
+        self.assertTrue(await reclaim_stale_key(owner))
+        self.assertFalse(await reclaim_stale_key(await IdempotencyKey.objects.aget(pk=record.pk)))
+
+        await release_key(stale)
+        self.assertTrue(await IdempotencyKey.objects.filter(pk=record.pk).aexists())
+        await save_response(stale, Response({"id": 1}, status=status.HTTP_201_CREATED))
+        self.assertIsNone((await IdempotencyKey.objects.aget(pk=record.pk)).response_status)
+        await save_response(owner, Response({"id": 2}, status=status.HTTP_201_CREATED))
+        self.assertEqual((await IdempotencyKey.objects.aget(pk=record.pk)).response_body, {"id": 2})
+
+    def test_prune_keys(self):
+        IdempotencyKey.objects.create(user=self.user, key="old", request_fingerprint="x")
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(hours=25))
+        IdempotencyKey.objects.create(user=self.user, key="new", request_fingerprint="x")
+        self.assertEqual(prune_idempotency_keys(), 1)
+        self.assertEqual(list(IdempotencyKey.objects.values_list("key", flat=True)), ["new"])
+
+
+class DeactivateInactiveUsersTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.now = timezone.now()
+
+    def make_user(self, email, last_login_days=None, is_active=True):
+        last_login = self.now - timedelta(days=last_login_days) if last_login_days is not None else None
+        return User.objects.create(email=email, is_active=is_active, last_login=last_login)
+
+    def test_deactivates_stale_users_in_batches(self):
+        """Деактивируются только давно не входившие активные пользователи, пачками"""
+        stale = [self.make_user(f"stale{i}@example.com", 40) for i in range(5)]
+        fresh = self.make_user("fresh@example.com", 1)
+        never = self.make_user("never@example.com")
+        report = deactivate_inactive_users(batch_size=2, sleep=0)
+        self.assertEqual(report["deactivated"], 5)
+        self.assertEqual(report["batches"], 3)
+        self.assertEqual(report["last_pk"], stale[-1].pk)
+        self.assertEqual(User.objects.filter(pk__in=[user.pk for user in stale], is_active=True).count(), 0)
+        self.assertFalse(User.objects.filter(pk__in=[fresh.pk, never.pk], is_active=False).exists())
+        self.assertIsNone(cache.get(DEACTIVATE_CHECKPOINT_KEY))
+
+    def test_each_batch_is_one_update(self):
+        for i in range(4):
+            self.make_user(f"stale{i}@example.com", 40)
+        with CaptureQueriesContext(connection) as ctx:
+            deactivate_inactive_users(batch_size=2, sleep=0)
+        updates = [query for query in ctx.captured_queries if query["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 2)
+
+    def test_user_logging_in_during_batch_keeps_tokens(self):
+        """Пользователь, вошедший между выборкой и UPDATE, остается активным, его токены не отзываются"""
+        stale, racer = self.make_user("stale@example.com", 40), self.make_user("racer@example.com", 40)
+        select_for_update = QuerySet.select_for_update
+
+        def login_before_lock(queryset, *args, **kwargs):
+            User.objects.filter(pk=racer.pk).update(last_login=timezone.now())
+            return select_for_update(queryset, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, "select_for_update", login_before_lock):
+            report = deactivate_inactive_users(sleep=0)
+        self.assertEqual(report["deactivated"], 1)
+        self.assertEqual(set(User.objects.filter(is_active=True).values_list("pk", flat=True)), {racer.pk})
+        self.assertIsNotNone(cache.get(revoked_cache_key(stale.pk)))
+        self.assertIsNone(cache.get(revoked_cache_key(racer.pk)))
+
+    def test_resumes_from_checkpoint(self):
+        """Прерванный проход продолжается с последней обработанной пачки"""
+        first, second = self.make_user("first@example.com", 40), self.make_user("second@example.com", 40)
+        cache.set(DEACTIVATE_CHECKPOINT_KEY, {"last_pk": first.pk, "deactivated": 1})
+        report = deactivate_inactive_users(sleep=0)
+        self.assertEqual(report["resumed_from"], first.pk)
+        self.assertEqual(report["deactivated"], 2)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertTrue(first.is_active)
+        self.assertFalse(second.is_active)
+
+    def test_scan_uses_index(self):
+        prefer_index_scans()
+        threshold = self.now - timedelta(days=30)
+        plan = (
+            User.objects.filter(is_active=True, last_login__lt=threshold, pk__gt=0)
+            .order_by("pk")
+            .values_list("pk", flat=True)[:1000]
+            .explain()
+        )
+        self.assertIn("users_user_active_login_idx", plan)
+
+
+def count_user_queries(queries):
+    return sum(1 for q in queries if 'FROM "users_user"' in q["sql"] or '"auth_group"' in q["sql"])
+
+
+class ClaimsJWTAuthenticationTestCase(APITestCase):
+    """Аутентификация по claims токена и отзыв токенов"""
+
+    def setUp(self):
+        cache.clear()
+        self.group, _ = Group.objects.get_or_create(name=MODERATOR_GROUP)
+        self.user = User.objects.create_user(email="claims@test.com", password="testpass123")
+        Course.objects.create(title="Course", owner=self.user)
+
+    def login(self):
+        response = self.client.post("/api/auth/token/", {"email": "claims@test.com", "password": "testpass123"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def get_courses(self, access):
+        return self.client.get("/api/courses/", headers={"authorization": f"Bearer {access}"})
+
+    def test_token_carries_claims(self):
+        payload = AccessToken(self.login()["access"]).payload
+        self.assertEqual(
+            (payload["is_staff"], payload["is_active"], payload["is_moderator"]), (False, True, False)
+        )
+
+    def test_read_without_auth_queries(self):
+        """Чтение с токеном с claims не обращается к пользователю и группам"""
+        access = self.login()["access"]
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.get_courses(access)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertEqual(count_user_queries(ctx.captured_queries), 0)
+
+    def test_owner_check_with_claims_user(self):
+        """Пользователь из claims равен владельцу объекта"""
+        access = self.login()["access"]
+        course = Course.objects.get()
+        response = self.client.patch(
+            f"/api/courses/{course.pk}/", {"title": "Renamed"}, headers={"authorization": f"Bearer {access}"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_async_view_without_auth_queries(self):
+        access = self.login()["access"]
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get("/api/payments/0/status/", headers={"authorization": f"Bearer {access}"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(count_user_queries(ctx.captured_queries), 0)
+
+    def test_token_without_claims_uses_cache(self):
+        """Токен без claims: пользователь читается из БД один раз, затем из кеша"""
+        access = AccessToken.for_user(self.user)
+        self.get_courses(access)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.get_courses(access)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(count_user_queries(ctx.captured_queries), 0)
+
+    def test_deactivation_is_immediate(self):
+        tokens = self.login()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get_courses(tokens["access"]).status_code, status.HTTP_401_UNAUTHORIZED)
+        refresh = self.client.post("/api/auth/token/refresh/", {"refresh": tokens["refresh"]})
+        self.assertEqual(refresh.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_profile_edit_keeps_tokens(self):
+        """Сохранение без изменения claims токены не отзывает"""
+        access = self.login()["access"]
+        self.user.city = "Moscow"
+        self.user.save()
+        self.assertEqual(self.get_courses(access).status_code, status.HTTP_200_OK)
+
+    def test_task_deactivation_revokes_tokens(self):
+        """deactivate_inactive_users деактивирует через update() и отзывает токены сам"""
+        access = self.login()["access"]
+        User.objects.filter(pk=self.user.pk).update(last_login=timezone.now() - timedelta(days=40))
+        self.assertEqual(deactivate_inactive_users(sleep=0)["deactivated"], 1)
+        self.assertEqual(self.get_courses(access).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_role_change_requires_refresh(self):
+        """Новая роль: старый access-токен отозван, refresh выдает токен с новой ролью"""
+        tokens = self.login()
+        self.user.groups.add(self.group)
+        self.assertEqual(self.get_courses(tokens["access"]).status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.post("/api/auth/token/refresh/", {"refresh": tokens["refresh"]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(AccessToken(response.data["access"])["is_moderator"])
+        self.assertEqual(self.get_courses(response.data["access"]).status_code, status.HTTP_200_OK)
+
+    def test_refresh_rotation(self):
+        """С ROTATE_REFRESH_TOKENS refresh возвращает и новый refresh-токен, access — с claims"""
+        tokens = self.login()
+        # override_settings здесь не поможет: модули simplejwt держат ссылку на прежний api_settings
+        with mock.patch.object(jwt_settings, "ROTATE_REFRESH_TOKENS", True):
+            response = self.client.post("/api/auth/token/refresh/", {"refresh": tokens["refresh"]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response.data["refresh"], tokens["refresh"])
+        self.assertFalse(AccessToken(response.data["access"])["is_moderator"])
+        self.assertEqual(self.get_courses(response.data["access"]).status_code, status.HTTP_200_OK)
+        response = self.client.post("/api/auth/token/refresh/", {"refresh": response.data["refresh"]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn("refresh", response.data)
+
+    def test_refresh_for_deleted_user(self):
+        tokens = self.login()
+        self.user.delete()
+        response = self.client.post("/api/auth/token/refresh/", {"refresh": tokens["refresh"]})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.get_courses(tokens["access"]).status_code, status.HTTP_401_UNAUTHORIZED)
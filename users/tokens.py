@@ -0,0 +1,99 @@
+"""
+Claims пользователя в JWT и отзыв выданных токенов.
+
+Access-токен несет id пользователя, is_staff, is_active и роль модератора,
+поэтому ClaimsJWTAuthentication не читает пользователя из БД. Claims верны
+на момент выдачи токена; если они меняются (деактивация, is_staff, группа
+модераторов, удаление), все ранее выданные токены пользователя отзываются:
+в кеш пишется время отзыва, и токены, claims которых прочитаны раньше,
+отклоняются. Запись живет столько же, сколько access-токен, — дольше старые
+токены не проживут. Новый access-токен с актуальными claims выдает
+/api/auth/token/refresh/.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+
+from users.models import User
+from users.permissions import is_moderator
+
+# Claims, которых достаточно для аутентификации и проверки прав
+USER_CLAIMS = ("is_staff", "is_active", "is_moderator", "claims_at")
+
+
+def user_claims(user):
+    return {
+        "is_staff": user.is_staff,
+        "is_active": user.is_active,
+        "is_moderator": is_moderator(user),
+        # Время чтения claims с долями секунды: iat целый, и по нему токен,
+        # выданный в ту же секунду после отзыва, не отличить от отозванного
+        "claims_at": time.time(),
+    }
+
+
+def revoked_cache_key(user_id):
+    return f"users:tokens-revoked:{user_id}"
+
+
+def revoke_user_tokens(user_ids):
+    """
+    Отзывает все выданные до этого момента токены пользователей. Отзыв
+    повторяется после коммита: refresh, прочитавший claims до коммита
+    изменения, выдаст токен, который тоже будет отозван.
+    """
+    user_ids = list(user_ids)
+    _revoke(user_ids)
+    transaction.on_commit(lambda: _revoke(user_ids))
+
+
+def _revoke(user_ids):
+    revoked_at = time.time()
+    timeout = int(api_settings.ACCESS_TOKEN_LIFETIME.total_seconds()) + 1
+    cache.set_many({revoked_cache_key(user_id): revoked_at for user_id in user_ids}, timeout)
+
+
+def is_token_revoked(validated_token, revoked_at):
+    """revoked_at — значение из кеша по revoked_cache_key"""
+    if revoked_at is None:
+        return False
+    # У токенов без claims есть только целый iat — в секунду отзыва они тоже отклоняются
+    return validated_token.get("claims_at", validated_token.get("iat", 0)) <= revoked_at
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """Выдает пару токенов с claims пользователя"""
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token.payload.update(user_claims(user))
+        return token
+
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Выдает access-токен с claims, прочитанными из БД заново: после отзыва
+    токенов пользователь получает актуальные роль и флаги через refresh.
+    Ротацию refresh-токена (ROTATE_REFRESH_TOKENS, BLACKLIST_AFTER_ROTATION)
+    выполняет родительский validate().
+    """
+
+    def validate(self, attrs):
+        # Access-токен выпускается до validate() родителя: после ротации с
+        # черным списком прежний refresh-токен уже не прочитать
+        refresh = self.token_class(attrs["refresh"])
+        user_id = refresh.payload.get(api_settings.USER_ID_CLAIM)
+        user = User.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).first()
+        if user is None or not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(self.error_messages["no_active_account"], "no_active_account")
+        access = refresh.access_token
+        access.payload.update(user_claims(user))
+
+        data = super().validate(attrs)
+        data["access"] = str(access)
+        return data
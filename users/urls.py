@@ -1,7 +1,7 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from users.payment_views import PaymentCreateView, PaymentStatusView
+from users.payment_views import PaymentCreateView, PaymentStatusView, StripeWebhookView
 from users.views import PaymentListView, UserProfileView, UserRegisterView, UserViewSet
 
 router = DefaultRouter()
@@ -12,6 +12,7 @@ urlpatterns = [
     path("payments/", PaymentListView.as_view(), name="payment-list"),
     path("payments/create/", PaymentCreateView.as_view(), name="payment-create"),
     path("payments/<int:pk>/status/", PaymentStatusView.as_view(), name="payment-status"),
+    path("payments/webhook/", StripeWebhookView.as_view(), name="payment-webhook"),
     path("users/<int:pk>/", UserProfileView.as_view(), name="user-profile"),
     path("auth/register/", UserRegisterView.as_view(), name="user-register"),
 ]
@@ -4,8 +4,11 @@ from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 
+from lms.mixins import RowListMixin
+from users.filters import PaymentFilter
 from users.models import Payment, User
-from users.permissions import IsModerator, IsSelfOrAdmin
+from users.paginators import PaymentKeysetPagination
+from users.permissions import IsSelfOrAdmin, is_moderator
 from users.serializers import (
     PaymentSerializer,
     UserProfileSerializer,
@@ -14,18 +17,30 @@ from users.serializers import (
 )
 
 
-class PaymentListView(generics.ListAPIView):
+class PaymentListView(RowListMixin, generics.ListAPIView):
+    """
+    История платежей с keyset-пагинацией (`?cursor=`, `?page_size=`).
+
+    `?ordering=payment_date` меняет направление; фильтры — см. PaymentFilter.
+    """
     serializer_class = PaymentSerializer
+    pagination_class = PaymentKeysetPagination
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
-    filterset_fields = ["paid_course", "paid_lesson", "payment_method"]
+    filterset_class = PaymentFilter
     ordering_fields = ["payment_date"]
     ordering = ["-payment_date"]
     permission_classes = [IsAuthenticated]
 
+    @property
+    def keyset_ordering(self):
+        # Порядок задает пагинатор: (payment_date, id) в направлении из ?ordering=
+        requested = self.request.query_params.get("ordering")
+        return requested if requested in ("payment_date", "-payment_date") else "-payment_date"
+
     def get_queryset(self):
         qs = Payment.objects.select_related("user", "paid_course", "paid_lesson").all()
         user = self.request.user
-        if IsModerator().has_permission(self.request, self):
+        if is_moderator(user):
             return qs
         return qs.filter(user=user)
 
@@ -0,0 +1,75 @@
+"""
+Обработка вебхуков Stripe: статус платежа меняется по событиям его сессии оплаты.
+
+Stripe доставляет события хотя бы один раз, в произвольном порядке и с
+повторами. Поэтому каждое событие записывается в StripeEvent в той же
+транзакции, что и изменение платежа: повторная доставка ничего не меняет,
+а сбой обработки откатывает и запись события, и Stripe доставит его снова.
+"""
+import stripe
+from django.db import transaction
+
+from users.models import Payment, StripeEvent
+
+# Статус платежа по событию сессии; None — по полю payment_status самой сессии
+SESSION_EVENT_STATUSES = {
+    "checkout.session.completed": None,
+    "checkout.session.async_payment_succeeded": Payment.PaymentStatus.PAID,
+    "checkout.session.async_payment_failed": Payment.PaymentStatus.CANCELLED,
+    "checkout.session.expired": Payment.PaymentStatus.CANCELLED,
+}
+
+
+class WebhookSignatureError(Exception):
+    """Тело запроса не разобрано или подпись Stripe-Signature не сошлась"""
+
+
+def construct_event(payload: bytes, signature: str, secret: str):
+    """Проверяет подпись (и ее давность) и возвращает событие Stripe"""
+    try:
+        return stripe.Webhook.construct_event(payload, signature, secret)
+    except (ValueError, stripe.SignatureVerificationError) as e:
+        raise WebhookSignatureError(str(e)) from e
+
+
+def session_payment_status(session):
+    """Статус платежа по сессии оплаты Stripe"""
+    if session.get("payment_status") in ("paid", "no_payment_required"):
+        return Payment.PaymentStatus.PAID
+    if session.get("status") == "expired":
+        return Payment.PaymentStatus.CANCELLED
+    # Сессия открыта или оплачена способом с отложенным подтверждением
+    return Payment.PaymentStatus.PENDING
+
+
+def apply_session_status(session_id, payment_status):
+    """
+    Переводит платеж сессии session_id в статус payment_status.
+
+    Строка платежа блокируется, чтобы одновременные события одной сессии
+    применялись по очереди. Оплаченный платеж запоздавшие события не
+    отменяют. Возвращает платеж или None, если платежа с такой сессией нет.
+    """
+    payment = Payment.objects.select_for_update().filter(stripe_session_id=session_id).first()
+    if payment is None or payment.payment_status in (payment_status, Payment.PaymentStatus.PAID):
+        return payment
+    payment.payment_status = payment_status
+    # save(), а не update(): сигнал учитывает оплату в сводной статистике курса
+    payment.save(update_fields=["payment_status"])
+    return payment
+
+
+def handle_stripe_event(event):
+    """
+    Применяет событие, если оно еще не обрабатывалось.
+    Возвращает False для повторной доставки.
+    """
+    with transaction.atomic():
+        _, created = StripeEvent.objects.get_or_create(event_id=event["id"], defaults={"type": event["type"]})
+        if not created:
+            return False
+        if event["type"] in SESSION_EVENT_STATUSES:
+            session = event["data"]["object"]
+            payment_status = SESSION_EVENT_STATUSES[event["type"]] or session_payment_status(session)
+            apply_session_status(session["id"], payment_status)
+    return True